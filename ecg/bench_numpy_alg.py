@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the NumPy ECG analysis backend
+
+Runs NumpyEcgAlg over synthetic ECG (synthetic.SyntheticECG) in blocks of each
+--blocks size, and one sample at a time through tg_ecg_update as the C library is
+driven, and reports the speed in multiples of realtime (512 Hz). The request was
+at least 100x realtime on one core in blocks.
+
+    python -m ecg.bench_numpy_alg --seconds 120 --blocks 64 512 4096
+"""
+
+import argparse
+import time
+
+from .numpy_alg import NumpyEcgAlg
+from .synthetic import SyntheticECG
+
+
+def realtime_factor(raw, block, Fs=512):
+    """ seconds of ECG analyzed per second, block samples at a time (0: per sample) """
+    alg = NumpyEcgAlg(Fs)
+    start = time.perf_counter()
+    if block:
+        for i in range(0, len(raw), block):
+            alg.process_block(raw[i:i + block])
+    else:
+        for x in raw:
+            alg.tg_ecg_update(x)
+    return len(raw) / float(Fs) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=120., help="seconds of ECG to analyze")
+    parser.add_argument("--blocks", type=int, nargs="+", default=[64, 512, 4096], help="block sizes, in samples")
+    parser.add_argument("--per-sample", action="store_true", help="also time tg_ecg_update, one sample at a time")
+    args = parser.parse_args()
+
+    raw, _leadoff = SyntheticECG(seed=0).generate(int(args.seconds * 512))
+    for block in args.blocks:
+        print("blocks of %5i samples: %8.0fx realtime" % (block, realtime_factor(raw, block)))
+    if args.per_sample:
+        print("one sample at a time:  %8.0fx realtime" % realtime_factor(raw[:512 * 10], 0))
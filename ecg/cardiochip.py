@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+CardioChip serial protocol
+
+Constants and framing helpers for the NeuroSky CardioChip (BMD101) packet stream.
+Every packet on the wire has the form
+
+    SYNC_BYTE SYNC_BYTE pLength payload[pLength] checksum
+
+where checksum is the ones complement inverse of the 8-bit payload sum.
+"""
+
+import logging
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+SYNC_BYTE = 0xAA  # NOTE: this used to be 0x77!!! change this in the documentation
+EXCODE_BYTE = 0x55
+# single-byte codes
+SENSOR_STATUS = 0x02
+HEART_RATE = 0x03
+CONFIG_BYTE = 0x08
+# multi-byte codes
+RAW_ECG = 0x80
+DEBUG_1 = 0x84  # not used
+DEBUG_2 = 0x85  # not used
+
+MAX_PAYLOAD_LENGTH = 169  # packets announcing a longer payload are rejected
+
+_SYNC_PAIR = bytes([SYNC_BYTE, SYNC_BYTE])
+
+# one row per raw ecg sample, as returned by CardioChipDecoder.decode()
+SAMPLE_DTYPE = np.dtype([
+    ('timestamp', np.float64),  # unix epoch seconds
+    ('ecg_raw', np.int16),
+    ('leadoff', np.uint8),  # most recent SENSOR_STATUS value, 0==no contact, 200==contact
+    ('hr', np.uint8),  # most recent HEART_RATE value reported by the chip
+])
+
+
+def payload_checksum(payload):
+    """ ones complement inverse of 8-bit payload sum """
+    return ~sum(payload) & 0xFF
+
+
+class FrameScanner(object):
+    """
+    Pulls CardioChip packets out of arbitrary chunks of the serial byte stream.
+
+    Bytes are copied into one reusable bytearray and scanned in place; a packet
+    that is cut off at the end of a chunk stays in the buffer until the rest of
+    it arrives with the next feed(). Sync, length and checksum handling follow the
+    byte-at-a-time reader in NeuroskyECG._read_cardiochip, so both readers accept
+    and reject exactly the same packets.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._start = 0  # first unscanned byte
+        self._end = 0  # one past the last valid byte
+        self.checksum_errors = 0
+        self.length_errors = 0
+
+    def __len__(self):
+        """ number of buffered bytes that have not been consumed yet """
+        return self._end - self._start
+
+    def reset(self):
+        """ drop any buffered partial packet """
+        self._start = self._end = 0
+
+    def feed(self, data):
+        """
+        append a chunk of raw serial bytes and return the list of complete,
+        checksum-verified payloads (as bytes) found so far
+        """
+        n = len(data)
+        if self._end + n > self.capacity:
+            # slide the unconsumed tail back to the front before appending
+            pending = self._end - self._start
+            if pending + n > self.capacity:
+                # grow rather than drop bytes; only happens if feed() is handed
+                # a chunk larger than the buffer
+                self.capacity = pending + n
+                self._buf.extend(bytes(self.capacity - len(self._buf)))
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        self._buf[self._end:self._end + n] = data
+        self._end += n
+        return self._scan()
+
+    def _scan(self):
+        buf = self._buf
+        pos, end = self._start, self._end
+        out = []
+        while True:
+            pos = buf.find(_SYNC_PAIR, pos, end)
+            if pos < 0:
+                # keep a trailing sync byte, it may pair up with the next chunk
+                pos = end - 1 if end > self._start and buf[end - 1] == SYNC_BYTE else end
+                break
+            # parse length byte, extra sync bytes are skipped
+            lpos = pos + 2
+            while lpos < end and buf[lpos] == SYNC_BYTE:
+                lpos += 1
+            if lpos >= end:
+                break  # length byte not here yet
+            pLength = buf[lpos]
+            if pLength > MAX_PAYLOAD_LENGTH:
+                self.length_errors += 1
+                pos = lpos + 1
+                continue
+            chkpos = lpos + 1 + pLength
+            if chkpos >= end:
+                break  # partial packet, wait for the rest
+            payload = bytes(buf[lpos + 1:chkpos])
+            chk = buf[chkpos]
+            pos = chkpos + 1
+            checksum = payload_checksum(payload)
+            if chk != checksum:
+                self.checksum_errors += 1
+                log.warning("checksum error, %i != %i", chk, checksum, extra={'rate_limited': True})
+                continue
+            out.append(payload)
+
+        if pos >= end:
+            self._start = self._end = 0
+        else:
+            self._start = pos
+        return out
+
+
+def iter_codes(payload):
+    """
+    walk the code/value rows of a single payload, yielding (code, value) where
+    value is the bytes following the code (and its length byte, for multi-byte codes)
+    """
+    bytesParsed = 0
+    n = len(payload)
+    while bytesParsed < n:
+        code = payload[bytesParsed]
+        bytesParsed += 1
+        if code > 0x7F:
+            # multi-byte code, length > 1
+            if bytesParsed >= n:
+                return
+            length = payload[bytesParsed]
+            bytesParsed += 1
+        else:
+            length = 1
+        yield code, payload[bytesParsed:bytesParsed + length]
+        bytesParsed += length
+
+
+class CardioChipDecoder(object):
+    """
+    Decodes many verified CardioChip payloads at once into a SAMPLE_DTYPE array.
+
+    The packets the chip sends at 512 Hz are all of the form
+    RAW_ECG 0x02 high low, so those are picked out and decoded with array
+    operations; the few other packets (sensor status, heart rate, about one a second)
+    go through iter_codes(). Lead status and heart rate are carried forward onto
+    every following sample, including across calls.
+
+    Without a clock, timestamps start at the host time of the first decoded sample
+    and advance by 1/Fs per sample, the same scheme as NeuroskyECG._parseData. With
+    a clocksync.SampleClock they come from its drift corrected fit instead.
+    """
+
+    def __init__(self, Fs=512, clock=None):
+        self.Fs = Fs
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        """ forget the time base and the carried lead status/heart rate """
+        self.restart_clock()
+        self.leadoff = 0
+        self.hr = 0
+
+    def restart_clock(self):
+        """ take the host time of the next decoded sample as the new time base """
+        self.starttime = None
+        self.sample_index = 0  # number of samples decoded since starttime
+        if self.clock is not None:
+            self.clock.reset()  # its fit and sample count belong to the old time base
+
+    def decode(self, payloads):
+        """
+        decode a sequence of payloads (e.g. the output of FrameScanner.feed)
+        and return a SAMPLE_DTYPE array with one row per raw ecg sample
+        """
+        nframes = len(payloads)
+        if nframes == 0:
+            return np.zeros(0, dtype=SAMPLE_DTYPE)
+        lengths = np.fromiter(map(len, payloads), dtype=np.intp, count=nframes)
+        data = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+        offsets = np.cumsum(lengths) - lengths
+
+        # fast path: the plain 4 byte raw ecg packets
+        is_raw = lengths == 4
+        raw_offsets = offsets[is_raw]
+        is_raw[is_raw] = (data[raw_offsets] == RAW_ECG) & (data[raw_offsets + 1] == 2)
+        raw_frames = np.flatnonzero(is_raw)
+        raw_offsets = offsets[raw_frames]
+        # raw value is between -32768 and 32767, in twos compliment form
+        raw = ((data[raw_offsets + 2].astype(np.uint16) << 8) | data[raw_offsets + 3]).view(np.int16)
+
+        # slow path: everything else
+        extra_frames, extra_raw = [], []
+        status_frames, status_values = [], []
+        hr_frames, hr_values = [], []
+        for f in np.flatnonzero(~is_raw):
+            for code, value in iter_codes(payloads[f]):
+                if not value:
+                    continue
+                if code == SENSOR_STATUS:
+                    status_frames.append(f)
+                    status_values.append(value[0])
+                elif code == HEART_RATE:
+                    hr_frames.append(f)
+                    hr_values.append(value[0])
+                elif code == RAW_ECG and len(value) >= 2:
+                    extra_frames.append(f)
+                    extra_raw.append(((value[0] << 8) | value[1]) - (0x10000 if value[0] & 0x80 else 0))
+
+        if extra_frames:
+            sample_frames = np.concatenate([raw_frames, extra_frames])
+            raw = np.concatenate([raw, np.array(extra_raw, dtype=np.int16)])
+            order = np.argsort(sample_frames, kind='stable')
+            sample_frames, raw = sample_frames[order], raw[order]
+        else:
+            sample_frames = raw_frames
+
+        out = np.empty(len(raw), dtype=SAMPLE_DTYPE)
+        out['ecg_raw'] = raw
+        # a status or heart rate row applies to the samples in its own packet and after
+        self.leadoff = self._carry(out['leadoff'], sample_frames, status_frames, status_values, self.leadoff)
+        self.hr = self._carry(out['hr'], sample_frames, hr_frames, hr_values, self.hr)
+
+        if len(out):
+            if self.clock is not None:
+                out['timestamp'] = self.clock.stamp(len(out))
+                if self.starttime is None:
+                    self.starttime = float(out['timestamp'][0])
+            else:
+                if self.starttime is None:
+                    self.starttime = time.time()
+                n = self.sample_index + np.arange(len(out))
+                out['timestamp'] = self.starttime + n / float(self.Fs)
+            self.sample_index += len(out)
+        return out
+
+    @staticmethod
+    def _carry(column, sample_frames, event_frames, event_values, previous):
+        """
+        fill column with the latest event value at or before each sample's frame,
+        and return the value to carry into the next call
+        """
+        if not event_frames:
+            column[:] = previous
+            return previous
+        values = np.array([previous] + event_values, dtype=column.dtype)
+        column[:] = values[np.searchsorted(event_frames, sample_frames, side='right')]
+        return event_values[-1]
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Host/device clock reconciliation for ECG samples
+
+Counting samples at a nominal 512 Hz from the first one drifts: the CardioChip's
+crystal is not exactly 512 Hz, and samples lost over bluetooth shift every later
+timestamp. SampleClock instead fits the arrival of the samples on the host against
+their index with a windowed linear regression, so the sample period and the offset
+are re-estimated continuously. A chunk that arrives carrying clearly fewer samples
+than the fit says should have arrived by then is only suspected of a drop: if the
+samples behind it catch up (a stall in the OS or USB stack that delivers them all
+late, in a burst) it was latency. If they are still short confirm seconds later, it
+is counted as a drop, and the sample index skips ahead over the lost samples so the
+timestamps after it stay right. Arrivals under suspicion are kept out of the fit.
+
+The fit runs on time.monotonic(), which never jumps, and the timestamps come out in
+unix epoch seconds, the clock MuseConnect._timestamp uses for the EEG, so ECG and
+EEG can be compared directly.
+"""
+
+from collections import deque
+import logging
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class SampleClock(object):
+    """
+    Timestamps for a stream of samples from a device with its own clock.
+
+    Fs          nominal sample rate in Hz
+    window      seconds of arrivals the regression is fitted over
+    min_span    seconds of arrivals needed before the fitted rate is used; until
+                then samples are spaced at the nominal rate
+    gap         a chunk arriving this many seconds worth of samples short of the
+                fit is suspected of a drop
+    confirm     seconds of arrivals a suspected drop has to last to count; if the
+                samples catch up before then, it was only latency
+    max_skew    fitted rates further than this fraction from Fs are clamped
+    """
+
+    MIN_POINT_INTERVAL = 0.01  # arrivals closer together than this share a regression point
+
+    def __init__(self, Fs=512, window=60., min_span=5., gap=0.1, confirm=0.5, max_skew=0.02):
+        self.Fs = Fs
+        self.window = window
+        self.min_span = min_span
+        self.gap = gap
+        self.confirm = confirm
+        self.max_skew = max_skew
+        self.reset()
+
+    def reset(self):
+        """ forget the fit, the sample count and the drop counters """
+        # offset from the monotonic clock the fit runs on to unix epoch time
+        self.epoch_offset = time.time() - time.monotonic()
+        self.sample_index = 0  # device index of the next sample, including lost ones
+        self.dropped = 0  # samples detected as lost
+        self.drops = 0  # number of gaps those came in
+        self.last_timestamp = None
+        self._points = deque()  # (sample index, monotonic arrival) pairs in the window
+        self._origin = None  # (index, arrival) the sums are taken relative to
+        self._sums = np.zeros(5)  # n, sum x, sum y, sum xx, sum xy
+        self._evicted = 0  # points dropped from the sums since the origin was set
+        self._suspect_since = None  # arrival that first came in short of the fit
+        self._suspect_missing = []  # how short each arrival since then came in
+
+    # ---- regression ------------------------------------------------------------------
+
+    def _add_point(self, index, arrival):
+        if self._origin is None:
+            self._origin = (index, arrival)
+        x, y = index - self._origin[0], arrival - self._origin[1]
+        self._points.append((index, arrival))
+        self._sums += (1., x, y, x * x, x * y)
+        while arrival - self._points[0][1] > self.window:
+            old_index, old_arrival = self._points.popleft()
+            x, y = old_index - self._origin[0], old_arrival - self._origin[1]
+            self._sums -= (1., x, y, x * x, x * y)
+            self._evicted += 1
+        if self._evicted > len(self._points):
+            self._rebase()
+
+    def _rebase(self):
+        """
+        recompute the sums relative to the oldest point in the window; done once per
+        window turnover so the running sums never grow large enough to lose precision
+        """
+        self._origin = self._points[0]
+        self._sums[:] = 0.
+        for index, arrival in self._points:
+            x, y = index - self._origin[0], arrival - self._origin[1]
+            self._sums += (1., x, y, x * x, x * y)
+        self._evicted = 0
+
+    def _settled(self):
+        return bool(self._points) and self._points[-1][1] - self._points[0][1] >= self.min_span
+
+    def fit(self):
+        """
+        return (period, intercept): the fitted seconds per sample and the monotonic
+        arrival time of sample index 0, or None before the first arrival
+        """
+        if self._origin is None:
+            return None
+        n, sx, sy, sxx, sxy = self._sums
+        nominal = 1. / self.Fs
+        period = nominal
+        if self._settled():
+            var = sxx - sx * sx / n
+            if var > 0:
+                period = (sxy - sx * sy / n) / var
+                period = min(max(period, nominal * (1 - self.max_skew)), nominal * (1 + self.max_skew))
+        intercept = (sy - period * sx) / n
+        return period, self._origin[1] + intercept - period * self._origin[0]
+
+    def sample_rate(self):
+        """ the device sample rate the fit currently implies, in Hz """
+        fitted = self.fit()
+        return self.Fs if fitted is None else 1. / fitted[0]
+
+    # ---- timestamps ------------------------------------------------------------------
+
+    def stamp(self, n, arrival=None):
+        """
+        account for n samples that have just arrived (at monotonic time arrival,
+        default now) and return their unix epoch timestamps as a float64 array
+        """
+        if arrival is None:
+            arrival = time.monotonic()
+        if n == 0:
+            return np.zeros(0)
+        return self._stamp(n, arrival)
+
+    def _stamp(self, n, arrival):
+        if self._settled():
+            fitted = self.fit()
+            # the fit says this many samples should have arrived by now
+            expected = (arrival - fitted[1]) / fitted[0]
+            missing = expected - (self.sample_index + n)
+            if missing <= self.gap * self.Fs:
+                self._suspect_since = None  # on time, or caught up: it was latency
+                self._suspect_missing = []
+            else:
+                if self._suspect_since is None:
+                    self._suspect_since = arrival
+                self._suspect_missing.append(missing)
+            if self._suspect_since is not None and arrival - self._suspect_since >= self.confirm:
+                # averaged over the arrivals, so the jitter of any one does not shift the rest
+                missing = int(round(np.mean(self._suspect_missing)))
+                log.warning("ECG clock: %i samples lost (index %i)", missing, self.sample_index)
+                self.dropped += missing
+                self.drops += 1
+                self.sample_index += missing
+                self._suspect_since = None
+                self._suspect_missing = []
+
+        last = self.sample_index + n - 1
+        if self._suspect_since is None and (
+                not self._points or arrival - self._points[-1][1] >= self.MIN_POINT_INTERVAL):
+            self._add_point(last, arrival)
+        period, intercept = self.fit()
+        index = self.sample_index + np.arange(n)
+        ts = self.epoch_offset + intercept + period * index
+        if self.last_timestamp is not None:
+            # a refit can move the line back a little; never step backwards in time
+            ts = np.maximum(ts, self.last_timestamp)
+        self.sample_index += n
+        self.last_timestamp = float(ts[-1])
+        return ts
+
+    def stamp_one(self, arrival=None):
+        """ stamp a single sample, returning its timestamp as a float """
+        return float(self.stamp(1, arrival)[0])
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming heart rate variability
+
+StreamingHRV is fed one RR interval per detected beat and keeps SDNN, RMSSD and
+pNN50 over a sliding window of the most recent intervals. Running sums over a
+bounded deque make every update and every query constant time, however long the
+session runs, instead of recomputing over the whole window on each beat.
+
+The window ramps up like the HRV in NeuroskyECG: no statistics until min_window
+intervals have arrived, then the window grows with every beat up to max_window.
+That state lives in the object, so it carries across analysis calls and only
+starts over on reset().
+"""
+
+from collections import deque
+import math
+
+
+class StreamingHRV(object):
+    """
+    sliding window SDNN / RMSSD / pNN50 over RR intervals in milliseconds
+
+    min_window  intervals needed before any statistic is reported
+    max_window  the window stops growing at this many intervals
+    nn_ms       threshold for pNN (50 ms gives pNN50)
+    """
+
+    def __init__(self, min_window=15, max_window=30, nn_ms=50):
+        if not 2 <= min_window <= max_window:
+            raise ValueError("need 2 <= min_window <= max_window, got {} and {}".format(min_window, max_window))
+        self.min_window = min_window
+        self.max_window = max_window
+        self.nn_ms = nn_ms
+        self.reset()
+
+    def reset(self):
+        """ forget every interval, the window ramps up from min_window again """
+        self._rri = deque(maxlen=self.max_window)
+        self._diff = deque(maxlen=self.max_window - 1)  # successive differences within the window
+        self._sum = 0.
+        self._sumsq = 0.
+        self._diff_sumsq = 0.
+        self._nn = 0  # successive differences larger than nn_ms
+        self.count = 0  # intervals added since the last reset
+
+    def add(self, rri):
+        """ add the next RR interval (ms) """
+        rri = float(rri)
+        if len(self._rri) == self._rri.maxlen:
+            old = self._rri[0]
+            self._sum -= old
+            self._sumsq -= old * old
+            if self._diff:
+                d = self._diff[0]
+                self._diff_sumsq -= d * d
+                self._nn -= abs(d) > self.nn_ms
+        if self._rri:
+            d = rri - self._rri[-1]
+            self._diff.append(d)  # drops the oldest difference along with the oldest interval
+            self._diff_sumsq += d * d
+            self._nn += abs(d) > self.nn_ms
+        self._rri.append(rri)
+        self._sum += rri
+        self._sumsq += rri * rri
+        self.count += 1
+
+    def __len__(self):
+        """ number of intervals currently in the window """
+        return len(self._rri)
+
+    def ready(self):
+        """ True once the window holds at least min_window intervals """
+        return len(self._rri) >= self.min_window
+
+    def mean(self):
+        """ mean RR interval in ms, or -1 before the window is ready """
+        if not self.ready():
+            return -1
+        return self._sum / len(self._rri)
+
+    def sdnn(self):
+        """ sample standard deviation of the RR intervals in ms, or -1 """
+        if not self.ready():
+            return -1
+        n = len(self._rri)
+        var = (self._sumsq - self._sum * self._sum / n) / (n - 1)
+        return math.sqrt(max(var, 0.))  # running sums can go a hair below zero
+
+    def rmssd(self):
+        """ root mean square of the successive differences in ms, or -1 """
+        if not self.ready():
+            return -1
+        return math.sqrt(max(self._diff_sumsq, 0.) / len(self._diff))
+
+    def pnn50(self):
+        """ percentage of successive differences larger than nn_ms, or -1 """
+        if not self.ready():
+            return -1
+        return 100. * self._nn / len(self._diff)
+
+    def get(self, metric):
+        """ look a statistic up by name: 'sdnn', 'rmssd', 'pnn50' or 'mean' """
+        if metric not in ('sdnn', 'rmssd', 'pnn50', 'mean'):
+            raise ValueError("unknown HRV metric: {}".format(metric))
+        return getattr(self, metric)()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Several CardioChips in one process
+
+NeuroskyECG.start() gives every chip a blocking reader thread. CardioChipIngest
+instead reads all of them from a single asyncio event loop: each port is polled
+for whatever bytes are waiting, which never blocks, and the bytes go through the
+chip's own NeuroskyECG.feed_bytes (FrameScanner, CardioChipDecoder, SampleClock)
+into that chip's ecg_buffer. Everything downstream (analyze_block, main.ecg_real)
+works per device exactly as with a threaded reader.
+
+    ingest = CardioChipIngest()
+    ingest.add_device('booth-1', 'COM7', backend='numpy')
+    ingest.add_device('booth-2', 'COM8', backend='numpy')
+    ingest.start()  # or: await ingest.run() on an existing loop
+    samples = ingest.buffers['booth-1'].drain()
+
+Polling works the same for serial.Serial on any platform and for the ReplaySerial
+and SyntheticSerial stand-ins. At 512 Hz a chip sends about 4 kB/s, so the
+default 5 ms poll picks up a couple of dozen bytes per device per pass.
+
+If reading a port fails (SerialException when a chip is unplugged, say) that
+device's reader ends: the error is logged, kept in errors[device id], and the
+device's check() goes False. The other devices go on being read.
+"""
+
+import asyncio
+import logging
+import threading
+
+from .neurosky_ecg import NeuroskyECG
+
+log = logging.getLogger(__name__)
+
+
+class CardioChipIngest(object):
+    """
+    reads many CardioChips on one asyncio event loop, one NeuroskyECG per device
+    """
+
+    def __init__(self, poll_interval=0.005, max_read=4096):
+        self.poll_interval = poll_interval  # seconds between polls of an idle port
+        self.max_read = max_read  # bytes taken from a port in one go
+        self.devices = {}  # device id -> NeuroskyECG
+        self.errors = {}  # device id -> the exception that ended its reader
+        self.running = False
+        self.loop = None
+        self._thread = None
+        self._tasks = set()  # a reader task per device, kept until it ends
+
+    @property
+    def buffers(self):
+        """ device id -> that device's SampleRingBuffer """
+        return {device_id: nsk.ecg_buffer for device_id, nsk in self.devices.items()}
+
+    def add_device(self, device_id, port, **kwargs):
+        """
+        open a CardioChip on port (anything NeuroskyECG accepts) under device_id and
+        return its NeuroskyECG; the keyword arguments go to NeuroskyECG as well
+        """
+        if device_id in self.devices:
+            raise ValueError("device id already in use: {}".format(device_id))
+        nsk = NeuroskyECG(port, chunked=True, device_id=device_id, **kwargs)
+        return self.add(nsk)
+
+    def add(self, nsk):
+        """ read an already created NeuroskyECG (not started) on this loop """
+        self.devices[nsk.device_id] = nsk
+        nsk.connected = True  # check() reports the device as being read; nsk.stop() ends it
+        if self.running:
+            self.loop.call_soon_threadsafe(self._spawn, nsk)
+        return nsk
+
+    def _spawn(self, nsk):
+        """ start the reader task for nsk, on the loop """
+        task = self.loop.create_task(self._read_device(nsk))
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._reader_done(nsk, t))
+
+    def _reader_done(self, nsk, task):
+        self._tasks.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        exc = task.exception()
+        self.errors[nsk.device_id] = exc
+        nsk.connected = False
+        log.error("CardioChip %s: reading failed, device disconnected: %r", nsk.device_id, exc, exc_info=exc)
+
+    async def _read_device(self, nsk):
+        ser = nsk.ser
+        while self.running and nsk.connected:
+            waiting = ser.in_waiting
+            if not waiting:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            nsk.feed_bytes(ser.read(min(waiting, self.max_read)))
+            await asyncio.sleep(0)  # let the other devices have a turn
+
+    async def run(self):
+        """ read every device until stop() is called """
+        self.loop = asyncio.get_running_loop()
+        self.running = True
+        for nsk in list(self.devices.values()):
+            self._spawn(nsk)
+        while self.running:
+            await asyncio.sleep(0.1)
+
+    def start(self):
+        """ run the event loop in a daemon thread """
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),))
+        self._thread.daemon = True
+        self._thread.start()
+        log.info("Started CardioChip ingest for %i devices", len(self.devices))
+
+    def stop(self):
+        """ stop reading and close any capture files """
+        self.running = False
+        for nsk in self.devices.values():
+            nsk.stop()
+        if self._thread is not None:
+            self._thread.join(1.)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    """ read four synthetic chips at 512 Hz for a while and report the sample rates """
+    import time
+    from .synthetic import SyntheticSerial
+
+    ingest = CardioChipIngest()
+    for n in range(4):
+        ingest.add_device('booth-%i' % (n + 1), SyntheticSerial(rate=1., seed=n), backend='numpy')
+    ingest.start()
+    start = time.monotonic()
+    counts = dict.fromkeys(ingest.devices, 0)
+    while time.monotonic() - start < 10:
+        time.sleep(1)
+        for device_id, buf in ingest.buffers.items():
+            counts[device_id] += len(buf.drain())
+    ingest.stop()
+    elapsed = time.monotonic() - start
+    for device_id, count in counts.items():
+        print("%s: %.1f samples/s" % (device_id, count / (elapsed - 2)))  # first 2 s are skipped
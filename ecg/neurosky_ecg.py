@@ -12,25 +12,26 @@ Created on Wed Jan 14 17:37:11 2015
 @author: mpesavento
 """
 
-from ctypes import cdll, c_double
+from ctypes import cdll, c_double, c_int32, c_uint8
 
 from threading import Thread
 import sys
 import time
 import serial
-from queue import Queue
 import os, inspect  # for dynamically checking for library file location
+import logging
 
-SYNC_BYTE = 0xAA  # NOTE: this used to be 0x77!!! change this in the documentation
-EXCODE_BYTE = 0x55
-# single-byte codes
-SENSOR_STATUS = 0x02
-HEART_RATE = 0x03
-CONFIG_BYTE = 0x08
-# multi-byte codes
-RAW_ECG = 0x80
-DEBUG_1 = 0x84  # not used
-DEBUG_2 = 0x85  # not used
+import numpy as np
+
+from .cardiochip import (SYNC_BYTE, EXCODE_BYTE, SENSOR_STATUS, HEART_RATE, CONFIG_BYTE,
+                         RAW_ECG, DEBUG_1, DEBUG_2, MAX_PAYLOAD_LENGTH, FrameScanner, CardioChipDecoder)
+from .ringbuffer import SampleRingBuffer, DROP_OLDEST
+from .serial_replay import SerialRecorder, ReplaySerial, REPLAY_SCHEME
+from .hrv import StreamingHRV
+from .clocksync import SampleClock
+from streams.notify import ChangeNotifier
+
+log = logging.getLogger(__name__)
 
 
 class NeuroskyECG(object):
@@ -39,31 +40,88 @@ class NeuroskyECG(object):
     updating of live ECG data through a serial port, namely one connected
     to the cardioChip Starter Kit via bluetooth
 
-    The class maintains an internal queue of the raw ecg values, and gives the user
+    The class maintains an internal buffer of the raw ecg values, and gives the user
     choice of how to proceed with processing the ECG data.
     Typically, if leadoff id detected, the user will not want to be repeatedly calling
     the analysis library.
-    Using a queue allows the user to throw away the leadoff data, and only analyze the
+    Using a buffer allows the user to throw away the leadoff data, and only analyze the
     valid raw data.
+
+    With chunked=True the reader thread pulls everything waiting on the serial port
+    in one read (or read_size bytes, if given) and scans it for packets with a
+    FrameScanner, decoding each chunk in one go with a CardioChipDecoder.
+
+    The buffer (ecg_buffer) is a SampleRingBuffer holding buffer_seconds of data;
+    overflow picks what happens when the consumer falls behind, see SampleRingBuffer.
+
+    backend selects the analysis library: 'tgecg' loads the NeuroSky TgEcgAlg
+    dll/so, 'numpy' uses the NumpyEcgAlg port in numpy_alg.py, which needs no vendor
+    binary. Both are driven through the same calls, but they do not report the same
+    HRV: 'numpy' gives the SDNN of the last RR intervals, the library its own
+    unpublished measure, and the port has not been checked against the library's
+    output. Pick the metric with ecg_real(hrv_metric=...) where it matters.
+
+    port may also be a replay://capture.bin?speed=N string or an already open
+    serial.Serial-like object, see serial_replay.py. With record_path set, every
+    byte read from the port is also written to that capture file.
+
+    With shared_ring (a streams.shm_ring.SharedRing with ECG_COLUMNS) every buffered
+    sample is also published there, for readers in other processes.
+
+    To read several CardioChips on one event loop instead of a thread each, leave
+    start() alone and add the instances to a multi_ingest.CardioChipIngest.
+
+    lead_notifier calls its subscribers with (lead on, sample timestamp) when the
+    lead off status changes, debounced by lead_debounce seconds, see streams/notify.py.
     """
 
-    def __init__(self, port='COM8', timeout=2):
+    def __init__(self, port='COM8', timeout=2, chunked=False, read_size=None,
+                 buffer_seconds=60, overflow=DROP_OLDEST, backend='tgecg', power_frequency=60,
+                 record_path=None, clock_sync=True, device_id=None, shared_ring=None, lead_debounce=.25):
         self.connected = False
         self.port = port
         self.timeout = timeout
+        self.chunked = chunked
+        self.read_size = read_size  # fixed block size for chunked reads, None reads whatever is waiting
         self.baud = 57600
         self.Fs = 512  # cardiochip reports ecg values at a sample rate of 512 hz
         self.HRV_UPDATE = 1  # update the HRV between this many hear beats; eg if 2, we update hrv every 2 beats
 
         # CardioChip bluetooth auth key = 0000
-        print("Connecting to NeuroSky CardioChip (%s)... " % self.port)
-        self.ser = serial.Serial(self.port, self.baud, timeout=self.timeout)
-
-        self.ecg_buffer = Queue(0)  # zero is infinite max queue length
-        self.analyze = self._ecgInitAlgLib()  # returns the C library object
-        self.filter_delay = 242  # number of samples of delay, 242 for 60Hz filter, 308 for 50 Hz
+        log.info("Connecting to NeuroSky CardioChip (%s)... ", self.port)
+        if not isinstance(port, str):
+            self.ser = port  # already open serial port, or a stand-in for one
+        elif port.startswith(REPLAY_SCHEME):
+            self.ser = ReplaySerial.from_url(port, timeout=self.timeout)
+        else:
+            self.ser = serial.Serial(self.port, self.baud, timeout=self.timeout)
+        self.recorder = None
+        if record_path is not None:
+            self.ser = self.recorder = SerialRecorder(self.ser, record_path)
+        # tags this chip's samples when several are read in one process
+        self.device_id = device_id if device_id is not None else getattr(self.ser, 'port', port)
+
+        self.ecg_buffer = SampleRingBuffer(self.Fs * buffer_seconds, overflow=overflow)
+        self.shared_ring = shared_ring  # optional streams.shm_ring.SharedRing getting a copy of every sample
+        # drift corrected, epoch aligned sample timestamps (the default); clock_sync=False
+        # counts at a nominal 512 Hz from the first sample, as before SampleClock
+        self.clock = SampleClock(self.Fs) if clock_sync else None
+        self.scanner = FrameScanner()  # used by the chunked reader and feed_bytes
+        self.decoder = CardioChipDecoder(self.Fs, clock=self.clock)
+        if backend == 'tgecg':
+            self.analyze = self._ecgInitAlgLib(power_frequency=power_frequency)  # returns the C library object
+        elif backend == 'numpy':
+            self.analyze = self._ecgInitNumpyAlg(power_frequency=power_frequency)
+        else:
+            raise ValueError("unknown analysis backend: {}".format(backend))
+        self.filter_delay = 242 if power_frequency == 60 else 308  # number of samples of delay, 242 for 60Hz filter, 308 for 50 Hz
+        self.hrv_stats = StreamingHRV(15, 30)  # SDNN/RMSSD/pNN50 over the last 15 to 30 RRIs, fed by _rPeak
         self.starttime = None  # start time, in unix epoch seconds
         self.curtime = None
+        self._restart_clock = False  # set by ecgResetAlgLib, acted on by the reader thread
+        self.cur_leadstatus = 0
+        self.lead_notifier = ChangeNotifier(lead_debounce)
+        self.sample_count = 0
 
     def start(self):
         """
@@ -71,10 +129,13 @@ class NeuroskyECG(object):
         """
         # TODO add thread checking, should only be 1 thread per serial interface
         self.connected = True
-        t1 = Thread(target=self._read_cardiochip)
+        if self.chunked:
+            t1 = Thread(target=self._read_cardiochip_chunked)
+        else:
+            t1 = Thread(target=self._read_cardiochip)
         t1.daemon = True
         t1.start()
-        print("Started CardioChip reader")
+        log.info("Started CardioChip reader")
 
     def check(self):
         """ checks if thread currently exists """
@@ -83,6 +144,8 @@ class NeuroskyECG(object):
     def stop(self):
         """ stops running thread """
         self.connected = False
+        if self.recorder is not None:
+            self.recorder.close_recording()
 
     def setHRVUpdate(self, numRRI):
         """
@@ -97,8 +160,10 @@ class NeuroskyECG(object):
         as the code and return a list of dicts of all values found in the packet
         dicts will be of the format: {'timestamp', t, <codename>: codeval}
 
-        Timestamps are based on the first raw_ecg data received on the host computer, and
-        extrapolated using a sample frequency of 512 Hz from there. This is accurate in the short term,
+        Timestamps come from self.clock (see clocksync.py), which tracks the CardioChip's
+        actual sample rate against the host clock. Without one (clock_sync=False) they are
+        based on the first raw_ecg data received on the host computer, and extrapolated using
+        a sample frequency of 512 Hz from there. This is accurate in the short term,
         but should not be used for longer (>10 min) recordings.
         """
         out = []
@@ -139,13 +204,17 @@ class NeuroskyECG(object):
             elif code == RAW_ECG:
                 # raw value is between -32768 and 32767, in twos compliment form
                 # if the raw value is higher than 32768, it should be rolled around to allow for negative values
-                raw = payload[bytesParsed] * 256 + payload[bytesParsed]
+                raw = payload[bytesParsed] * 256 + payload[bytesParsed + 1]
                 if raw >= 32768:
                     raw = raw - 65536
                 # print("ecg: %i" % ecg)
 
                 # create the timestamp on each ECG sample, starting from the first
-                if self.starttime is None:
+                if self.clock is not None:
+                    self.curtime = self.clock.stamp_one()
+                    if self.starttime is None:
+                        self.starttime = self.curtime
+                elif self.starttime is None:
                     self.starttime = time.time()
                     self.curtime = self.starttime
                 else:
@@ -165,7 +234,7 @@ class NeuroskyECG(object):
                 bytesParsed += length
 
             else:
-                print("unknown code: %i" % code)
+                log.warning("unknown code: %i", code, extra={'rate_limited': True})
 
         return out
 
@@ -173,12 +242,13 @@ class NeuroskyECG(object):
         """
         read data packets from the cardiochip starter kit, via the bluetooth serial port
         """
-        cur_leadstatus = 0
-        sample_count = 0
         while self.connected:
-            sample_count += 1
+            self.sample_count += 1
             # check for sync bytes
-            readbyte = ord(self.ser.read(1))
+            readbyte = self.ser.read(1)
+            if not readbyte:
+                continue  # read timed out
+            readbyte = ord(readbyte)
             # print(readbyte, SYNC_BYTE)
             if readbyte != SYNC_BYTE:
                 continue
@@ -191,7 +261,7 @@ class NeuroskyECG(object):
                 pLength = ord(self.ser.read(1))
                 if pLength != SYNC_BYTE:
                     break
-            if pLength > 169:
+            if pLength > MAX_PAYLOAD_LENGTH:
                 continue
             # print("L: %i" % pLength)
 
@@ -209,61 +279,147 @@ class NeuroskyECG(object):
             chk = ord(self.ser.read(1))
             # print("chk: " + str(checksum))
             if chk != checksum:
-                print("checksum error, %i != %i" % (chk, checksum))
+                log.warning("checksum error, %i != %i", chk, checksum, extra={'rate_limited': True})
                 continue
 
-            output = self._parseData(payload)
-
-            lead_status = next((d for d in output if 'leadoff' in d), None)
-            if lead_status is not None:
-                if cur_leadstatus != lead_status['leadoff']:
-                    # we have a change
-                    if lead_status['leadoff'] == 200:
-                        print("LEAD ON")
-                    elif lead_status['leadoff'] == 0:
-                        print("LEAD OFF")
-                cur_leadstatus = lead_status['leadoff']
-
-            # store the output data in a queue
-            # first, create a tuple with the sample index and dict with the timestamp and ecg
-            ecgdict = next(((i, d) for i, d in enumerate(output) if 'ecg_raw' in d), None)
-            if ecgdict is not None and sample_count > self.Fs * 2:
-                # let's just ignore the first 2 seconds of crappy data
-                ecgdict[1]['leadoff'] = cur_leadstatus
-                # print ecgdict[1]
-                self.ecg_buffer.put(ecgdict[1])  # this should save the ecg and timestamp keys
+            self._handlePayload(payload)
 
         return
 
+    def _read_cardiochip_chunked(self):
+        """
+        read data packets from the cardiochip in chunks, scanning each chunk for
+        complete packets. Packets split across two reads are held in the scanner
+        until the rest arrives.
+        """
+        while self.connected:
+            size = self.read_size or self.ser.in_waiting or 1  # block for at least a byte
+            data = self.ser.read(size)
+            if not data:
+                continue  # read timed out
+            self.feed_bytes(data)
+
+        return
+
+    def feed_bytes(self, data):
+        """
+        parse a chunk of bytes read from the cardiochip and buffer the samples in it,
+        for callers that do the reading themselves (see multi_ingest.py)
+        """
+        payloads = self.scanner.feed(data)
+        if payloads:
+            self._clock_restart_check()
+            self._storeSamples(self.decoder.decode(payloads))
+
+    def _storeSamples(self, samples):
+        """
+        bulk version of _handlePayload, for a SAMPLE_DTYPE array from the decoder
+        """
+        leadoff = samples['leadoff']
+        changes = np.flatnonzero(np.diff(leadoff, prepend=self.cur_leadstatus))
+        for i in changes:
+            # we have a change
+            if leadoff[i] == 200:
+                log.info("LEAD ON")
+            elif leadoff[i] == 0:
+                log.info("LEAD OFF")
+            self.lead_notifier.update(bool(leadoff[i] == 200), float(samples['timestamp'][i]))
+        if len(samples):
+            # the last status too, to pass on a change held back by the debounce
+            self.lead_notifier.update(bool(leadoff[-1] == 200), float(samples['timestamp'][-1]))
+            self.cur_leadstatus = int(leadoff[-1])
+            self.curtime = float(samples['timestamp'][-1])
+            self.starttime = self.decoder.starttime
+
+        # let's just ignore the first 2 seconds of crappy data
+        skip = max(0, self.Fs * 2 - self.sample_count)
+        self.sample_count += len(samples)
+        samples = samples[skip:]
+        self.ecg_buffer.write(samples['timestamp'], samples['ecg_raw'], samples['leadoff'])
+        if self.shared_ring is not None:
+            self.shared_ring.write(timestamp=samples['timestamp'], ecg_raw=samples['ecg_raw'],
+                                   leadoff=samples['leadoff'])
+
+    def _handlePayload(self, payload):
+        """
+        parse one verified packet payload, track lead status changes and
+        queue any raw ecg sample it holds
+        """
+        self._clock_restart_check()
+        output = self._parseData(payload)
+
+        lead_status = next((d for d in output if 'leadoff' in d), None)
+        if lead_status is not None:
+            if self.cur_leadstatus != lead_status['leadoff']:
+                # we have a change
+                if lead_status['leadoff'] == 200:
+                    log.info("LEAD ON")
+                elif lead_status['leadoff'] == 0:
+                    log.info("LEAD OFF")
+            self.cur_leadstatus = lead_status['leadoff']
+            t = lead_status['timestamp']  # None before the first raw sample
+            self.lead_notifier.update(self.cur_leadstatus == 200, time.time() if t is None else t)
+
+        # store the output data in the buffer
+        ecgdict = next((d for d in output if 'ecg_raw' in d), None)
+        if ecgdict is not None and self.sample_count > self.Fs * 2:
+            # let's just ignore the first 2 seconds of crappy data
+            self.ecg_buffer.write_sample(ecgdict['timestamp'], ecgdict['ecg_raw'], self.cur_leadstatus)
+            if self.shared_ring is not None:
+                self.shared_ring.write(timestamp=ecgdict['timestamp'], ecg_raw=ecgdict['ecg_raw'],
+                                       leadoff=self.cur_leadstatus)
+
     def isBufferEmpty(self):
         """ check to see if ecg buffer is empty """
         return self.ecg_buffer.empty()
 
     def popBuffer(self):
-        """ get first value  (dict) in the ecg_buffer """
+        """
+        get first value (dict) in the ecg_buffer, with 'timestamp', 'ecg_raw' and 'leadoff' keys.
+        Prefer ecg_buffer.drain() to pull many samples at once.
+        """
         return self.ecg_buffer.get()
 
     def _ecgInitAlgLib(self, libname='TgEcgAlg64.dll', power_frequency=60):
         """ initialize the TgEcg algorithm dll """
         curFN = inspect.getfile(inspect.currentframe())
-        print("curFN:", curFN)
+        log.debug("curFN: %s", curFN)
         curFN = curFN.split(os.path.sep)
-        print("split curFN:", curFN)
+        log.debug("split curFN: %s", curFN)
         if len(curFN) != 1:
             libRoot = "/".join(curFN[:-1]) + "/"
-            print("library dir: ", libRoot)
+            log.debug("library dir: %s", libRoot)
         else:
             libRoot = ""
         if sys.maxsize > (2 ** 32) / 2 - 1:  # running 64 bit
-            print("loading Neurosky tg_ecg library, 64 bit")
+            log.info("loading Neurosky tg_ecg library, 64 bit")
             libname = libRoot + "TgEcgAlg64.dll"
         else:
-            print("loading Neurosky tg_ecg library, 32 bit")
+            log.info("loading Neurosky tg_ecg library, 32 bit")
             # libname = 'TgEcgAlg.dll'
             libname = libRoot + "tg_ecg.so"
-        print("loading analysis library: ", libname)
+        log.info("loading analysis library: %s", libname)
         E = cdll.LoadLibrary(libname)
 
+        # declare the signatures of the calls made per sample, see tg_ecg.h
+        for fname in ['tg_ecg_do_hrv_sdnn', 'tg_ecg_do_relaxation_level',
+                      'tg_ecg_do_respiratory_rate', 'tg_ecg_do_rri_precise']:
+            getattr(E, fname).argtypes = [c_uint8]
+            getattr(E, fname).restype = None
+        E.tg_ecg_set_power_line_freq.argtypes = [c_int32]
+        E.tg_ecg_set_power_line_freq.restype = None
+        E.tg_ecg_init.argtypes = []
+        E.tg_ecg_init.restype = None
+        E.tg_ecg_update.argtypes = [c_int32]
+        E.tg_ecg_update.restype = None
+        E.tg_ecg_compute_hrv.argtypes = [c_int32]
+        E.tg_ecg_compute_hrv.restype = c_int32
+        for fname in ['tg_ecg_is_r_peak', 'tg_ecg_get_total_rri_count', 'tg_ecg_get_rri',
+                      'tg_ecg_compute_hr_now']:
+            getattr(E, fname).argtypes = []
+            getattr(E, fname).restype = c_int32
+        E.tg_ecg_get_raw_smoothed.argtypes = []
+
         E.tg_ecg_do_hrv_sdnn(0)
         E.tg_ecg_do_relaxation_level(0)
         E.tg_ecg_do_respiratory_rate(0)
@@ -273,12 +429,35 @@ class NeuroskyECG(object):
         E.tg_ecg_init()  # init the library with selected options
         return E
 
+    def _ecgInitNumpyAlg(self, power_frequency=60):
+        """ initialize the NumPy port of the TgEcg algorithm """
+        from .numpy_alg import NumpyEcgAlg  # needs scipy, only import it when asked for
+        log.info("loading NumPy ecg analysis backend (HRV is the SDNN, not the library's measure)")
+        return NumpyEcgAlg(self.Fs, power_frequency)
+
     def ecgResetAlgLib(self):
         """ reset ecg algorithm """
-        print("resetting ecg analysis library")
+        log.info("resetting ecg analysis library")
         self.analyze.tg_ecg_init()
-        self.starttime = None
-        self.curtime = None
+        self.hrv_stats.reset()
+        # the timestamps belong to the reader thread, which restarts them before its next packet
+        self._restart_clock = True
+
+    def _clock_restart_check(self):
+        """ in the reader thread: restart the time base if ecgResetAlgLib asked for it """
+        if self._restart_clock:
+            self._restart_clock = False
+            self.starttime = None
+            self.curtime = None
+            self.decoder.restart_clock()
+
+    def getHRVStats(self):
+        """
+        return the streaming HRV statistics of the current window as a dict with
+        'sdnn', 'rmssd', 'pnn50' and 'mean' (ms, ms, percent, ms), each -1 until
+        15 RRIs have been seen since the last reset
+        """
+        return {m: self.hrv_stats.get(m) for m in ('sdnn', 'rmssd', 'pnn50', 'mean')}
 
     def getTotalNumRRI(self):
         """
@@ -302,25 +481,66 @@ class NeuroskyECG(object):
 
         if self.analyze.tg_ecg_is_r_peak():
             # print("found peak")
-            num_rri = self.analyze.tg_ecg_get_total_rri_count()
-            rri = self.analyze.tg_ecg_get_rri()
-            hr = self.analyze.tg_ecg_compute_hr_now()
+            num_rri, rri, hr, hrv = self._rPeak(nHRV)
             D['rri'] = rri
             D['hr'] = hr
-            print("%i HR: %i (rri: %i)" % (num_rri, 60000 * 1 / rri, rri))
-
-            if num_rri >= 15 and num_rri < nHRV:
-                # slowly increase number of RRIs in HRV calculation until we reach nHRV
-                # This is equivalen to starting with a window of 15 RRIs and increasing the window length to max=nHRV
-                nHRV = num_rri
-            if num_rri >= nHRV and (num_rri + 2) % self.HRV_UPDATE == 0:
-                # calculate every HRV_UPDATE heartbeats, starting at nHRV (window increases from 15 to 30)
-                hrv = self.analyze.tg_ecg_compute_hrv(nHRV)
+            log.debug("%i HR: %i (rri: %i)", num_rri, 60000 * 1 / rri, rri)
+            if hrv is not None:
                 D['hrv'] = hrv
-                print("hrv: " + str(hrv))
+                log.debug("hrv: %s", hrv)
 
         return D
 
+    def _rPeak(self, nHRV):
+        """
+        collect the RRI, HR and (every HRV_UPDATE beats) HRV after tg_ecg_is_r_peak() fired
+        returns (num_rri, rri, hr, hrv), with hrv None if it was not computed on this beat
+        """
+        num_rri = self.analyze.tg_ecg_get_total_rri_count()
+        rri = self.analyze.tg_ecg_get_rri()
+        hr = self.analyze.tg_ecg_compute_hr_now()
+        hrv = None
+        self.hrv_stats.add(rri)
+
+        if num_rri >= 15 and num_rri < nHRV:
+            # slowly increase number of RRIs in HRV calculation until we reach nHRV
+            # This is equivalen to starting with a window of 15 RRIs and increasing the window length to max=nHRV
+            nHRV = num_rri
+        if num_rri >= nHRV and (num_rri + 2) % self.HRV_UPDATE == 0:
+            # calculate every HRV_UPDATE heartbeats, starting at nHRV (window increases from 15 to 30)
+            hrv = self.analyze.tg_ecg_compute_hrv(nHRV)
+        return num_rri, rri, hr, hrv
+
+    def analyze_block(self, raw, nHRV=30):
+        """
+        run a whole block of raw ecg samples through the analysis library.
+        Gives the same results as calling ecgalgAnalyzeRaw on each sample in turn,
+        without building a dict or printing per sample.
+
+        Returns (ecg_filt, peaks): ecg_filt is a float64 array of the smoothed ecg,
+        one value per input sample, and peaks a list of (sample_index, rri, hr, hrv)
+        tuples, one per detected R-peak, with hrv None where it was not computed.
+        """
+        peaks = []
+        if hasattr(self.analyze, 'process_block'):
+            # backend analyzes the whole block itself, and calls back on each beat
+            ecg_filt = self.analyze.process_block(
+                raw, lambda i: peaks.append((i,) + self._rPeak(nHRV)[1:]))
+            return ecg_filt, peaks
+
+        raw = np.asarray(raw, dtype=np.int32).tolist()
+        # bind the library calls once, outside the loop
+        update = self.analyze.tg_ecg_update
+        get_smoothed = self.analyze.tg_ecg_get_raw_smoothed
+        is_r_peak = self.analyze.tg_ecg_is_r_peak
+        ecg_filt = [0.] * len(raw)
+        for i, x in enumerate(raw):
+            update(x)
+            ecg_filt[i] = get_smoothed()
+            if is_r_peak():
+                peaks.append((i,) + self._rPeak(nHRV)[1:])
+        return np.array(ecg_filt, dtype=np.float64), peaks
+
 
 if __name__ == "__main__":
     """
@@ -331,6 +551,8 @@ if __name__ == "__main__":
     # import numpy as np
     # from matplotlib import pyplot as plt
     import pylab as plt
+    from logconfig import setup_logging  # at the repository root, run this as python -m ecg.neurosky_ecg
+    setup_logging(logging.DEBUG)
 
     # hack to get interactive plot working
     # https://github.com/matplotlib/matplotlib/issues/3505
@@ -346,7 +568,7 @@ if __name__ == "__main__":
     try:
         nskECG = NeuroskyECG(target_port)
     except serial.serialutil.SerialException:
-        print("Could not open target serial port: %s" % target_port)
+        log.error("Could not open target serial port: %s", target_port)
         sys.exit(1)
 
     nskECG.start()
@@ -379,7 +601,7 @@ if __name__ == "__main__":
     while True:
         if not nskECG.isBufferEmpty():
             sample_count += 1
-            # print("buffer len", nskECG.ecg_buffer.qsize())
+            # print("buffer len", len(nskECG.ecg_buffer))
             D = nskECG.popBuffer()
             # ignore data prior to leadoff
 
@@ -392,14 +614,13 @@ if __name__ == "__main__":
                         isreset = True
                         ecgdict = []  # reset the buffer
                         nskECG.ecgResetAlgLib()
-                        print("num rri post reset", nskECG.analyze.tg_ecg_get_total_rri_count())
-                    nskECG.ecg_buffer.task_done()
+                        log.info("num rri post reset %i", nskECG.analyze.tg_ecg_get_total_rri_count())
                     continue
             else:  # leadoff==200, or lead on
                 # print("done resetting, loading data again")
                 leadoff_count = 0
                 if isreset:
-                    print("turning things back on")
+                    log.info("turning things back on")
                     isreset = False
 
             D = nskECG.ecgalgAnalyzeRaw(D)
@@ -457,8 +678,5 @@ if __name__ == "__main__":
                 #    time.sleep(0.05)
                 plt.draw()
 
-            # let the queue know we are done processing its
-            nskECG.ecg_buffer.task_done()
-
     # stop the thread, ctrl-C
     pass
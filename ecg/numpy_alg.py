@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy ECG analysis backend
+
+A pure NumPy/SciPy stand-in for the NeuroSky TgEcgAlg library, for machines where
+the vendor dll/so does not load and for profiling. NumpyEcgAlg answers the same
+tg_ecg_* calls NeuroskyECG makes on the C library, so it can be dropped in as
+NeuroskyECG.analyze, and also offers process_block() to analyze many samples at once.
+
+ * smoothing: a linear phase FIR notch (band stop, +-NOTCH_WIDTH Hz) at the power
+   line frequency, with the same delay as NeuroskyECG.filter_delay (242 samples at
+   60 Hz, 308 at 50 Hz). Everything else, muscle noise included, passes; how far
+   the vendor's "raw smoothed" output also low passes is not documented, so the
+   two outputs may differ above a few tens of Hz
+ * R-peak detection: Pan-Tompkins (band pass, derivative, squaring, moving window
+   integration, adaptive thresholds with a refractory period), run block-wise
+ * HRV: NOT CONFORMING. tg_ecg_compute_hrv's definition is not published; this
+   reports SDNN (standard deviation) of the last n RR intervals, in ms, which has
+   not been checked against the library on recorded sessions. Use NeuroskyECG's
+   StreamingHRV (ecg_real(hrv_metric=...)) where the metric has to be known
+
+bench_numpy_alg.py measures the speed in multiples of realtime.
+"""
+
+import numpy as np
+from scipy import signal
+
+# number of samples the smoothed output lags the raw input, per power line frequency
+FILTER_DELAY = {60: 242, 50: 308}
+NOTCH_WIDTH = 2.  # Hz either side of the power line frequency
+
+
+class NumpyEcgAlg(object):
+    """
+    Streaming Pan-Tompkins R-peak detector and HRV engine with the TgEcgAlg call interface
+    """
+
+    def __init__(self, Fs=512, power_line_freq=60):
+        self.Fs = Fs
+        self.tg_ecg_set_power_line_freq(power_line_freq)
+
+        # QRS detection filters
+        self._bp_sos = signal.butter(2, [5, 15], btype='bandpass', fs=Fs, output='sos')
+        self._deriv = np.array([2., 1., 0., -1., -2.]) * Fs / 8.  # five point derivative
+        self._mwi_len = int(round(0.150 * Fs))  # 150 ms moving window integration
+        self._refractory = int(round(0.200 * Fs))  # no two beats within 200 ms
+        self._settle_len = Fs // 2  # filter start up transient, ignored
+        self._learn_len = 2 * Fs  # thresholds are seeded from the next 2 seconds
+        self.max_rri_buffer = 512
+        self.tg_ecg_init()
+
+    # ---- TgEcgAlg interface --------------------------------------------------------
+
+    def tg_ecg_set_power_line_freq(self, x):
+        """ 50 or 60 Hz; call tg_ecg_init() afterwards, as with the C library """
+        if x not in FILTER_DELAY:
+            raise ValueError("power line frequency must be 50 or 60 Hz, got {}".format(x))
+        self.power_line_freq = x
+        self.filter_delay = FILTER_DELAY[x]
+        # odd length, symmetric: linear phase, delayed by exactly filter_delay samples
+        self._smooth_taps = signal.firwin(2 * self.filter_delay + 1, [x - NOTCH_WIDTH, x + NOTCH_WIDTH],
+                                          pass_zero='bandstop', fs=self.Fs)
+
+    def tg_ecg_init(self):
+        """ reset all filter and detector state """
+        self._smooth_zi = np.zeros(len(self._smooth_taps) - 1)
+        self._bp_zi = np.zeros((self._bp_sos.shape[0], 2))
+        self._deriv_zi = np.zeros(len(self._deriv) - 1)
+        self._mwi_zi = np.zeros(self._mwi_len - 1)
+        self._total = 0  # samples processed
+        # integrated signal not yet searched for peaks, starting at sample _hist_start
+        self._hist = np.zeros(0)
+        self._hist_start = 0
+        self._searched_to = -1  # candidates at or before this sample were already classified
+        self._learning = []
+        self._spki = None  # running signal peak level
+        self._npki = None  # running noise peak level
+        self._last_beat = None
+        self._missed = []  # (sample, height) of the noise peaks since the last beat, for searchback
+        self._rris = []
+        self._total_rri = 0
+        self._is_peak = 0
+        self._smoothed = 0.
+
+    def tg_ecg_update(self, x):
+        """ add one raw sample """
+        self._is_peak = 0
+
+        def on_peak(i):
+            self._is_peak = 1
+        self._smoothed = self.process_block([x], on_peak)[0]
+
+    def tg_ecg_get_raw_smoothed(self):
+        return self._smoothed
+
+    def tg_ecg_is_r_peak(self):
+        return self._is_peak
+
+    def tg_ecg_get_total_sample_count(self):
+        return self._total
+
+    def tg_ecg_get_total_rri_count(self):
+        return self._total_rri
+
+    def tg_ecg_get_rri(self):
+        """ most recent RR interval in milliseconds, or -1 """
+        return self._rris[-1] if self._rris else -1
+
+    def tg_ecg_compute_hr_now(self):
+        """ heart rate in BPM from the median of the recent RR intervals """
+        if not self._rris:
+            return -1
+        return int(round(60000. / np.median(self._rris[-8:])))
+
+    def tg_ecg_compute_hrv(self, num_heart_beat):
+        """
+        SDNN of the last num_heart_beat RR intervals, in ms, or -1. Not known to match
+        the C library's HRV, see the module docstring
+        """
+        if num_heart_beat > len(self._rris) or num_heart_beat < 2:
+            return -1
+        return int(round(np.std(self._rris[-num_heart_beat:])))
+
+    def tg_ecg_compute_hrv_now(self):
+        return self.tg_ecg_compute_hrv(len(self._rris))
+
+    # ---- block processing ------------------------------------------------------------
+
+    def process_block(self, raw, on_peak=None):
+        """
+        analyze a block of raw samples, returning the smoothed ecg (one value per
+        sample, delayed by filter_delay). Each detected R-peak appends an RR interval and
+        then calls on_peak(i), where i is the index in this block of the sample that
+        confirmed the beat; the tg_ecg_get_* calls reflect that beat during the callback.
+        """
+        x = np.asarray(raw, dtype=np.float64)
+        smoothed, self._smooth_zi = signal.lfilter(self._smooth_taps, 1., x, zi=self._smooth_zi)
+        bp, self._bp_zi = signal.sosfilt(self._bp_sos, x, zi=self._bp_zi)
+        deriv, self._deriv_zi = signal.lfilter(self._deriv, 1., bp, zi=self._deriv_zi)
+        mwi, self._mwi_zi = signal.lfilter(np.ones(self._mwi_len) / self._mwi_len, 1.,
+                                           deriv * deriv, zi=self._mwi_zi)
+        block_start = self._total
+        self._total += len(x)
+
+        if self._spki is None:
+            # still collecting the first seconds to seed the thresholds
+            self._learning.append(mwi)
+            seen = np.concatenate(self._learning)[self._settle_len:]
+            if len(seen) < self._learn_len:
+                return smoothed
+            self._spki = 0.25 * seen.max()
+            self._npki = 0.5 * seen.mean()
+            self._learning = []
+            self._hist_start = block_start
+
+        self._hist = np.concatenate([self._hist, mwi])
+        end = self._hist_start + len(self._hist)
+        confirmed = end - self._refractory - 1  # peaks up to here have seen their right side
+        if confirmed > self._searched_to:
+            peaks, _ = signal.find_peaks(self._hist, distance=self._refractory)
+            peaks = peaks + self._hist_start
+            new = peaks[(peaks > self._searched_to) & (peaks <= confirmed)]
+            for p in new.tolist():
+                confirmed_at = p + self._refractory - block_start
+                self._classify(p, self._hist[p - self._hist_start],
+                               lambda: on_peak(confirmed_at) if on_peak is not None else None)
+            self._searched_to = confirmed
+            # keep enough history to judge the left side of the next candidates
+            keep = end - 2 * self._refractory
+            if keep > self._hist_start:
+                self._hist = self._hist[keep - self._hist_start:]
+                self._hist_start = keep
+        return smoothed
+
+    def _classify(self, p, height, emit):
+        """
+        Pan-Tompkins threshold update for one candidate peak at sample p. emit() is
+        called after each new RR interval, which can also come from a missed beat
+        found by searching back when the interval since the last beat got too long.
+        """
+        threshold = self._npki + 0.25 * (self._spki - self._npki)
+        if self._last_beat is not None and self._missed:
+            # searchback: take the biggest skipped peak if a beat is overdue
+            limit = 1.66 * np.mean(self._rris[-8:]) * self.Fs / 1000. if self._rris else 2 * self.Fs
+            if p - self._last_beat > limit:
+                q, h = max(self._missed, key=lambda m: m[1])
+                if h > 0.5 * threshold:
+                    self._spki = 0.25 * h + 0.75 * self._spki
+                    if self._accept(q):
+                        emit()
+                    threshold = self._npki + 0.25 * (self._spki - self._npki)
+
+        if height > threshold and (self._last_beat is None or p - self._last_beat > self._refractory):
+            self._spki = 0.125 * height + 0.875 * self._spki
+            if self._accept(p):
+                emit()
+        else:
+            self._npki = 0.125 * height + 0.875 * self._npki
+            self._missed.append((p, height))
+
+    def _accept(self, p):
+        """ record a beat at sample p, True if it produced an RR interval """
+        previous, self._last_beat = self._last_beat, p
+        self._missed = []
+        if previous is None:
+            return False
+        self._rris.append(int(round(1000. * (p - previous) / self.Fs)))
+        del self._rris[:-self.max_rri_buffer]
+        self._total_rri += 1
+        return True
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed capacity ECG sample buffer
+
+Replaces the Queue of per-sample dicts between the CardioChip reader thread and
+the analysis consumer. Samples are stored in preallocated parallel columns and
+moved in bulk, so the producer and consumer touch the lock once per chunk rather
+than once per sample.
+"""
+
+import threading
+
+import numpy as np
+
+# one row per buffered sample, as returned by SampleRingBuffer.drain()
+BUFFER_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('ecg_raw', np.int16),
+    ('leadoff', np.uint8),
+])
+
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+class SampleRingBuffer(object):
+    """
+    Single producer / single consumer ring of (timestamp, ecg_raw, leadoff) samples.
+
+    When a write does not fit, the overflow policy decides what happens:
+        'drop_oldest' -- discard the oldest unread samples to make room
+        'block'       -- wait for the consumer to read, for at most block_timeout
+                         seconds (None waits forever); samples that still do not
+                         fit after the timeout are handled as with drop_oldest
+    Every write that had to discard data counts as one overrun; the number of
+    discarded samples is kept in dropped.
+    """
+
+    def __init__(self, capacity=512 * 60, overflow=DROP_OLDEST, block_timeout=None):
+        if overflow not in (DROP_OLDEST, BLOCK):
+            raise ValueError("unknown overflow policy: {}".format(overflow))
+        self.capacity = capacity
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.timestamp = np.zeros(capacity, dtype=np.float64)
+        self.ecg_raw = np.zeros(capacity, dtype=np.int16)
+        self.leadoff = np.zeros(capacity, dtype=np.uint8)
+        self._columns = (self.timestamp, self.ecg_raw, self.leadoff)
+        self._cond = threading.Condition()
+        self._read = 0  # total samples consumed (or dropped)
+        self._written = 0  # total samples written
+        self.overruns = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._written - self._read
+
+    def empty(self):
+        return self._written == self._read
+
+    def write(self, timestamp, ecg_raw, leadoff):
+        """ append equal length arrays of timestamps, raw ecg values and lead status """
+        timestamp = np.asarray(timestamp, dtype=np.float64)
+        ecg_raw = np.asarray(ecg_raw, dtype=np.int16)
+        leadoff = np.asarray(leadoff, dtype=np.uint8)
+        n = len(timestamp)
+        if n == 0:
+            return
+        with self._cond:
+            start = 0
+            if self.overflow == BLOCK:
+                while start < n:
+                    free = self.capacity - len(self)
+                    if free == 0 and not self._cond.wait_for(
+                            lambda: len(self) < self.capacity, self.block_timeout):
+                        break  # timed out, fall through to dropping
+                    free = self.capacity - len(self)
+                    count = min(free, n - start)
+                    self._put(timestamp[start:start + count], ecg_raw[start:start + count],
+                              leadoff[start:start + count])
+                    start += count
+                    self._cond.notify_all()
+                if start == n:
+                    return
+            self._put_dropping(timestamp[start:], ecg_raw[start:], leadoff[start:])
+            self._cond.notify_all()
+
+    def write_sample(self, timestamp, ecg_raw, leadoff):
+        """ append a single sample """
+        self.write((timestamp,), (ecg_raw,), (leadoff,))
+
+    def _put_dropping(self, timestamp, ecg_raw, leadoff):
+        n = len(timestamp)
+        excess = len(self) + n - self.capacity
+        if excess > 0:
+            self.overruns += 1
+            self.dropped += excess
+            skip = max(0, n - self.capacity)  # new samples that could never fit
+            self._read += excess - skip
+            self._written += skip
+            self._read += skip
+            timestamp, ecg_raw, leadoff = timestamp[skip:], ecg_raw[skip:], leadoff[skip:]
+        self._put(timestamp, ecg_raw, leadoff)
+
+    def _put(self, *data):
+        n = len(data[0])
+        start = self._written % self.capacity
+        first = min(n, self.capacity - start)
+        for column, values in zip(self._columns, data):
+            column[start:start + first] = values[:first]
+            column[:n - first] = values[first:]
+        self._written += n
+
+    def read_into(self, timestamp, ecg_raw, leadoff):
+        """
+        move up to len(timestamp) of the oldest samples into the given arrays,
+        returns the number of samples copied
+        """
+        with self._cond:
+            n = min(len(self), len(timestamp))
+            self._take(n, (timestamp, ecg_raw, leadoff))
+            return n
+
+    def drain(self, n=None):
+        """ remove and return up to n of the oldest samples (all if n is None) as a BUFFER_DTYPE array """
+        with self._cond:
+            available = len(self)
+            n = available if n is None else min(n, available)
+            out = np.empty(n, dtype=BUFFER_DTYPE)
+            self._take(n, (out['timestamp'], out['ecg_raw'], out['leadoff']))
+            return out
+
+    def _take(self, n, outputs):
+        start = self._read % self.capacity
+        first = min(n, self.capacity - start)
+        for column, out in zip(self._columns, outputs):
+            out[:first] = column[start:start + first]
+            out[first:n] = column[:n - first]
+        self._read += n
+        self._cond.notify_all()
+
+    def oldest_timestamp(self):
+        """ timestamp of the oldest unread sample, or None if the buffer is empty """
+        with self._cond:
+            if self.empty():
+                return None
+            return float(self.timestamp[self._read % self.capacity])
+
+    def wait(self, timeout=None):
+        """ block until at least one sample is available, returns False on timeout """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.empty(), timeout)
+
+    def get(self, timeout=None):
+        """
+        remove and return the oldest sample as a dict with 'timestamp', 'ecg_raw'
+        and 'leadoff' keys, blocking until one is available (like Queue.get)
+        """
+        if not self.wait(timeout):
+            return None
+        row = self.drain(1)[0]
+        return {'timestamp': float(row['timestamp']), 'ecg_raw': int(row['ecg_raw']),
+                'leadoff': int(row['leadoff'])}
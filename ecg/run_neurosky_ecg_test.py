@@ -45,7 +45,6 @@ while True:
                 if nskECG.getTotalNumRRI()!=0:
                     # reset the library
                     nskECG.ecgalgResetLib()
-                nskECG.ecg_buffer.task_done()  # let queue know that we're done
                 continue
         else: # leadoff==200, or lead is on
             leadoff_count=0
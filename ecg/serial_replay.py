@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+CardioChip serial capture and replay
+
+SerialRecorder tees every chunk read from a serial port into a capture file,
+together with the host time it arrived. ReplaySerial plays such a file back
+through the parts of the serial.Serial interface NeuroskyECG uses (read,
+in_waiting, timeout, close), at the recorded pace, N times faster, or as fast as
+possible, so the ECG path can be run and benchmarked without a CardioChip.
+
+NeuroskyECG opens a replay for port strings of the form
+    replay://path/to/capture.bin             real time
+    replay://path/to/capture.bin?speed=4     4x real time
+    replay://path/to/capture.bin?speed=max   as fast as possible
+
+Capture file layout: the MAGIC header, then one record per chunk of
+    float64 host time (unix epoch seconds), uint32 length, length bytes of data
+all little endian.
+"""
+
+import struct
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+MAGIC = b'CYMSER1\n'
+_RECORD = struct.Struct('<dI')
+
+REPLAY_SCHEME = 'replay://'
+
+
+def read_capture(path):
+    """ return the list of (host time, bytes) records in a capture file """
+    records = []
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a serial capture file".format(path))
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            t, n = _RECORD.unpack(header)
+            records.append((t, f.read(n)))
+    return records
+
+
+class SerialRecorder(object):
+    """
+    Wraps an open serial port and appends everything read from it to a capture file.
+    Reads that arrive within coalesce seconds of each other share one record, so the
+    byte-at-a-time reader does not write a record per byte.
+    All other attributes are passed through to the wrapped port.
+    """
+
+    def __init__(self, ser, path, coalesce=0.005):
+        self.ser = ser
+        self.path = path
+        self.coalesce = coalesce
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._pending = bytearray()
+        self._pending_t = None
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        if data:
+            now = time.time()
+            with self._lock:
+                if self._pending_t is not None and now - self._pending_t > self.coalesce:
+                    self._flush()
+                if self._pending_t is None:
+                    self._pending_t = now
+                self._pending += data
+        return data
+
+    def _flush(self):
+        if self._pending and self._file is not None:
+            self._file.write(_RECORD.pack(self._pending_t, len(self._pending)))
+            self._file.write(self._pending)
+        self._pending = bytearray()
+        self._pending_t = None
+
+    def close_recording(self):
+        """ write out any pending bytes and close the capture file, the port stays open """
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def close(self):
+        self.close_recording()
+        self.ser.close()
+
+
+class ReplaySerial(object):
+    """
+    serial.Serial look-alike that plays back a capture file.
+    speed is the playback rate relative to the recording, None (or 0) for as
+    fast as possible. With loop=True the recording starts over at the end,
+    otherwise reads time out like a silent port once it is used up.
+    """
+
+    MAX_BUFFERED = 1 << 16  # fast playback releases at most about this many bytes ahead
+
+    def __init__(self, path, speed=1., timeout=2, loop=False):
+        self.port = path
+        self.speed = speed or None
+        self.timeout = timeout
+        self.loop = loop
+        self.is_open = True
+        self._records = read_capture(path)
+        self._next = 0  # index of the next record to release
+        self._buf = bytearray()
+        self._t0 = None  # (recorded time, host monotonic time) of the playback start
+
+    @classmethod
+    def from_url(cls, url, timeout=2):
+        """ build a ReplaySerial from a replay://path?speed=N port string """
+        parts = urlsplit(url)
+        path = parts.netloc + parts.path
+        query = parse_qs(parts.query)
+        speed = query.get('speed', ['1'])[0]
+        speed = None if speed == 'max' else float(speed)
+        loop = query.get('loop', ['0'])[0] in ('1', 'true')
+        return cls(path, speed=speed, timeout=timeout, loop=loop)
+
+    def _due(self):
+        """ playback position, in recorded seconds """
+        return self._t0[0] + (time.monotonic() - self._t0[1]) * self.speed
+
+    def _release(self):
+        """ move every record whose time has come into the read buffer """
+        if self._t0 is None and self._records:
+            self._t0 = (self._records[0][0], time.monotonic())
+        while True:
+            if self._next >= len(self._records):
+                if not self.loop or not self._records:
+                    return None
+                # start over, continuing the clock from where the recording ended
+                self._next = 0
+                self._t0 = (self._records[0][0], time.monotonic())
+            t, data = self._records[self._next]
+            if self.speed is None:
+                if len(self._buf) >= self.MAX_BUFFERED:
+                    return 0.  # plenty to read already
+            elif t > self._due():
+                return (t - self._due()) / self.speed  # seconds until the next record
+            self._buf += data
+            self._next += 1
+
+    @property
+    def in_waiting(self):
+        self._release()
+        return len(self._buf)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            wait = self._release()
+            if len(self._buf) >= size:
+                break
+            if wait is None:
+                # recording used up; time out like a silent port would
+                wait = self.timeout if self.timeout is not None else 1.
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = min(wait, remaining)
+            time.sleep(wait)
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def exhausted(self):
+        """ True once every recorded byte has been read """
+        return not self.loop and self._next >= len(self._records) and not self._buf
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Shared memory channel for ECG results
+
+Carries the compact output of an ECG analysis running in another process (lead
+state, the latest RRI/HR/HRV and a decimated smoothed waveform) to the main
+process through a multiprocessing.shared_memory block, so reading it costs no
+pickling, no pipe and no lock held by the other side.
+
+There is one writer. Each write is bracketed by a sequence counter (a seqlock):
+the writer makes it odd before changing anything and even again afterwards, and a
+reader that saw an odd or changed counter simply reads again.
+"""
+
+from multiprocessing import shared_memory
+import time
+
+import numpy as np
+
+# scalar results; NaN stands for "not available yet"
+RESULT_DTYPE = np.dtype([
+    ('seq', np.uint64),
+    ('lead_on', np.uint8),
+    ('rri', np.float64),
+    ('hr', np.float64),
+    ('hrv', np.float64),
+    ('hrv_t', np.float64),
+    ('lag', np.float64),  # seconds the analysis is behind the reader
+    ('updated', np.float64),  # unix time of the last publish
+    ('wave_written', np.uint64),  # waveform samples written so far
+], align=True)
+
+
+class EcgResultChannel(object):
+    """
+    create=True makes a new shared memory block (its name is in .name, pass it to
+    the other process), create=False attaches to an existing one.
+    The waveform ring holds wave_len samples, of every decimate-th smoothed sample.
+    """
+
+    def __init__(self, name=None, create=True, wave_len=1280, decimate=4):
+        self.wave_len = wave_len
+        self.decimate = decimate
+        size = RESULT_DTYPE.itemsize + wave_len * (8 + 4)
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self._header = np.ndarray(1, dtype=RESULT_DTYPE, buffer=buf)[0:1]
+        self._wave_t = np.ndarray(wave_len, dtype=np.float64, buffer=buf, offset=RESULT_DTYPE.itemsize)
+        self._wave = np.ndarray(wave_len, dtype=np.float32, buffer=buf,
+                                offset=RESULT_DTYPE.itemsize + 8 * wave_len)
+        self._phase = 0  # samples to skip before the next one kept, when decimating
+        if create:
+            self._header[0] = (0, 0, np.nan, np.nan, np.nan, np.nan, 0., 0., 0)
+
+    # ---- writer side -------------------------------------------------------------------
+
+    def _begin(self):
+        self._header['seq'] += 1
+
+    def _end(self):
+        self._header['seq'] += 1
+
+    def publish(self, lead_on, rri=None, hr=None, hrv=None, hrv_t=None, lag=0.):
+        """ store the latest results; None leaves a value unavailable """
+        def nan(x):
+            return np.nan if x is None else x
+        self._begin()
+        h = self._header
+        h['lead_on'] = bool(lead_on)
+        h['rri'] = nan(rri)
+        h['hr'] = nan(hr)
+        h['hrv'] = nan(hrv)
+        h['hrv_t'] = nan(hrv_t)
+        h['lag'] = lag
+        h['updated'] = time.time()
+        self._end()
+
+    def write_wave(self, t, x):
+        """ append smoothed ecg values x with timestamps t, keeping every decimate-th one """
+        n = len(x)
+        t = np.asarray(t)[self._phase::self.decimate][-self.wave_len:]
+        x = np.asarray(x)[self._phase::self.decimate][-self.wave_len:]
+        self._phase = (self._phase - n) % self.decimate
+        if len(x) == 0:
+            return
+        self._begin()
+        written = int(self._header['wave_written'][0])
+        pos = (written + np.arange(len(x))) % self.wave_len
+        self._wave_t[pos] = t
+        self._wave[pos] = x
+        self._header['wave_written'] = written + len(x)
+        self._end()
+
+    # ---- reader side -------------------------------------------------------------------
+
+    def snapshot(self):
+        """ consistent copy of the scalar results, as a dict """
+        while True:
+            seq = int(self._header['seq'][0])
+            if seq % 2:
+                time.sleep(0)
+                continue
+            values = self._header[0].copy()
+            if int(self._header['seq'][0]) == seq:
+                break
+        return {name: values[name].item() for name in RESULT_DTYPE.names if name != 'seq'}
+
+    def wave(self, n=None):
+        """ (timestamps, values) of the last n (default all held) waveform samples, oldest first """
+        while True:
+            seq = int(self._header['seq'][0])
+            if seq % 2:
+                time.sleep(0)
+                continue
+            written = int(self._header['wave_written'][0])
+            held = min(written, self.wave_len) if n is None else min(n, written, self.wave_len)
+            pos = (written - held + np.arange(held)) % self.wave_len
+            t, x = self._wave_t[pos], self._wave[pos]  # fancy indexing copies
+            if int(self._header['seq'][0]) == seq:
+                return t, x
+
+    def close(self):
+        """ detach from the block, in every process that opened it """
+        self._header = self._wave_t = self._wave = None
+        self.shm.close()
+
+    def unlink(self):
+        """ free the block; call once, from the process that created it, after close() """
+        self.shm.unlink()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic CardioChip data
+
+Generates realistic ECG (P-QRS-T beats with heart rate variability, sensor noise,
+power line hum and leadoff episodes) and encodes it as byte accurate CardioChip
+packets, for load and soak testing the ingest and analysis path without a device.
+
+    SyntheticECG     -- stateful waveform generator
+    encode_frames    -- samples -> SENSOR_STATUS/HEART_RATE and RAW_ECG packets
+    SyntheticSerial  -- in-memory serial port stand-in, pass it to NeuroskyECG(port=...)
+    open_pty_feed    -- write the packets into a pseudo terminal, for code that
+                        wants a real device path (POSIX only)
+
+Running this module measures the highest sample rate, as a multiple of the
+CardioChip's 512 Hz, that NeuroskyECG can ingest and analyze without falling behind:
+    python -m ecg.synthetic --seconds 10
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from .cardiochip import SYNC_BYTE, SENSOR_STATUS, HEART_RATE, RAW_ECG, payload_checksum
+
+LEAD_ON = 200
+LEAD_OFF = 0
+
+# (offset from the R peak in s, width in s, amplitude in ADC counts) of each wave
+BEAT_SHAPE = [(-0.20, 0.025, 150), (-0.03, 0.010, -200), (0., 0.012, 2000),
+              (0.03, 0.010, -400), (0.25, 0.040, 300)]
+
+
+class SyntheticECG(object):
+    """
+    Continuous synthetic ECG, generated a block at a time.
+
+    hr          mean heart rate in BPM
+    hrv         standard deviation of the RR intervals in ms
+    rsa         respiratory sinus arrhythmia depth in ms (at 0.2 Hz breathing)
+    noise       standard deviation of the white sensor noise, ADC counts
+    hum         amplitude of the power line hum, ADC counts
+    hum_freq    power line frequency, 50 or 60 Hz
+    leadoff     list of (start, stop) seconds during which the leads are off
+    """
+
+    def __init__(self, Fs=512, hr=70., hrv=40., rsa=30., noise=30., hum=300., hum_freq=60,
+                 leadoff=(), seed=None):
+        self.Fs = Fs
+        self.hr = hr
+        self.hrv = hrv
+        self.rsa = rsa
+        self.noise = noise
+        self.hum = hum
+        self.hum_freq = hum_freq
+        self.leadoff = list(leadoff)
+        self.rng = np.random.RandomState(seed)
+        self.n = 0  # samples generated so far
+        self.beats = []  # R peak times (s) that may still overlap future samples
+        self.beat_times = []  # every R peak time generated, for checking detectors
+        self._next_beat = 0.5
+
+    def _rr(self, t):
+        """ next RR interval in seconds for a beat at time t """
+        rr = 60. / self.hr + self.rsa / 1000. * np.sin(2 * np.pi * 0.2 * t)
+        return max(0.3, rr + self.rng.randn() * self.hrv / 1000.)
+
+    def is_lead_on(self, t):
+        return not any(start <= t < stop for start, stop in self.leadoff)
+
+    def generate(self, n):
+        """ return the next n samples as (raw int16 array, leadoff uint8 array) """
+        t = (self.n + np.arange(n)) / float(self.Fs)
+        self.n += n
+        end = t[-1] if n else 0.
+        while self._next_beat < end + 0.5:
+            self.beats.append(self._next_beat)
+            self.beat_times.append(self._next_beat)
+            self._next_beat += self._rr(self._next_beat)
+
+        x = self.noise * self.rng.randn(n)
+        x += self.hum * np.sin(2 * np.pi * self.hum_freq * t)
+        for b in self.beats:
+            for offset, width, amplitude in BEAT_SHAPE:
+                lo, hi = np.searchsorted(t, [b + offset - 5 * width, b + offset + 5 * width])
+                if lo < hi:
+                    x[lo:hi] += amplitude * np.exp(-0.5 * ((t[lo:hi] - b - offset) / width) ** 2)
+        self.beats = [b for b in self.beats if b > end - 0.5]
+
+        leadoff = np.full(n, LEAD_ON, dtype=np.uint8)
+        for start, stop in self.leadoff:
+            off = (t >= start) & (t < stop)
+            leadoff[off] = LEAD_OFF
+            x[off] = self.hum * np.sin(2 * np.pi * self.hum_freq * t[off]) \
+                + 20 * self.noise * self.rng.randn(off.sum())
+        return np.clip(x, -32768, 32767).astype(np.int16), leadoff
+
+
+def encode_frames(raw, leadoff, first_sample=0, Fs=512, hr=0):
+    """
+    encode samples as CardioChip packets: one RAW_ECG packet per sample, preceded once
+    a second (whenever the sample index is a multiple of Fs) by a SENSOR_STATUS and
+    HEART_RATE packet. first_sample is the index of raw[0] in the whole stream.
+    """
+    raw = np.asarray(raw, dtype=np.int16).view(np.uint16)
+    n = len(raw)
+    frames = np.empty((n, 8), dtype=np.uint8)
+    frames[:, 0] = frames[:, 1] = SYNC_BYTE
+    frames[:, 2] = 4
+    frames[:, 3] = RAW_ECG
+    frames[:, 4] = 2
+    frames[:, 5] = raw >> 8
+    frames[:, 6] = raw & 0xFF
+    frames[:, 7] = ~((RAW_ECG + 2 + frames[:, 5].astype(np.int32) + frames[:, 6]) & 0xFF) & 0xFF
+
+    status_at = np.flatnonzero((first_sample + np.arange(n)) % Fs == 0)
+    if len(status_at) == 0:
+        return frames.tobytes()
+    out = []
+    prev = 0
+    for i in status_at.tolist():
+        out.append(frames[prev:i].tobytes())
+        payload = bytes([SENSOR_STATUS, int(leadoff[i]), HEART_RATE, int(hr) & 0xFF])
+        out.append(bytes([SYNC_BYTE, SYNC_BYTE, len(payload)]) + payload + bytes([payload_checksum(payload)]))
+        prev = i
+    out.append(frames[prev:].tobytes())
+    return b''.join(out)
+
+
+class SyntheticSerial(object):
+    """
+    serial.Serial look-alike that produces CardioChip packets from a SyntheticECG.
+    rate is the sample rate as a multiple of the source's Fs (so rate=4 sends
+    2048 samples a second at 512 Hz); None produces data as fast as it is read.
+    """
+
+    BLOCK = 256  # samples generated at a time
+
+    def __init__(self, source=None, rate=1., timeout=2, **kwargs):
+        self.source = source if source is not None else SyntheticECG(**kwargs)
+        self.rate = rate
+        self.timeout = timeout
+        self.port = 'synthetic'
+        self.is_open = True
+        self._buf = bytearray()
+        self._t0 = None
+
+    def _fill(self, size):
+        """ generate every sample that is due (or, when unpaced, enough for size bytes) """
+        Fs = self.source.Fs
+        if self.rate is None:
+            while len(self._buf) < size:
+                self._generate(self.BLOCK)
+            return 0.
+        if self._t0 is None:
+            self._t0 = time.monotonic()
+        due = int((time.monotonic() - self._t0) * Fs * self.rate) - self.source.n
+        if due > 0:
+            self._generate(due)
+        return 1. / (Fs * self.rate)
+
+    def _generate(self, n):
+        first = self.source.n
+        raw, leadoff = self.source.generate(n)
+        self._buf += encode_frames(raw, leadoff, first, self.source.Fs, self.source.hr)
+
+    @property
+    def in_waiting(self):
+        self._fill(0)
+        return len(self._buf)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            wait = self._fill(size)
+            if len(self._buf) >= size:
+                break
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = min(wait, remaining)
+            time.sleep(max(wait, 0.001))
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+def open_pty_feed(source=None, rate=1., **kwargs):
+    """
+    start a daemon thread writing synthetic packets into a new pseudo terminal and
+    return the device path of its other end, to open like a serial port
+    """
+    import pty  # POSIX only
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    feed = SyntheticSerial(source, rate=rate, timeout=None, **kwargs)
+
+    def pump():
+        while True:
+            os.write(master, feed.read(max(feed.in_waiting, 8)))
+
+    t = threading.Thread(target=pump)
+    t.daemon = True
+    t.start()
+    return os.ttyname(slave)
+
+
+def measure_sustainable_rate(seconds=10., rates=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512), backend='numpy'):
+    """
+    feed NeuroskyECG from a SyntheticSerial at each rate (multiple of 512 Hz) for the
+    given number of seconds, draining and analyzing in batches like main.ecg_real,
+    and return the highest rate at which the consumer kept up
+    """
+    from .neurosky_ecg import NeuroskyECG
+    best = None
+    for rate in rates:
+        nsk = NeuroskyECG(SyntheticSerial(rate=rate, timeout=0.1), chunked=True, backend=backend)
+        nsk.start()
+        analyzed = 0
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            if nsk.ecg_buffer.wait(0.1):
+                analyzed += len(nsk.analyze_block(nsk.ecg_buffer.drain()['ecg_raw'])[0])
+        nsk.stop()
+        lag = len(nsk.ecg_buffer)
+        expected = nsk.Fs * rate * seconds
+        kept_up = nsk.ecg_buffer.overruns == 0 and analyzed + lag >= 0.9 * (expected - 2 * nsk.Fs) \
+            and lag < nsk.Fs * rate
+        print("rate %4ix (%6i Hz): analyzed %8i samples, %6i queued, %i overruns -> %s"
+              % (rate, nsk.Fs * rate, analyzed, lag, nsk.ecg_buffer.overruns, "ok" if kept_up else "BEHIND"))
+        if not kept_up:
+            break
+        best = rate
+    return best
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10., help="seconds to run each rate")
+    parser.add_argument("--backend", default='numpy', help="analysis backend, numpy or tgecg")
+    args = parser.parse_args()
+
+    best = measure_sustainable_rate(args.seconds, backend=args.backend)
+    print("maximum sustainable rate: {}x 512 Hz".format(best))
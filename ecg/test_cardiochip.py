@@ -0,0 +1,96 @@
+"""
+Tests for the CardioChip framing helpers, run with pytest from the repository root
+"""
+import numpy as np
+
+from .cardiochip import FrameScanner, CardioChipDecoder, SAMPLE_DTYPE, SYNC_BYTE, payload_checksum
+
+
+def make_frame(payload):
+    payload = bytes(payload)
+    return bytes([SYNC_BYTE, SYNC_BYTE, len(payload)]) + payload + bytes([payload_checksum(payload)])
+
+
+RAW_PAYLOADS = [bytes([0x80, 0x02, hi, lo]) for hi, lo in [(0x00, 0x10), (0xFF, 0xF0), (0x7F, 0xFF), (0x80, 0x00)]]
+STATUS_PAYLOAD = bytes([0x02, 200, 0x03, 72])
+
+
+def test_scanner_finds_all_frames_in_one_chunk():
+    stream = b''.join(make_frame(p) for p in [STATUS_PAYLOAD] + RAW_PAYLOADS)
+    assert FrameScanner().feed(stream) == [STATUS_PAYLOAD] + RAW_PAYLOADS
+
+
+def test_scanner_handles_frames_split_across_chunks():
+    stream = b'\x01\x02' + b''.join(make_frame(p) for p in RAW_PAYLOADS * 50)
+    for size in (1, 2, 3, 7, 64):
+        scanner = FrameScanner(capacity=32)
+        found = []
+        for i in range(0, len(stream), size):
+            found.extend(scanner.feed(stream[i:i + size]))
+        assert found == RAW_PAYLOADS * 50
+        assert len(scanner) == 0
+
+
+def test_scanner_rejects_bad_checksum_and_long_length():
+    bad = bytearray(make_frame(RAW_PAYLOADS[0]))
+    bad[-1] ^= 0xFF
+    too_long = bytes([SYNC_BYTE, SYNC_BYTE, 171])
+    scanner = FrameScanner()
+    found = scanner.feed(bytes(bad) + too_long + make_frame(RAW_PAYLOADS[1]))
+    assert found == [RAW_PAYLOADS[1]]
+    assert scanner.checksum_errors == 1
+    assert scanner.length_errors == 1
+
+
+def test_scanner_skips_repeated_sync_bytes_before_length():
+    stream = bytes([SYNC_BYTE] * 5) + make_frame(RAW_PAYLOADS[2])[2:]
+    assert FrameScanner().feed(stream) == [RAW_PAYLOADS[2]]
+
+
+# golden capture: a status packet (lead on, HR 72) followed by raw samples, then a
+# lead-off status packet and two more samples, as the chip puts them on the wire
+GOLDEN_STREAM = bytes.fromhex(
+    'aaaa0402c80348ea'
+    'aaaa04800200106d'
+    'aaaa048002fff08e'
+    'aaaa0480027fffff'
+    'aaaa0480028000fd'
+    'aaaa0402000348b2'
+    'aaaa048002fc1869'
+    'aaaa04800203e892'
+)
+GOLDEN_RAW = [16, -16, 32767, -32768, -1000, 1000]
+GOLDEN_LEADOFF = [200, 200, 200, 200, 0, 0]
+GOLDEN_HR = [72] * 6
+
+
+def test_decoder_matches_golden_frames():
+    payloads = FrameScanner().feed(GOLDEN_STREAM)
+    assert len(payloads) == 8
+    decoder = CardioChipDecoder()
+    out = decoder.decode(payloads)
+    assert out.dtype == SAMPLE_DTYPE
+    assert out['ecg_raw'].tolist() == GOLDEN_RAW
+    assert out['leadoff'].tolist() == GOLDEN_LEADOFF
+    assert out['hr'].tolist() == GOLDEN_HR
+    assert np.allclose(np.diff(out['timestamp']), 1. / 512)
+
+
+def test_decoder_carries_state_across_calls():
+    payloads = FrameScanner().feed(GOLDEN_STREAM)
+    decoder = CardioChipDecoder()
+    first = decoder.decode(payloads[:3])
+    second = decoder.decode(payloads[3:])
+    joined = np.concatenate([first, second])
+    assert joined['ecg_raw'].tolist() == GOLDEN_RAW
+    assert joined['leadoff'].tolist() == GOLDEN_LEADOFF
+    assert np.allclose(np.diff(joined['timestamp']), 1. / 512)
+
+
+def test_decoder_agrees_with_per_packet_parser():
+    from .neurosky_ecg import NeuroskyECG
+    nsk = NeuroskyECG.__new__(NeuroskyECG)  # no serial port needed to parse
+    nsk.Fs, nsk.starttime, nsk.curtime, nsk.clock = 512, None, None, None
+    payloads = [bytes([0x80, 0x02, v >> 8, v & 0xFF]) for v in range(0, 65536, 97)]
+    expected = [d['ecg_raw'] for p in payloads for d in nsk._parseData(p)]
+    assert CardioChipDecoder().decode(payloads)['ecg_raw'].tolist() == expected
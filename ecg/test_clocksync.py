@@ -0,0 +1,57 @@
+"""
+Tests for the ECG sample clock, run with pytest from the repository root
+"""
+import numpy as np
+
+from .clocksync import SampleClock
+
+
+def simulate(clock, seconds=120, rate=512 * 1.004, chunk=64, lost=(), seed=0):
+    """
+    feed a clock chunks from a device running at rate Hz, arriving 20-40 ms after the
+    last sample in them; lost is a list of (first sample, count) that never arrive.
+    Returns the true sampling times and the clock's timestamps of the samples that arrived.
+    """
+    rng = np.random.RandomState(seed)
+    t0 = 1000.
+    keep = np.ones(int(seconds * rate), dtype=bool)
+    for first, count in lost:
+        keep[first:first + count] = False
+    index = np.flatnonzero(keep)
+    true, stamped = [], []
+    for start in range(0, len(index), chunk):
+        idx = index[start:start + chunk]
+        arrival = t0 + idx[-1] / rate + rng.uniform(0.02, 0.04)
+        true.append(t0 + idx / rate)
+        stamped.append(clock.stamp(len(idx), arrival))
+    return np.concatenate(true), np.concatenate(stamped) - clock.epoch_offset
+
+
+def test_tracks_a_fast_device_clock_and_skips_lost_samples():
+    clock = SampleClock(512)
+    true, stamped = simulate(clock, lost=[(40000, 1000)])
+    assert clock.drops == 1 and abs(clock.dropped - 1000) < 30
+    assert abs(clock.sample_rate() - 512 * 1.004) < 0.1
+    err = stamped - true - 0.03  # mean arrival latency
+    assert np.abs(err[-20000:]).max() < 0.02  # settled and across the gap
+    assert (np.diff(stamped) >= 0).all()
+
+
+def test_timestamps_are_unix_epoch_seconds():
+    import time
+    clock = SampleClock(512)
+    ts = clock.stamp(512)
+    assert abs(ts[-1] - time.time()) < 0.1
+
+
+def test_a_late_burst_with_nothing_lost_is_latency():
+    clock = SampleClock(512)
+    rate = 512 * 1.004
+    true = 1000. + np.arange(int(30 * rate)) / rate
+    arrival = true + 0.005
+    stall = (true >= 1020.) & (true < 1020.2)
+    arrival[stall] = 1020.2 + 0.005  # held up by the OS, then delivered all at once
+    stamped = np.array([clock.stamp_one(a) for a in arrival]) - clock.epoch_offset
+    assert clock.drops == 0 and clock.dropped == 0
+    err = stamped - true - 0.005
+    assert np.abs(err[true > 1010.]).max() < 0.01  # settled, through the stall and after it
@@ -0,0 +1,42 @@
+"""
+Tests for the streaming HRV statistics, run with pytest from the repository root
+"""
+import numpy as np
+
+from .hrv import StreamingHRV
+
+
+def reference(rri):
+    rri = np.asarray(rri, dtype=float)
+    diff = np.diff(rri)
+    return (np.std(rri, ddof=1), np.sqrt(np.mean(diff ** 2)),
+            100. * np.mean(np.abs(diff) > 50))
+
+
+def test_matches_batch_statistics_while_ramping_and_sliding():
+    rng = np.random.RandomState(0)
+    rri = rng.randint(600, 1100, 500)
+    hrv = StreamingHRV(15, 30)
+    for n, x in enumerate(rri, 1):
+        hrv.add(x)
+        if n < 15:
+            assert not hrv.ready() and hrv.sdnn() == -1
+            continue
+        window = rri[max(0, n - 30):n]
+        assert len(hrv) == len(window)
+        sdnn, rmssd, pnn50 = reference(window)
+        assert np.isclose(hrv.sdnn(), sdnn)
+        assert np.isclose(hrv.rmssd(), rmssd)
+        assert np.isclose(hrv.pnn50(), pnn50)
+
+
+def test_reset_restarts_the_ramp():
+    hrv = StreamingHRV(15, 30)
+    for x in range(40):
+        hrv.add(800 + 10 * (x % 3))
+    assert hrv.ready() and len(hrv) == 30
+    hrv.reset()
+    assert len(hrv) == 0 and hrv.rmssd() == -1
+    for x in range(15):
+        hrv.add(900)
+    assert hrv.sdnn() == 0 and hrv.pnn50() == 0
@@ -0,0 +1,63 @@
+"""
+Tests for reading several CardioChips on one event loop, run with pytest from the repository root
+"""
+import time
+
+import serial
+
+from .multi_ingest import CardioChipIngest
+from .serial_replay import SerialRecorder, ReplaySerial
+from .synthetic import SyntheticSerial
+
+
+def test_each_device_fills_its_own_buffer_at_full_rate():
+    ingest = CardioChipIngest()
+    rates = {'booth-1': 4., 'booth-2': 4., 'booth-3': 4., 'booth-4': 2.}
+    for device_id, rate in rates.items():
+        ingest.add_device(device_id, SyntheticSerial(rate=rate, hr=60 + 10 * rate, seed=1),
+                          backend='numpy')
+    ingest.start()
+    time.sleep(2.)
+    ingest.stop()
+    counts = {device_id: len(buf) for device_id, buf in ingest.buffers.items()}
+    for device_id, rate in rates.items():
+        expected = 512 * rate * 2. - 1024  # less the first 2 s of samples, which are skipped
+        assert 0.8 * expected < counts[device_id] < 1.2 * expected + 512
+    assert ingest.devices['booth-1'].device_id == 'booth-1'
+    assert not ingest.devices['booth-1'].check()
+
+
+class UnpluggedSerial(ReplaySerial):
+    """ replays a capture, then fails like a serial port whose chip was unplugged """
+
+    def __init__(self, path, fail_after):
+        super(UnpluggedSerial, self).__init__(path, speed=None)
+        self.fail_after = fail_after
+
+    @property
+    def in_waiting(self):
+        if self.fail_after <= 0:
+            raise serial.SerialException("device reports readiness to read but returned no data")
+        self.fail_after -= 1
+        return super(UnpluggedSerial, self).in_waiting
+
+
+def test_a_failing_port_disconnects_only_its_device(tmp_path, caplog):
+    capture = str(tmp_path / 'cap.bin')
+    rec = SerialRecorder(SyntheticSerial(rate=None, seed=1), capture, coalesce=0.)
+    for _ in range(20):
+        rec.read(4096)
+    rec.close()
+    ingest = CardioChipIngest()
+    ingest.add_device('unplugged', UnpluggedSerial(capture, fail_after=5), backend='numpy')
+    ingest.add_device('fine', SyntheticSerial(rate=1., seed=2), backend='numpy')
+    ingest.start()
+    deadline = time.time() + 2
+    while 'unplugged' not in ingest.errors and time.time() < deadline:
+        time.sleep(0.01)
+    still_reading = ingest.devices['fine'].check()
+    ingest.stop()
+    assert isinstance(ingest.errors['unplugged'], serial.SerialException)
+    assert not ingest.devices['unplugged'].check() and still_reading
+    assert 'fine' not in ingest.errors
+    assert any("unplugged: reading failed" in r.getMessage() for r in caplog.records)
@@ -0,0 +1,114 @@
+"""
+Tests for NeuroskyECG analysis entry points, run with pytest from the repository root
+
+The vendor library only loads on the booth machines, so these run against
+FakeTgEcg, a small stand-in with the same call interface and deterministic output.
+"""
+import numpy as np
+
+from .neurosky_ecg import NeuroskyECG
+from .cardiochip import CardioChipDecoder
+from .clocksync import SampleClock
+from .hrv import StreamingHRV
+
+
+class FakeTgEcg(object):
+    """ reports an R-peak whenever the raw value crosses 1000 upwards """
+
+    def __init__(self):
+        self.tg_ecg_init()
+
+    def tg_ecg_init(self):
+        self.count = 0
+        self.prev = 0
+        self.last_peak = None
+        self.peak = 0
+        self.rris = []
+        self.smoothed = 0.
+
+    def tg_ecg_update(self, x):
+        self.smoothed = 0.75 * self.smoothed + 0.25 * x
+        self.peak = int(self.prev < 1000 <= x)
+        if self.peak:
+            if self.last_peak is not None:
+                self.rris.append(int(1000 * (self.count - self.last_peak) / 512))
+            self.last_peak = self.count
+        self.prev = x
+        self.count += 1
+
+    def tg_ecg_get_raw_smoothed(self):
+        return self.smoothed
+
+    def tg_ecg_is_r_peak(self):
+        return self.peak and len(self.rris) > 0
+
+    def tg_ecg_get_total_rri_count(self):
+        return len(self.rris)
+
+    def tg_ecg_get_rri(self):
+        return self.rris[-1]
+
+    def tg_ecg_compute_hr_now(self):
+        return int(60000 / np.mean(self.rris))
+
+    def tg_ecg_compute_hrv(self, n):
+        return int(np.std(self.rris[-n:]))
+
+
+def make_ecg(analyze):
+    nsk = NeuroskyECG.__new__(NeuroskyECG)  # skip opening the serial port
+    nsk.Fs = 512
+    nsk.HRV_UPDATE = 1
+    nsk.analyze = analyze
+    nsk.hrv_stats = StreamingHRV(15, 30)
+    return nsk
+
+
+def recorded_raw(seconds=60):
+    """ a beat train with varying RR intervals """
+    rng = np.random.RandomState(0)
+    raw = np.zeros(512 * seconds, dtype=np.int16)
+    t = 100
+    while t < len(raw):
+        raw[t] = 2000
+        t += int(rng.uniform(350, 550))
+    return raw + rng.randint(-50, 50, len(raw)).astype(np.int16)
+
+
+def test_analyze_block_matches_per_sample_path():
+    raw = recorded_raw()
+    per_sample = make_ecg(FakeTgEcg())
+    expected_filt, expected_peaks = [], []
+    for i, x in enumerate(raw):
+        D = per_sample.ecgalgAnalyzeRaw({'ecg_raw': int(x)})
+        expected_filt.append(D['ecg_filt'])
+        if 'rri' in D:
+            expected_peaks.append((i, D['rri'], D['hr'], D.get('hrv')))
+
+    block = make_ecg(FakeTgEcg())
+    ecg_filt = []
+    peaks = []
+    for start in range(0, len(raw), 700):  # blocks that do not line up with beats
+        f, p = block.analyze_block(raw[start:start + 700])
+        ecg_filt.append(f)
+        peaks.extend((i + start,) + tuple(rest) for i, *rest in p)
+
+    assert np.array_equal(np.concatenate(ecg_filt), expected_filt)
+    assert peaks == expected_peaks
+    assert any(p[3] is not None for p in peaks)
+
+
+def test_reset_starts_the_sample_clock_over():
+    nsk = make_ecg(FakeTgEcg())
+    nsk.clock = SampleClock(nsk.Fs)
+    nsk.decoder = CardioChipDecoder(nsk.Fs, clock=nsk.clock)
+    nsk.clock.stamp(512, arrival=100.)
+    nsk.clock.stamp(512, arrival=101.)
+    assert nsk.clock.sample_index == 1024
+    nsk.curtime = nsk.starttime = 1700000000.
+    nsk._restart_clock = False
+    nsk.ecgResetAlgLib()  # from the analysis thread: leaves the reader's clock alone
+    assert nsk.clock.sample_index == 1024 and nsk.curtime == 1700000000.
+    nsk._clock_restart_check()  # the reader, before its next packet
+    assert nsk.clock.sample_index == 0 and nsk.clock.last_timestamp is None
+    assert nsk.curtime is None and nsk.decoder.starttime is None
@@ -0,0 +1,110 @@
+"""
+Tests for the NumPy ECG analysis backend, run with pytest from the repository root
+"""
+import numpy as np
+import pytest
+
+from .numpy_alg import NumpyEcgAlg
+from .neurosky_ecg import NeuroskyECG
+from .hrv import StreamingHRV
+
+
+def synthetic_ecg(seconds=120, Fs=512, seed=0):
+    """ P-QRS-T beats at jittered intervals, with 60 Hz hum, baseline wander and noise """
+    rng = np.random.RandomState(seed)
+    beats = np.cumsum(rng.uniform(0.7, 1.0, int(seconds / 0.7)))
+    beats = beats[beats < seconds - 0.5]
+    t = np.arange(seconds * Fs) / float(Fs)
+    x = np.zeros_like(t)
+    for b in beats:
+        for offset, width, amplitude in [(-0.2, 0.025, 150), (-0.03, 0.01, -200), (0, 0.012, 2000),
+                                         (0.03, 0.01, -400), (0.25, 0.04, 300)]:
+            near = np.abs(t - b - offset) < 5 * width
+            x[near] += amplitude * np.exp(-0.5 * ((t[near] - b - offset) / width) ** 2)
+    x += 300 * np.sin(2 * np.pi * 60 * t) + 1000 * np.sin(2 * np.pi * 0.2 * t) + 30 * rng.randn(len(t))
+    return x.astype(np.int16), beats
+
+
+def run_blocks(raw, block):
+    alg = NumpyEcgAlg()
+    rris = []
+    for start in range(0, len(raw), block):
+        alg.process_block(raw[start:start + block], lambda i: rris.append(alg.tg_ecg_get_rri()))
+    return alg, rris
+
+
+def test_detects_beats_and_rr_intervals():
+    raw, beats = synthetic_ecg()
+    alg, rris = run_blocks(raw, 512)
+    true_rri = np.round(np.diff(beats) * 1000)
+    assert len(beats) - 5 <= len(rris) <= len(beats) - 1
+    # once locked on, every interval matches the next stretch of true intervals
+    tail = np.array(rris[-100:])
+    assert np.abs(tail - true_rri[-100:]).max() <= 10
+    assert alg.tg_ecg_compute_hrv(30) > 0
+    assert 55 < alg.tg_ecg_compute_hr_now() < 90
+
+
+def test_block_size_does_not_change_results():
+    raw, _beats = synthetic_ecg(60)
+    _alg, big = run_blocks(raw, 4096)
+    _alg, small = run_blocks(raw, 37)
+    assert big[-40:] == small[-40:]
+
+
+def test_smoothed_output_is_delayed_by_filter_delay():
+    alg = NumpyEcgAlg()
+    impulse = np.zeros(1024)
+    impulse[100] = 1000
+    out = alg.process_block(impulse)
+    assert np.argmax(out) == 100 + alg.filter_delay == 342
+
+
+def test_notch_removes_only_the_power_line_hum():
+    t = np.arange(512 * 8) / 512.
+    for mains in (60, 50):
+        settled = slice(2 * NumpyEcgAlg(power_line_freq=mains).filter_delay + 1, None)
+        hum = NumpyEcgAlg(power_line_freq=mains).process_block(1000 * np.sin(2 * np.pi * mains * t))
+        qrs = NumpyEcgAlg(power_line_freq=mains).process_block(1000 * np.sin(2 * np.pi * 10 * t))
+        assert np.abs(hum[settled]).max() < 10  # 40 dB down
+        assert 950 < np.abs(qrs[settled]).max() < 1050
+
+
+def test_neurosky_analyze_block_uses_numpy_backend():
+    raw, _beats = synthetic_ecg(60)
+    nsk = NeuroskyECG.__new__(NeuroskyECG)  # skip opening the serial port
+    nsk.Fs, nsk.HRV_UPDATE = 512, 1
+    nsk.hrv_stats = StreamingHRV(15, 30)
+    nsk.analyze = nsk._ecgInitNumpyAlg()
+    ecg_filt, peaks = nsk.analyze_block(raw)
+    assert len(ecg_filt) == len(raw)
+    assert len(peaks) > 50
+    assert all(hrv is None for _i, _rri, _hr, hrv in peaks[:13])
+    assert peaks[-1][3] is not None
+
+
+def test_conformance_with_tg_ecg_library():
+    def analyzer(init):
+        nsk = NeuroskyECG.__new__(NeuroskyECG)
+        nsk.Fs, nsk.HRV_UPDATE = 512, 1
+        nsk.hrv_stats = StreamingHRV(15, 30)
+        nsk.analyze = init(nsk)
+        return nsk
+    try:
+        c_lib = analyzer(lambda nsk: nsk._ecgInitAlgLib())
+    except OSError:
+        pytest.skip("NeuroSky tg_ecg library does not load on this machine")
+    raw, _beats = synthetic_ecg()
+    c_filt, c_peaks = c_lib.analyze_block(raw)
+    np_filt, np_peaks = analyzer(lambda nsk: nsk._ecgInitNumpyAlg()).analyze_block(raw)
+    # RR intervals
+    c_rri = np.array([p[1] for p in c_peaks[-60:]])
+    np_rri = np.array([p[1] for p in np_peaks[-60:]])
+    assert abs(np.median(c_rri) - np.median(np_rri)) <= 10
+    # smoothed output, past the filters' start up
+    settled = slice(4 * 512, None)
+    assert np.corrcoef(c_filt[settled], np_filt[settled])[0, 1] > 0.95
+    # HRV: the NumPy one is an SDNN, not known to be the library's definition
+    c_hrv = [p[3] for p in c_peaks if p[3] is not None][-1]
+    np_hrv = [p[3] for p in np_peaks if p[3] is not None][-1]
+    assert abs(c_hrv - np_hrv) <= max(5, 0.2 * c_hrv)
@@ -0,0 +1,59 @@
+"""
+Tests for the ECG sample ring buffer, run with pytest from the repository root
+"""
+import threading
+
+import numpy as np
+
+from .ringbuffer import SampleRingBuffer, BLOCK
+
+
+def write_range(buf, start, stop):
+    n = np.arange(start, stop)
+    buf.write(n * 0.5, n, n % 2 * 200)
+
+
+def test_bulk_write_and_drain_wraps_around():
+    buf = SampleRingBuffer(capacity=10)
+    write_range(buf, 0, 7)
+    assert buf.drain(5)['ecg_raw'].tolist() == [0, 1, 2, 3, 4]
+    write_range(buf, 7, 14)
+    out = buf.drain()
+    assert out['ecg_raw'].tolist() == list(range(5, 14))
+    assert out['timestamp'].tolist() == [x * 0.5 for x in range(5, 14)]
+    assert out['leadoff'].tolist() == [x % 2 * 200 for x in range(5, 14)]
+    assert buf.empty() and buf.overruns == 0
+
+
+def test_drop_oldest_counts_overruns():
+    buf = SampleRingBuffer(capacity=10)
+    write_range(buf, 0, 8)
+    write_range(buf, 8, 12)
+    assert buf.overruns == 1 and buf.dropped == 2
+    write_range(buf, 12, 40)
+    assert buf.overruns == 2 and buf.dropped == 30
+    assert buf.drain()['ecg_raw'].tolist() == list(range(30, 40))
+
+
+def test_read_into_and_compat_get():
+    buf = SampleRingBuffer(capacity=8)
+    write_range(buf, 0, 3)
+    ts, raw, lead = np.zeros(2), np.zeros(2, np.int16), np.zeros(2, np.uint8)
+    assert buf.read_into(ts, raw, lead) == 2
+    assert raw.tolist() == [0, 1]
+    assert buf.get() == {'timestamp': 1.0, 'ecg_raw': 2, 'leadoff': 0}
+    assert buf.get(timeout=0.01) is None
+
+
+def test_block_policy_waits_for_consumer():
+    buf = SampleRingBuffer(capacity=4, overflow=BLOCK)
+    write_range(buf, 0, 4)
+    writer = threading.Thread(target=write_range, args=(buf, 4, 10))
+    writer.start()
+    got = []
+    while len(got) < 10:
+        buf.wait(1)
+        got.extend(buf.drain()['ecg_raw'].tolist())
+    writer.join(1)
+    assert got == list(range(10))
+    assert buf.overruns == 0
@@ -0,0 +1,62 @@
+"""
+Tests for serial capture and replay, run with pytest from the repository root
+"""
+import time
+
+from .serial_replay import SerialRecorder, ReplaySerial, read_capture
+from .neurosky_ecg import NeuroskyECG
+from .test_cardiochip import make_frame
+
+
+class ChunkSerial(object):
+    """ hands out a list of byte chunks, one per read """
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read(self, size=1):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def close(self):
+        pass
+
+
+def record(path, chunks, gap=0.):
+    rec = SerialRecorder(ChunkSerial(chunks), str(path), coalesce=0.)
+    for _chunk in chunks:
+        rec.read(4096)
+        time.sleep(gap)
+    rec.close()
+
+
+def test_recorder_round_trip(tmp_path):
+    chunks = [b'\xaa\xaa\x04', b'\x80\x02\x00\x10\x6d', b'\x01']
+    record(tmp_path / 'cap.bin', chunks)
+    records = read_capture(str(tmp_path / 'cap.bin'))
+    assert b''.join(data for _t, data in records) == b''.join(chunks)
+    assert all(a[0] <= b[0] for a, b in zip(records, records[1:]))
+
+
+def test_replay_paces_reads(tmp_path):
+    record(tmp_path / 'cap.bin', [b'a', b'b', b'c'], gap=0.1)
+    fast = ReplaySerial.from_url('replay://%s?speed=max' % (tmp_path / 'cap.bin'), timeout=0.05)
+    assert fast.read(3) == b'abc'
+    assert fast.read(1) == b'' and fast.exhausted()
+
+    paced = ReplaySerial(str(tmp_path / 'cap.bin'), speed=2., timeout=1)
+    start = time.monotonic()
+    assert paced.read(3) == b'abc'
+    assert 0.07 < time.monotonic() - start < 0.3  # 0.2 s recorded, played at 2x
+
+
+def test_neurosky_reads_from_replay_port(tmp_path):
+    frames = b''.join(make_frame([0x80, 0x02, v >> 8, v & 0xFF]) for v in range(1500))
+    record(tmp_path / 'cap.bin', [frames[i:i + 700] for i in range(0, len(frames), 700)])
+    nsk = NeuroskyECG('replay://%s?speed=max' % (tmp_path / 'cap.bin'), timeout=0.05,
+                      chunked=True, backend='numpy')
+    nsk.start()
+    while not nsk.ser.exhausted():
+        time.sleep(0.01)
+    nsk.stop()
+    time.sleep(0.1)
+    assert nsk.ecg_buffer.drain()['ecg_raw'].tolist() == list(range(1024, 1500))
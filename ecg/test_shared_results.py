@@ -0,0 +1,50 @@
+"""
+Tests for the shared memory ECG result channel, run with pytest from the repository root
+"""
+import multiprocessing
+import math
+
+import numpy as np
+
+from .shared_results import EcgResultChannel
+
+
+def _child_writer(name):
+    channel = EcgResultChannel(name, create=False)
+    for k in range(1, 2001):
+        channel.publish(True, rri=k, hr=k, hrv=k, hrv_t=k)
+    channel.close()
+
+
+def test_results_cross_processes_consistently():
+    channel = EcgResultChannel()
+    try:
+        assert math.isnan(channel.snapshot()['rri'])
+        child = multiprocessing.Process(target=_child_writer, args=(channel.name,))
+        child.start()
+        while child.is_alive():
+            snap = channel.snapshot()
+            # the four values are written together, a torn read would mix them
+            assert math.isnan(snap['rri']) or snap['rri'] == snap['hr'] == snap['hrv'] == snap['hrv_t']
+        child.join()
+        assert channel.snapshot()['rri'] == 2000 and channel.snapshot()['lead_on'] == 1
+    finally:
+        channel.close()
+        channel.unlink()
+
+
+def test_waveform_is_decimated_across_writes_and_wraps():
+    channel = EcgResultChannel(wave_len=100, decimate=4)
+    reader = EcgResultChannel(channel.name, create=False, wave_len=100, decimate=4)
+    try:
+        x = np.arange(1000, dtype=np.float64)
+        for start in range(0, 1000, 37):
+            channel.write_wave(x[start:start + 37] / 512., x[start:start + 37])
+        t, w = reader.wave()
+        assert w.tolist() == list(range(600, 1000, 4))
+        assert np.allclose(t, w / 512.)
+        assert reader.wave(3)[1].tolist() == [988, 992, 996]
+    finally:
+        reader.close()
+        channel.close()
+        channel.unlink()
@@ -0,0 +1,29 @@
+"""
+Tests for the synthetic CardioChip generator, run with pytest from the repository root
+"""
+import numpy as np
+
+from .cardiochip import FrameScanner, CardioChipDecoder
+from .synthetic import SyntheticECG, SyntheticSerial, encode_frames, LEAD_ON, LEAD_OFF
+from .numpy_alg import NumpyEcgAlg
+
+
+def test_frames_decode_back_to_the_samples():
+    source = SyntheticECG(hr=80, leadoff=[(2., 3.)], seed=1)
+    raw, leadoff = source.generate(512 * 5)
+    stream = encode_frames(raw, leadoff, hr=80)
+    decoded = CardioChipDecoder().decode(FrameScanner().feed(stream))
+    assert np.array_equal(decoded['ecg_raw'], raw)
+    assert np.array_equal(decoded['leadoff'], leadoff)
+    assert set(decoded['hr'].tolist()) == {80}
+    assert (leadoff[1024:1536] == LEAD_OFF).all() and (leadoff[:1024] == LEAD_ON).all()
+
+
+def test_serial_stand_in_carries_the_configured_heart_rate():
+    ser = SyntheticSerial(rate=None, hr=75, hrv=20, seed=2)
+    scanner, decoder = FrameScanner(), CardioChipDecoder()
+    samples = decoder.decode(scanner.feed(ser.read(8 * 512 * 60 + 12 * 60)))
+    alg = NumpyEcgAlg()
+    rris = []
+    alg.process_block(samples['ecg_raw'], lambda i: rris.append(alg.tg_ecg_get_rri()))
+    assert abs(60000. / np.median(rris) - 75) < 3
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Logging setup for the booth
+
+The modules log through logging.getLogger(__name__) with %-style arguments, e.g.
+    log.debug("%s: %s, queuelen=%i", name, value, unread)
+so a disabled level costs one isEnabledFor() check and nothing is formatted.
+
+setup_logging() routes every record through a queue: the thread that logs (an OSC
+handler, the ECG reader) only puts the record on the queue, and a QueueListener
+thread formats it and does the slow console I/O. Records are passed on unformatted,
+the listener formats them, so the logging thread does not pay for that either.
+
+A RateLimitFilter in front of the queue lets each DEBUG message (logger and format
+string) through at most once per interval; the next one let through says how many
+were held back, so a message repeated on every packet or poll shows up once a second
+instead. Other levels are only rate limited when the caller asks for it, on a hot
+path:
+    log.warning("checksum error, %i != %i", chk, checksum, extra={'rate_limited': True})
+so state changes, lead on/off and the like are always logged, however close together.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+RATE_LIMITED = {'rate_limited': True}  # extra= for records to rate limit whatever their level
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    let each (logger, message format) through at most once every interval seconds;
+    that is done for records below limit_level (default INFO, so DEBUG) and records
+    logged with extra=RATE_LIMITED, the rest are never held back
+    """
+
+    def __init__(self, interval=1., limit_level=logging.INFO):
+        super(RateLimitFilter, self).__init__()
+        self.interval = interval
+        self.limit_level = limit_level
+        self._last = {}  # (logger name, msg) -> [time let through, records held back since]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.interval <= 0:
+            return True
+        if record.levelno >= self.limit_level and not getattr(record, 'rate_limited', False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last[0] < self.interval:
+                last[1] += 1
+                return False
+            held = last[1] if last is not None else 0
+            self._last[key] = [now, 0]
+        if held:
+            record.suppressed = held
+        return True
+
+
+class _SuppressedFormatter(logging.Formatter):
+    """ appends how many similar records the rate limit held back """
+
+    def format(self, record):
+        text = super(_SuppressedFormatter, self).format(record)
+        held = getattr(record, 'suppressed', 0)
+        return text + " ({} similar suppressed)".format(held) if held else text
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that queues the record as it is; the standard one formats the
+    message first, in the logging thread, so it could be pickled to another process.
+    The listener is in this process, so the formatting can wait until it gets there;
+    that does mean arguments must not be changed after they are logged (pass a copy
+    of a buffer that is about to be refilled).
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level=logging.INFO, rate_limit=1., stream=None, levels=None):
+    """
+    send all logging through a queue to stream (default stderr) at level, with DEBUG
+    messages (and those logged with extra=RATE_LIMITED) rate limited to one per
+    rate_limit seconds each (0: off).
+    levels maps logger names to their own level, e.g. {'museEEG': logging.DEBUG}.
+    Returns the QueueListener; it is stopped (and the queue flushed) at exit.
+    Calling it again replaces the previous setup.
+    """
+    global _listener
+    root = logging.getLogger()
+    _stop_listener()
+    for h in [h for h in root.handlers if isinstance(h, DeferredQueueHandler)]:
+        root.removeHandler(h)
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(RateLimitFilter(rate_limit))
+    console = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    console.setFormatter(_SuppressedFormatter(FORMAT))
+    _listener = logging.handlers.QueueListener(records, console)
+
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, name_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(name_level)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _stop_listener():
+    """ stop the listener thread once it has written out what is queued """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
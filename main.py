@@ -3,21 +3,33 @@ import random
 from os.path import abspath
 # sys.path.insert(0, abspath(".."))
 import json
+import logging
 import time
 from websocket import create_connection
 import threading
+import multiprocessing
 import webbrowser
+import numpy as np
 from state_control.state_control import ChangeYourBrainStateControl
 from ecg.neurosky_ecg import NeuroskyECG
+from ecg.shared_results import EcgResultChannel
 import serial
 from museEEG.museconnect import MuseConnect
+from logconfig import setup_logging
+
+log = logging.getLogger(__name__)
 
 eeg_source = "real"  # fake or real
 # eeg_source = "fake"  # fake or real
+eeg_routing = None  # one headset per MuseConnect (muse-io without --prefix)
+# eeg_routing = "prefix"  # one MuseConnect for every headset in muse_ids, muse-io --prefix /<muse id>
 
 # ecg_source = "real"  # fake or real
+# ecg_source = "process"  # real, with reading and analysis in a child process
 ecg_source = "fake"  # fake or real
 
+log_level = logging.INFO  # logging.DEBUG also logs every OSC packet and heart beat (rate limited)
+
 timing = "live"  # for full timing as in exploratorium visitor mode
 # timing = "debug"  # for quick debug timing
 
@@ -40,7 +52,7 @@ class SpacebrewServer(object):
         ]
 
         self.ws = create_connection("ws://%s:%s" % (self.server, self.port))
-        print('initializing SpacebrewServer. Created websocket connection: {}'.format(self.ws))
+        log.info('initializing SpacebrewServer. Created websocket connection: %s', self.ws)
 
         if (port == 9002):
             config = {'config': {
@@ -67,6 +79,16 @@ class eeg_fake():  # FAKE BRAIN
         return [random.random() for _ in range(self.num_per_call)]
         # return [(t + self.time_stamp, v) for t, v in enumerate(random.random() for _ in range(self.num_per_call))]
 
+    def get_alpha_block(self):
+        """ same columns as MuseConnect.get_alpha_block """
+        values = np.array(self.get_alpha())
+        now = time.time()
+        # 10 Hz, the newest now, like muse-io's elements
+        block = {'value': values, 'device_time': now - np.arange(len(values))[::-1] / 10., 'host_time': np.full(len(values), now)}
+        for ch in ('ch1', 'ch2', 'ch3', 'ch4'):
+            block[ch] = values
+        return block
+
     def is_on_forehead(self):
         if time.time() - self.init_time > self.sec_til_start:
             return 1
@@ -97,81 +119,146 @@ class ecg_fake():  # FAKE HEART
         return random.random()
 
     def get_hrv_t(self):
-        return random.random()
+        return time.time()
 
     def get_rri(self):
         return random.random()
 
 
 class ecg_real(object):
-    def __init__(self, port="COM7"):
+    def __init__(self, port="COM7", hrv_metric=None, nskECG=None, **kwargs):
+        """
+        hrv_metric picks what get_hrv reports: None for the analysis library's HRV,
+        or 'sdnn', 'rmssd' or 'pnn50' from NeuroskyECG's streaming HRV statistics.
+        nskECG is an already open NeuroskyECG to use instead of opening port, e.g. one
+        read by an ecg.multi_ingest.CardioChipIngest together with other booths' chips.
+        Other keyword arguments go to NeuroskyECG, e.g. backend='numpy' (whose HRV is an
+        SDNN, not the NeuroSky library's measure: see NeuroskyECG).
+        """
         self.lead_count = 0
         target_port = port
         # target_port = 'devA/tty.XXXXXXX'  #change this to work on OSX
 
-        try:
-            self.nskECG = NeuroskyECG(target_port)
-        except serial.serialutil.SerialException:
-            print("Could not open target serial port: %s" % target_port)
-            sys.exit(1)
+        if nskECG is not None:
+            self.nskECG = nskECG
+        else:
+            try:
+                self.nskECG = NeuroskyECG(target_port, **kwargs)
+            except serial.serialutil.SerialException:
+                log.error("Could not open target serial port: %s", target_port)
+                sys.exit(1)
 
         # optional call, default is already 1
         self.nskECG.setHRVUpdate(1)  # update hrv every 1 detected pulses
 
         # want the LEAD_TIMEOUT to hold on to values between baseline and test, but reset between users
         self.LEAD_TIMEOUT = 30  # reset algorithm if leadoff for more than this many seconds
+        self.WAIT_TIMEOUT = 0.5  # seconds the consumer sleeps waiting for new samples
+        self.LAG_WARNING = 1.  # complain when the oldest queued sample is older than this, in seconds
+        self.hrv_metric = hrv_metric
         self.cur_lead_on = False
         self.cur_hrv = 0
+        self.lag_samples = 0
+        self.lag_seconds = 0.
+        self._lagging = False
+        self.running = True
+        self.on_batch = None  # called with this object after every analyzed batch
+        self.lead_notifier = self.nskECG.lead_notifier  # (lead on, sample time) on lead changes, no need to poll is_lead_on
+        self.wave_listener = None  # called with (timestamps, smoothed ecg) of every analyzed segment
 
     def start(self):
-        # start running the serial producer thread
-        self.nskECG.start()
+        # start running the serial producer thread, unless something already reads the chip
+        if not self.nskECG.check():
+            self.nskECG.start()
 
-        # this loop is the consumer thread, and will pop
-        # dict values (with 'timestamp', 'ecg_raw', and 'leadoff'
-        # from the internal buffer and run the analysis on the
-        # data.
+        # this loop is the consumer thread. It sleeps until the reader puts
+        # samples (with 'timestamp', 'ecg_raw', and 'leadoff') into the internal
+        # buffer, then drains everything there and runs the analysis on it in one batch.
 
         self.cur_hrv = None  # whatever the current hrv value is
         self.cur_hrv_t = None  # timestamp with the current hrv
         self.cur_rri = None  # R to R interval as an int representing # samples
+        self.cur_hr = None  # heart rate at the last beat, in BPM
 
-        sample_count = 0  # keep track of numbers of samples we've processed
         leadoff_count = 0  # counter for length of time been leadoff
-        while True:
-            if not self.nskECG.isBufferEmpty():
-                sample_count += 1
-                D = self.nskECG.popBuffer()  # get the oldest dict
-
-                if D['leadoff'] == 200:
-                    self.cur_lead_on = True  # lead is on
-                else:
-                    self.cur_lead_on = False  # no connection between leads
-
-                # if we are more than LEAD_TIMEOUT seconds in and leadoff is still zero
-                if D['leadoff'] == 0:
-                    leadoff_count += 1
-                    if leadoff_count > self.nskECG.Fs * self.LEAD_TIMEOUT:
-                        if self.nskECG.getTotalNumRRI() != 0:
-                            # reset the library
-                            self.nskECG.ecgResetAlgLib()
-                        self.nskECG.ecg_buffer.task_done()  # let queue know that we're done
-                        continue
-                else:  # leadoff==200, or lead is on
-                    leadoff_count = 0
-
-                D = self.nskECG.ecgalgAnalyzeRaw(D)
-
-                if 'hrv' in D:
-                    self.cur_hrv = D['hrv']
-                    self.cur_hrv_t = D['timestamp']
-
-                if 'rri' in D:
-                    self.cur_rri = D['rri']
+        while self.running:
+            if not self.nskECG.ecg_buffer.wait(self.WAIT_TIMEOUT):
+                continue  # nothing arrived, check again
+            self._update_lag()
+            samples = self.nskECG.ecg_buffer.drain()
+            leadoff_count = self._process_samples(samples, leadoff_count)
+            if self.on_batch is not None:
+                self.on_batch(self)
 
             # we keep looping until something tells us to stop
         pass  #
 
+    def _update_lag(self):
+        """
+        record how far the consumer is behind the reader: the number of samples
+        waiting in the buffer and the age (seconds) of the oldest one
+        """
+        buf = self.nskECG.ecg_buffer
+        oldest = buf.oldest_timestamp()
+        self.lag_samples = len(buf)
+        self.lag_seconds = time.time() - oldest if oldest is not None else 0.
+        if self.lag_seconds > self.LAG_WARNING:
+            if not self._lagging:
+                log.warning("ECG analysis is falling behind: %i samples queued, oldest %.2f s old",
+                            self.lag_samples, self.lag_seconds)
+            self._lagging = True
+        else:
+            self._lagging = False
+
+    def get_lag(self):
+        """ (queued samples, age of the oldest queued sample in seconds) at the last wake up """
+        return self.lag_samples, self.lag_seconds
+
+    def _process_samples(self, samples, leadoff_count):
+        """
+        analyze a batch of samples drained from the buffer, returns the updated leadoff_count.
+        Samples taken after the lead has been off for more than LEAD_TIMEOUT seconds
+        are dropped and the algorithm is reset, as in the per-sample loop this replaces.
+        """
+        if len(samples) == 0:
+            return leadoff_count
+        leadoff = samples['leadoff']
+        self.cur_lead_on = leadoff[-1] == 200  # lead is on, otherwise no connection between leads
+
+        # number of consecutive leadoff samples up to and including each sample
+        off = leadoff == 0
+        idx = np.arange(len(samples))
+        last_on = np.maximum.accumulate(np.where(off, -1, idx))
+        count = np.where(last_on >= 0, idx - last_on, idx + 1 + leadoff_count)
+        count[~off] = 0
+        # if we are more than LEAD_TIMEOUT seconds in and leadoff is still zero
+        skip = count > self.nskECG.Fs * self.LEAD_TIMEOUT
+
+        edges = np.concatenate([[0], np.flatnonzero(np.diff(skip)) + 1, [len(samples)]])
+        for start, stop in zip(edges[:-1], edges[1:]):
+            if skip[start]:
+                if self.nskECG.getTotalNumRRI() != 0:
+                    # reset the library
+                    self.nskECG.ecgResetAlgLib()
+                continue
+            ecg_filt, peaks = self.nskECG.analyze_block(samples['ecg_raw'][start:stop])
+            if self.wave_listener is not None:
+                # the smoothed ecg lags the raw samples by filter_delay samples
+                delay = self.nskECG.filter_delay / float(self.nskECG.Fs)
+                self.wave_listener(samples['timestamp'][start:stop] - delay, ecg_filt)
+            for i, rri, hr, hrv in peaks:
+                self.cur_rri = rri
+                self.cur_hr = hr
+                if hrv is not None and self.hrv_metric is None:
+                    self.cur_hrv = hrv
+                    self.cur_hrv_t = float(samples['timestamp'][start + i])
+            if peaks and self.hrv_metric is not None and self.nskECG.hrv_stats.ready():
+                # the streaming statistics already include every beat of this block
+                self.cur_hrv = self.nskECG.hrv_stats.get(self.hrv_metric)
+                self.cur_hrv_t = float(samples['timestamp'][start + peaks[-1][0]])
+
+        return int(count[-1])
+
     def is_lead_on(self):
         return self.cur_lead_on
 
@@ -193,13 +280,138 @@ class ecg_real(object):
         else:
             return -1
 
+    def stop(self):
+        """ end the consumer loop in start() and the serial reader """
+        self.running = False
+        self.nskECG.stop()
+
+
+def _ecg_process_main(channel_name, port, kwargs, stop_event):
+    """
+    body of the ecg_process child: read and analyze the CardioChip with an ecg_real,
+    publishing its results to the shared memory channel after every batch
+    """
+    setup_logging(log_level)  # the child needs its own listener thread, spawned or forked
+    channel = EcgResultChannel(channel_name, create=False)
+    ecg = ecg_real(port, **kwargs)
+
+    def publish(e):
+        channel.publish(e.cur_lead_on, e.cur_rri, e.cur_hr, e.cur_hrv, e.cur_hrv_t, e.lag_seconds)
+
+    def wait_for_stop():
+        stop_event.wait()
+        ecg.stop()
+
+    ecg.on_batch = publish
+    ecg.wave_listener = channel.write_wave
+    t = threading.Thread(target=wait_for_stop)
+    t.daemon = True
+    t.start()
+    try:
+        ecg.start()
+    finally:
+        channel.close()
+
+
+class ecg_process(object):
+    """
+    ecg_real run in a child process, so the serial reading and the ECG analysis do not
+    share the interpreter (and its GIL) with the OSC server and the state control.
+    Only the results come back, through an ecg.shared_results.EcgResultChannel:
+    lead state, the latest RRI/HR/HRV, and the smoothed ecg decimated to 128 Hz.
+    Has the same is_lead_on/get_hrv/get_hrv_t/get_rri calls as ecg_real; kwargs go
+    to ecg_real in the child.
+
+    Every call checks the child is still running: if it has died (it could not open
+    the port, or the analysis raised) that is logged as an error and the child is
+    started again, up to max_restarts times; after that the calls go on returning
+    "no value" (-1, lead off) and alive() is False.
+    """
+
+    def __init__(self, port="COM7", max_restarts=3, **kwargs):
+        self.channel = EcgResultChannel(create=True)
+        self.stop_event = multiprocessing.Event()
+        self.port = port
+        self.kwargs = kwargs
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.failed = False  # died more than max_restarts times
+        self.process = self._new_process()
+
+    def _new_process(self):
+        process = multiprocessing.Process(target=_ecg_process_main,
+                                          args=(self.channel.name, self.port, self.kwargs, self.stop_event))
+        process.daemon = True
+        return process
+
+    def start(self):
+        """ start the child process; returns straight away, unlike ecg_real.start """
+        self.process.start()
+        log.info("Started ECG analysis process (pid %i)", self.process.pid)
+
+    def stop(self):
+        self.stop_event.set()
+        self.process.join(5)
+        self.channel.close()
+        self.channel.unlink()
+
+    def alive(self):
+        """ whether the child is running, restarting it if it died and restarts are left """
+        if self.failed:
+            return False
+        if self.process.is_alive() or self.process.pid is None or self.stop_event.is_set():
+            return self.process.is_alive()  # running, not started yet, or stopped on purpose
+        log.error("ECG analysis process (pid %i) died with exit code %s", self.process.pid, self.process.exitcode)
+        if self.restarts >= self.max_restarts:
+            log.error("ECG analysis process failed %i times, giving up: no ECG from here on", self.restarts + 1)
+            self.failed = True
+            return False
+        self.restarts += 1
+        self.process = self._new_process()
+        self.start()
+        return True
+
+    def _get(self, name):
+        if not self.alive():
+            return -1  # a dead child's last results are stale
+        value = self.channel.snapshot()[name]
+        # same convention as ecg_real: -1 until there is a value
+        return -1 if np.isnan(value) or not value else value
+
+    def is_lead_on(self):
+        if not self.alive():
+            return False
+        return bool(self.channel.snapshot()['lead_on'])
+
+    def get_hrv(self):
+        return self._get('hrv')
+
+    def get_hrv_t(self):
+        return self._get('hrv_t')
+
+    def get_rri(self):
+        return self._get('rri')
+
+    def get_hr(self):
+        return self._get('hr')
+
+    def get_lag(self):
+        """ seconds the child's analysis was behind its reader at the last batch """
+        return self.channel.snapshot()['lag']
+
+    def get_wave(self, n=None):
+        """ (timestamps, smoothed ecg) of the last n decimated samples """
+        return self.channel.wave(n)
+
 
 if __name__ == "__main__":
+    setup_logging(log_level)
+
     # VISUALIZATION SERVER: used for sending out instructions & processed EEG/ECG to the viz
     global sb_server_2
     sb_server_2 = SpacebrewServer(server='127.0.0.1', port=9002, muse_ids=['booth-7'])
 
-    print('Started SpaceBrew visualization server: ready to send instructions and processed EEG/ECG')
+    log.info('Started SpaceBrew visualization server: ready to send instructions and processed EEG/ECG')
 
     if (ecg_source == 'real'):
         # ecg = ecg_real(ecg_comPort)
@@ -207,20 +419,26 @@ if __name__ == "__main__":
         t1 = threading.Thread(target=ecg.start)
         t1.daemon = True
         t1.start()
+    elif (ecg_source == 'process'):
+        ecg = ecg_process()
+        ecg.start()
     else:
         ecg = ecg_fake()
 
     if (eeg_source == 'real'):
-        eeg = MuseConnect(verbose=True)
-        eeg.start()
+        eeg_server = MuseConnect(verbose=log_level <= logging.DEBUG, route=eeg_routing,
+                                 devices=sb_server_2.muse_ids if eeg_routing else None)
+        eeg_server.start()
+        # with routing, this booth's state control reads its own headset's view
+        eeg = eeg_server.device(sb_server_2.muse_ids[0]) if eeg_routing else eeg_server
     else:
         eeg = eeg_fake()
 
-    print('Started SpaceBrew Client & Listener thread')
+    log.info('Started SpaceBrew Client & Listener thread')
 
     # TODO: unhardcode these filepaths
 
-    print('Loading Chrome on platform: ', sys.platform)
+    log.info('Loading Chrome on platform: %s', sys.platform)
 
     if sys.platform == 'win32':  # windoze
         chrome_path = 'C:\Program Files (x86)\Google\Chrome\Application\chrome.exe %s'
@@ -231,13 +449,14 @@ if __name__ == "__main__":
     else:  # Linux
         chrome_path = '/usr/bin/google-chrome %s'
         webbrowser.get(chrome_path).open(biodata_viz_url)
-    print('Chrome Loaded')
+    log.info('Chrome Loaded')
 
     if timing == "live":     # run full timing #TODO: change 'booth-7' name in live routes json etc
         sc = ChangeYourBrainStateControl('booth-7', sb_server_2, eeg=eeg, ecg=ecg, vis_period_sec=.25, baseline_sec=30, condition_sec=90, baseline_inst_sec=6, condition_inst_sec=9)
     elif timing == "debug":  # run expidited timing (DO NOT CHANGE VALUES)
         sc = ChangeYourBrainStateControl('booth-7', sb_server_2, eeg=eeg, ecg=ecg, vis_period_sec=.25, baseline_sec=5, condition_sec=5, baseline_inst_sec=2, condition_inst_sec=2)
-    print('ChangeYourBrain state engine started, beginning protocol.')
+    log.info('ChangeYourBrain state engine started, beginning protocol.')
+    sc.run()  # the state scheduler, in this thread until it is stopped
 
     # print('waiting for tag in')
     # TODO: this will need to be a keyboard tag in. OR ... we could 'tag_out' after 5 seconds of EEG disconnect
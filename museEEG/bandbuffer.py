@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+BandBuffer
+columnar storage for one Muse band power stream (e.g. alpha_absolute)
+
+Each OSC band packet becomes one row of device time, host arrival time and the four
+channel values, stored in growable NumPy columns. Rows get consecutive sequence
+numbers (kept in the 'seq' column); read_since(seq) hands back everything newer
+than a consumer's last read as NumPy views, and rows older than the retention
+window are let go.
+
+The buffer never holds more than max_rows rows. When it is full and nothing has
+expired, the overflow policy frees a quarter of it:
+    'drop_oldest' -- discard the oldest rows
+    'decimate'    -- keep every other row of the oldest half, so the whole time
+                     span stays covered at a lower rate
+    'spill'       -- append the oldest rows to a file on disk (see read_spilled); the
+                     writer does that after letting go of the lock
+Each time that happens counts as an overflow; dropped/spilled count the rows, and
+high_water is the most rows ever held.
+
+Rows are only ever appended past the end of the arrays, and making room copies into
+new arrays, so a view that has been handed out never changes under its reader.
+That also lets readers go without a lock: after each append the writer publishes
+(arrays, start, end, next_seq) as one tuple, in a single reference assignment, and a
+reader that picks up that tuple can slice rows start..end out of those arrays knowing
+they are complete and will stay as they are. The lock only keeps writers apart.
+"""
+
+import threading
+
+import numpy as np
+
+COLUMNS = ('seq', 'device_time', 'host_time', 'ch1', 'ch2', 'ch3', 'ch4')
+ROW_DTYPE = np.dtype([('seq', np.int64), ('device_time', np.float64), ('host_time', np.float64),
+                      ('ch1', np.float32), ('ch2', np.float32), ('ch3', np.float32), ('ch4', np.float32)])
+
+DROP_OLDEST = 'drop_oldest'
+DECIMATE = 'decimate'
+SPILL = 'spill'
+
+
+class BandBuffer(object):
+    """
+    rows of (seq, device_time, host_time, ch1, ch2, ch3, ch4) for one band, keeping
+    at least the last retention seconds (by host time) of them, up to max_rows rows.
+    spill_path is the file the 'spill' policy appends to.
+    """
+
+    def __init__(self, retention=60., initial_capacity=256, max_rows=4096, overflow=DROP_OLDEST,
+                 spill_path=None):
+        if overflow not in (DROP_OLDEST, DECIMATE, SPILL):
+            raise ValueError("unknown overflow policy: {}".format(overflow))
+        if overflow == SPILL and spill_path is None:
+            raise ValueError("the spill policy needs a spill_path")
+        self.retention = retention
+        self.initial_capacity = min(initial_capacity, max_rows)
+        self.max_rows = max_rows
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self._lock = threading.Lock()  # the threading OSC server calls the handlers from several threads
+        self._spill_lock = threading.Lock()  # keeps spill file writes in order, taken before _lock
+        self._to_spill = []  # row arrays the overflow took out, for the spill file
+        cols = {c: np.zeros(self.initial_capacity, dtype=ROW_DTYPE[c]) for c in COLUMNS}
+        # (arrays, index of the oldest row held, index one past the newest, seq of the next row),
+        # replaced as a whole by the writer, see the module docstring
+        self._state = (cols, 0, 0, 0)
+        self.overflows = 0  # times the overflow policy had to run
+        self.dropped = 0  # rows discarded by drop_oldest or decimate
+        self.spilled = 0  # rows written to spill_path
+        self.high_water = 0  # most rows held at once
+
+    def __len__(self):
+        _cols, start, end, _next_seq = self._state
+        return end - start
+
+    @property
+    def next_seq(self):
+        """ sequence number the next appended row will get """
+        return self._state[3]
+
+    @property
+    def first_seq(self):
+        """ sequence number of the oldest row still held """
+        cols, start, end, next_seq = self._state
+        return int(cols['seq'][start]) if end > start else next_seq
+
+    def append(self, device_time, host_time, ch1, ch2, ch3, ch4):
+        with self._lock:
+            cols, start, end, next_seq = self._state
+            if end == len(cols['seq']):
+                cols, start, end = self._make_room(cols, start, end, host_time)
+            cols['seq'][end] = next_seq
+            cols['device_time'][end] = device_time
+            cols['host_time'][end] = host_time
+            cols['ch1'][end] = ch1
+            cols['ch2'][end] = ch2
+            cols['ch3'][end] = ch3
+            cols['ch4'][end] = ch4
+            # publish the row; readers cannot see it before this
+            self._state = (cols, start, end + 1, next_seq + 1)
+            if end + 1 - start > self.high_water:
+                self.high_water = end + 1 - start
+        if self._to_spill:
+            self._write_spilled()
+
+    def _write_spilled(self):
+        """ append the rows the overflow took out to spill_path, outside the writer lock """
+        with self._spill_lock:
+            with self._lock:
+                pending, self._to_spill = self._to_spill, []
+            if pending:
+                with open(self.spill_path, 'ab') as f:
+                    for rows in pending:
+                        rows.tofile(f)
+
+    def _make_room(self, cols, start, end, now):
+        """
+        copy the rows still inside the retention window into new arrays with space
+        to spare, applying the overflow policy if they would fill max_rows, and return
+        (arrays, start, end) for them; amortized this costs O(1) per appended row
+        """
+        host_time = cols['host_time'][start:end]
+        keep = np.arange(start + int(np.searchsorted(host_time, now - self.retention)), end)
+        if len(keep) >= self.max_rows:
+            keep = self._overflow(cols, keep)
+        capacity = min(self.max_rows, max(self.initial_capacity, 2 * len(keep)))
+        new = {}
+        for c, col in cols.items():
+            new[c] = np.zeros(capacity, dtype=col.dtype)
+            new[c][:len(keep)] = col[keep]
+        return new, 0, len(keep)
+
+    def _overflow(self, cols, keep):
+        """ free a quarter of max_rows from the array indices in keep, per the policy """
+        self.overflows += 1
+        n_free = max(1, self.max_rows // 4)
+        if self.overflow == DECIMATE:
+            # every other row of the oldest 2 * n_free
+            old = keep[:2 * n_free]
+            self.dropped += len(old) - len(old[::2])
+            return np.concatenate([old[::2], keep[2 * n_free:]])
+        if self.overflow == SPILL:
+            rows = np.empty(n_free, dtype=ROW_DTYPE)
+            for c, col in cols.items():
+                rows[c] = col[keep[:n_free]]
+            self._to_spill.append(rows)  # written by append() once the lock is released
+            self.spilled += n_free
+        else:
+            self.dropped += n_free
+        return keep[n_free:]
+
+    def read_spilled(self):
+        """ every row the spill policy has written out so far, as a ROW_DTYPE array """
+        if self.spill_path is None:
+            return np.zeros(0, dtype=ROW_DTYPE)
+        self._write_spilled()
+        with self._spill_lock:
+            try:
+                return np.fromfile(self.spill_path, dtype=ROW_DTYPE)
+            except FileNotFoundError:
+                return np.zeros(0, dtype=ROW_DTYPE)
+
+    def read_since(self, seq):
+        """
+        return (columns, next_seq): a dict of read-only views of every row held with a
+        sequence number >= seq, and the sequence number to pass next time. Rows that
+        expired, overflowed or were decimated away are missing from the 'seq' column.
+        Takes no lock and copies nothing, so it can be called from any thread.
+        """
+        cols, start, end, next_seq = self._state
+        i = start + int(np.searchsorted(cols['seq'][start:end], seq))
+        out = {}
+        for c, col in cols.items():
+            view = col[i:end]
+            view.flags.writeable = False
+            out[c] = view
+        return out, next_seq
+
+    def latest(self, n):
+        """ views of the newest n rows held """
+        cols, start, end, _next_seq = self._state
+        i = max(start, end - n)
+        return {c: col[i:end] for c, col in cols.items()}
+
+    @staticmethod
+    def front_average(cols):
+        """ average of the two frontal sensors (ch2, ch3) per row, as float64 """
+        return (cols['ch2'].astype(np.float64) + cols['ch3']) / 2.
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of MuseConnect's OSC server types
+
+Sends alpha_absolute packets (four floats plus the --osc-timestamp pair, like
+muse-io) from a separate process at a series of rates, and reports for each server
+type how many packets per second MuseConnect handled and how much CPU it used.
+
+    python -m museEEG.bench_osc --seconds 5 --rates 1000 5000 20000
+
+With --capture, a recorded session (see osc_replay.py) is replayed instead, at each
+--speeds factor ('max' for as fast as possible), and every band power and raw EEG
+message handled counts.
+"""
+
+import argparse
+import multiprocessing
+import time
+
+from pythonosc import udp_client
+
+from .museconnect import MuseConnect, OSC_SERVERS, BANDS
+from .osc_replay import OSCReplayer
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def _cpu_seconds():
+    """ CPU time used by this process, every thread included """
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+    return time.process_time()
+
+
+def _send(port, rate, seconds):
+    """ send alpha packets to port at rate per second for seconds, in bursts every ms """
+    client = udp_client.SimpleUDPClient("127.0.0.1", port)
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            break
+        due = int(elapsed * rate)
+        while sent < due:
+            now = time.time()
+            client.send_message("/muse/elements/alpha_absolute",
+                                [0.1, 0.2, 0.3, 0.4, int(now), int((now % 1) * 1e6)])
+            sent += 1
+        time.sleep(0.001)
+
+
+def _replay(port, capture, speed):
+    OSCReplayer(capture, port=port, speed=speed).run()
+
+
+def _handled(muse):
+    """ band power and raw EEG messages MuseConnect has taken in """
+    return sum(getattr(muse, band).next_seq for band in BANDS) + muse.raw_eeg.written
+
+
+def run(server, rate, seconds, capture=None):
+    """
+    returns (packets sent, packets handled per second, CPU %, CPU milliseconds per 1000 packets);
+    with capture, rate is the replay speed (None: as fast as possible) and seconds is ignored
+    """
+    muse = MuseConnect(port=0, verbose=False, server=server, max_rows=1 << 20, raw_eeg=capture is not None)
+    port = muse.oscServer.server_address[1]
+    muse.start()
+    time.sleep(0.2)
+    if capture is None:
+        sender = multiprocessing.Process(target=_send, args=(port, rate, seconds))
+        sent = int(rate * seconds)
+    else:
+        sender = multiprocessing.Process(target=_replay, args=(port, capture, rate))
+        sent = len(OSCReplayer(capture).records)
+    cpu0, wall0 = _cpu_seconds(), time.perf_counter()
+    sender.start()
+    sender.join()
+    time.sleep(0.2)  # let the last packets through
+    cpu, wall = _cpu_seconds() - cpu0, time.perf_counter() - wall0
+    handled = _handled(muse)
+    muse.shutdown()
+    muse.oscServer.server_close()
+    return sent, handled / wall, 100. * cpu / wall, 1e6 * cpu / max(handled, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5., help="seconds to send at each rate")
+    parser.add_argument("--rates", type=int, nargs="+", default=[1000, 5000, 20000],
+                        help="packets per second to send")
+    parser.add_argument("--servers", nargs="+", default=sorted(OSC_SERVERS), choices=sorted(OSC_SERVERS))
+    parser.add_argument("--capture", default=None, help="replay this OSC capture instead of sending alpha packets")
+    parser.add_argument("--speeds", nargs="+", default=["max"], help="replay speeds for --capture, e.g. 1 4 max")
+    args = parser.parse_args()
+
+    print("%-10s %8s %10s %12s %8s %16s" % ("server", "rate", "sent", "handled/s", "CPU %", "CPU ms/1000 pkt"))
+    if args.capture is None:
+        for rate in args.rates:
+            for server in args.servers:
+                sent, pps, cpu_pct, cpu = run(server, rate, args.seconds)
+                print("%-10s %8i %10i %12.0f %8.1f %16.1f" % (server, rate, sent, pps, cpu_pct, cpu))
+    else:
+        for speed in args.speeds:
+            for server in args.servers:
+                sent, pps, cpu_pct, cpu = run(server, None if speed == "max" else float(speed), 0,
+                                              capture=args.capture)
+                print("%-10s %8s %10i %12.0f %8.1f %16.1f" % (server, speed if speed == "max" else speed + "x", sent, pps, cpu_pct, cpu))
@@ -8,6 +8,8 @@ date: 2015.09.30
 
 
 import argparse
+import logging
+import os
 import threading
 import time
 
@@ -16,6 +18,45 @@ from collections import deque
 from pythonosc import dispatcher
 from pythonosc import osc_server
 
+from streams.notify import ChangeNotifier
+
+from .bandbuffer import BandBuffer, DROP_OLDEST
+from .osc_async import AsyncOSCReceiver
+from .osc_replay import RecordingDispatcher
+from . import spectral
+
+log = logging.getLogger(__name__)
+
+# OSC server types MuseConnect can run, see MuseConnect.__init__
+OSC_SERVERS = {
+    'threading': osc_server.ThreadingOSCUDPServer,  # a new thread per datagram
+    'blocking': osc_server.BlockingOSCUDPServer,  # one thread, datagrams handled in turn
+    'asyncio': AsyncOSCReceiver,  # one asyncio event loop thread
+}
+
+BANDS = ['delta_absolute', 'theta_absolute', 'alpha_absolute', 'beta_absolute', 'gamma_absolute',
+         'delta_relative', 'theta_relative', 'alpha_relative', 'beta_relative', 'gamma_relative']
+# the same bands computed on this host from /muse/eeg, see museEEG/spectral.py
+COMPUTED_BANDS = [band + '_computed' for band in BANDS]
+
+# OSC path -> (handler method, name passed to it or None)
+OSC_HANDLERS = {
+    "/muse/batt": ("battery_handler", "battery"),
+    "/muse/elements/touching_forehead": ("touchingforehead_handler", "touchingforehead"),
+    "/muse/elements/horseshoe": ("horseshoe_handler", "horseshoe"),
+    # "/muse/elements/delta_absolute": ("eeg_bandpower_handler", "delta_absolute"),
+    # "/muse/elements/theta_absolute": ("eeg_bandpower_handler", "theta_absolute"),
+    "/muse/elements/alpha_absolute": ("eeg_bandpower_handler", "alpha_absolute"),
+    # "/muse/elements/beta_absolute": ("eeg_bandpower_handler", "beta_absolute"),
+    # "/muse/elements/gamma_absolute": ("eeg_bandpower_handler", "gamma_absolute"),
+    # "/muse/elements/delta_relative": ("eeg_bandpower_handler", "delta_relative"),
+    # "/muse/elements/theta_relative": ("eeg_bandpower_handler", "theta_relative"),
+    # "/muse/elements/alpha_relative": ("eeg_bandpower_handler", "alpha_relative"),
+    # "/muse/elements/beta_relative": ("eeg_bandpower_handler", "beta_relative"),
+    # "/muse/elements/gamma_relative": ("eeg_bandpower_handler", "gamma_relative"),
+    "/muse/eeg": ("eeg_handler", None),
+}
+
 
 class MuseConnect(object):
     """
@@ -34,28 +75,97 @@ class MuseConnect(object):
     Each member that catches information from the muse-io OSC output puts it in a deque object after
     some basic analysis (eg averaging the frontal sensors only)
 
+    Band powers (alpha_absolute etc) go into a BandBuffer per band instead, one row of
+    device time, host time and all four channels per packet, kept for retention seconds.
+    popAll/get_alpha consume them as front averages; read_since gives NumPy views.
+    Each buffer holds at most max_rows rows; overflow picks what happens beyond that
+    ('drop_oldest', 'decimate', or 'spill' to a file per band in spill_dir), see
+    BandBuffer. bufferStats() reports the overflow counters and high-water marks.
+    Reading never blocks the OSC handlers: read_since(name, seq) is a lock-free
+    snapshot of the rows from seq on, and consume(name) hands every row since the last
+    consume/popAll/get_alpha over in one go, as views, by moving a sequence number.
+    consume and the calls built on it are meant for one consumer (the state control);
+    any other reader keeps its own sequence number and uses read_since.
+
+    server picks how OSC datagrams are received: 'threading' (pythonosc's
+    ThreadingOSCUDPServer, a thread per datagram), 'blocking' or 'asyncio' (both
+    dispatch every datagram from one thread). The handlers are the same for all;
+    museEEG/bench_osc.py compares their throughput and CPU use.
+
+    shared_rings maps band names (e.g. "alpha_absolute") to streams.shm_ring.SharedRing
+    objects with EEG_BAND_COLUMNS; each band packet is also written there, all four
+    channels, for readers in other processes.
+
+    Raw EEG from /muse/eeg (raw_fs samples a second: 220 for the 2014 Muse, 256 for
+    the 2016 one) is kept in a RawEEGBuffer, and every band_step samples the band
+    powers of the last band_window samples are computed from it (spectral.py) into
+    the "<band>_computed" buffers, e.g. "alpha_absolute_computed". alpha_source picks
+    whether get_alpha serves muse-io's alpha_absolute ('elements') or the computed
+    one ('computed'); crossCheck() compares the two. /muse/eeg is only taken in with
+    alpha_source='computed' or raw_eeg=True: otherwise it is not even dispatched, so
+    the Welch PSDs do not run in the OSC handler threads for nothing.
+
+    With record_path every datagram received is also appended to that capture file,
+    with its arrival time; osc_replay.py plays such a file back into MuseConnect.
+
+    One MuseConnect can serve several headsets on one port and one server. route picks
+    how a message is matched to its headset:
+        'prefix'   by the first element of the OSC address, run muse-io with
+                   --prefix /booth-7 to get /booth-7/muse/elements/alpha_absolute;
+                   messages without a prefix are kept by this MuseConnect itself
+        'address'  by the source address the datagram came from, "ip:port"
+    device(device_id) returns the MuseConnect holding that headset's buffers and
+    contact state (created on first use, or when its first message arrives), with the
+    usual get_alpha/is_on_forehead/... API. Those device views have no server of
+    their own (server=None). devices names the headsets to set up right away: a
+    list of ids, or for 'address' a dict of id -> source address. Register sources
+    by ip only ("10.0.0.7"): muse-io binds a new source port every time it starts, so
+    an "ip:port" source is lost when it restarts.
+    auto_add picks what happens to messages from a headset nobody named: True adds a
+    view for it (by prefix, or by "ip:port"), False logs and drops them. It defaults to
+    False when devices is given, so a restarted muse-io or a stray sender cannot take
+    a booth's data away from its view or pile views up.
+
+    Instead of polling onForehead and curSensorState, subscribe to contact_notifier
+    (called with (on forehead, device time)) and horseshoe_notifier (with (the four
+    channel states, device time)); both are debounced by contact_debounce seconds,
+    see streams/notify.py. Without --osc-timestamp the host time stands in for the
+    device time.
+
     """
-    def __init__(self, ipAddress="127.0.0.1", port=5000, verbose=True):
-        self.verbose = verbose  # if true, print all caught OSC packet analysis products
+    def __init__(self, ipAddress="127.0.0.1", port=5000, verbose=True, shared_rings=None, retention=60.,
+                 max_rows=4096, overflow=DROP_OLDEST, spill_dir=None, server='threading', raw_fs=220,
+                 band_window=None, band_step=None, alpha_source='elements', record_path=None, route=None,
+                 devices=None, device_id=None, contact_debounce=.5, auto_add=None, raw_eeg=False):
+        # if true, log all caught OSC packet analysis products at debug level; whether those
+        # are shown is up to the logging setup, e.g. setup_logging(levels={'museEEG': logging.DEBUG})
+        self.verbose = verbose
+        self.shared_rings = shared_rings or {}
 
         self.connected = False
-        self.oscDispatcher = dispatcher.Dispatcher()
+        # the recorder is a Dispatcher too, so it sees exactly what gets dispatched
+        self.recorder = RecordingDispatcher(record_path) if record_path is not None else None
+        self.oscDispatcher = self.recorder if self.recorder is not None else dispatcher.Dispatcher()
         # oscDispatcher.map("/debug", print)
-        self.oscDispatcher.map("/muse/batt", self.battery_handler, "battery")
-        self.oscDispatcher.map("/muse/elements/touching_forehead", self.touchingforehead_handler, "touchingforehead")
-        self.oscDispatcher.map("/muse/elements/horseshoe", self.horseshoe_handler, "horseshoe")
-
-        # self.oscDispatcher.map("/muse/elements/delta_absolute", self.eeg_bandpower_handler, "delta_absolute")
-        # self.oscDispatcher.map("/muse/elements/theta_absolute", self.eeg_bandpower_handler, "theta_absolute")
-        self.oscDispatcher.map("/muse/elements/alpha_absolute", self.eeg_bandpower_handler, "alpha_absolute")
-        # self.oscDispatcher.map("/muse/elements/beta_absolute", self.eeg_bandpower_handler, "beta_absolute")
-        # self.oscDispatcher.map("/muse/elements/gamma_absolute", self.eeg_bandpower_handler, "gamma_absolute")
-
-        # self.oscDispatcher.map("/muse/elements/delta_relative", self.eeg_bandpower_handler, "delta_relative")
-        # self.oscDispatcher.map("/muse/elements/theta_relative", self.eeg_bandpower_handler, "theta_relative")
-        # self.oscDispatcher.map("/muse/elements/alpha_relative", self.eeg_bandpower_handler, "alpha_relative")
-        # self.oscDispatcher.map("/muse/elements/beta_relative", self.eeg_bandpower_handler, "beta_relative")
-        # self.oscDispatcher.map("/muse/elements/gamma_relative", self.eeg_bandpower_handler, "gamma_relative")
+        if route not in (None, 'prefix', 'address'):
+            raise ValueError("unknown routing: {}".format(route))
+        self.route = route
+        self.device_id = device_id
+        self.auto_add = not devices if auto_add is None else auto_add
+        self.dropped = 0  # messages from unknown headsets, when not auto_add
+        self.ingest_raw = raw_eeg or alpha_source == 'computed'  # handle /muse/eeg
+        if route is None:
+            for path, (method, name) in OSC_HANDLERS.items():
+                if method == "eeg_handler" and not self.ingest_raw:
+                    continue
+                if name is None:
+                    self.oscDispatcher.map(path, getattr(self, method))
+                else:
+                    self.oscDispatcher.map(path, getattr(self, method), name)
+        else:
+            # nothing is mapped, so every message ends up here; _route finds the device and
+            # handler with two dict lookups, however many headsets there are
+            self.oscDispatcher.set_default_handler(self._route, needs_reply_address=True)
 
         # each of these should be an empty queue,
         # where each element holds a tuple of (timestamp, value)
@@ -67,48 +177,144 @@ class MuseConnect(object):
         self._contactTransTime = 0  # the time that we observed the transition of contact state
         self.horseshoe = deque()
         self.curSensorState = None  # hold just the most recent value from horseshoe
-
-        self.delta_absolute = deque()
-        self.theta_absolute = deque()
-        self.alpha_absolute = deque()
-        self.beta_absolute = deque()
-        self.gamma_absolute = deque()
-
-        self.delta_relative = deque()
-        self.theta_relative = deque()
-        self.alpha_relative = deque()
-        self.beta_relative = deque()
-        self.gamma_relative = deque()
-
+        self.contact_notifier = ChangeNotifier(contact_debounce)
+        self.horseshoe_notifier = ChangeNotifier(contact_debounce)
+
+        # band power columns, and the sequence number popAll has consumed up to, per band
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)  # before the first overflow, not in the OSC handler
+        for band in BANDS + COMPUTED_BANDS:
+            spill_path = os.path.join(spill_dir, band + ".bin") if spill_dir is not None else None
+            setattr(self, band, BandBuffer(retention, max_rows=max_rows, overflow=overflow, spill_path=spill_path))
+        self._popped = dict.fromkeys(BANDS + COMPUTED_BANDS, 0)
+        self.unread_high_water = dict.fromkeys(BANDS + COMPUTED_BANDS, 0)  # most rows waiting for popAll at once
+        self.missed = dict.fromkeys(BANDS + COMPUTED_BANDS, 0)  # rows gone (expired, dropped, spilled) before popAll got them
+
+        # raw EEG, and the band powers computed from it
+        if alpha_source not in ('elements', 'computed'):
+            raise ValueError("alpha_source must be 'elements' or 'computed', not {}".format(alpha_source))
+        self.alpha_source = alpha_source
+        self.raw_eeg = spectral.RawEEGBuffer(int(raw_fs * retention))
+        self.band_power = spectral.SlidingBandPower(self.raw_eeg, raw_fs, band_window, band_step)
+        self._spectral_lock = threading.Lock()  # one handler thread computes at a time
+
+        # the headsets routed to, by id, and for route='address' the id of each source address
+        self.devices = {}
+        self._sources = {}
+        self._devices_lock = threading.Lock()
+        self._device_settings = dict(verbose=verbose, retention=retention, max_rows=max_rows, overflow=overflow,
+                                     raw_fs=raw_fs, band_window=band_window, band_step=band_step,
+                                     alpha_source=alpha_source, contact_debounce=contact_debounce, raw_eeg=raw_eeg)
+        self._spill_dir = spill_dir
+        if isinstance(devices, dict):
+            for dev, source in devices.items():
+                self.device(dev, source)
+        else:
+            for dev in devices or []:
+                self.device(dev)
+
+        self.oscServer = None
+        if server is None:
+            return  # a device view, fed by the MuseConnect that routes to it
         # self.oscServer = osc_server.ForkingOSCUDPServer((ipAddress, port), self.oscDispatcher)
-        self.oscServer = osc_server.ThreadingOSCUDPServer((ipAddress, port), self.oscDispatcher)
+        if server not in OSC_SERVERS:
+            raise ValueError("unknown OSC server type: {}".format(server))
+        self.oscServer = OSC_SERVERS[server]((ipAddress, port), self.oscDispatcher)
         self.oscServer.daemon = True
-        print("Muse OSC client running on {}".format(self.oscServer.server_address))
+        log.info("Muse OSC client (%s) running on %s", server, self.oscServer.server_address)
 
     def start(self):
         """
         start the osc server & message handler
         """
         self.connected = True
+        if self.oscServer is None:
+            return  # a device view, see device()
         # self.oscServer.serve_forever()
         t = threading.Thread(target=self.oscServer.serve_forever)
         t.daemon = False
         t.start()
-        print("Started Muse OSC reader")
+        log.info("Started Muse OSC reader")
 
     def shutdown(self):
         """
         close the osc server
         """
         # do we actually even need this?
-        self.oscServer.shutdown()
+        if self.oscServer is not None:
+            self.oscServer.shutdown()
+        if self.recorder is not None:
+            self.recorder.close_recording()
 
-    def vprint(self, value):
+    def device(self, device_id, source=None):
+        """
+        the MuseConnect for headset device_id, created if it is new. With route='address',
+        source ("ip" or "ip:port") is where its datagrams come from; otherwise its
+        messages are recognized by the source address itself, as its id
+        """
+        with self._devices_lock:
+            view = self.devices.get(device_id)
+            if view is None:
+                spill_dir = None
+                if self._spill_dir is not None:
+                    spill_dir = os.path.join(self._spill_dir, device_id)
+                view = MuseConnect(server=None, device_id=device_id, spill_dir=spill_dir, **self._device_settings)
+                self.devices[device_id] = view
+                log.info("Muse headset %s added", device_id)
+            if source is not None:
+                self._sources[source] = device_id
+            return view
+
+    def _route(self, client_address, address, *args):
+        """ dispatcher default handler when routing: hand the message to its device's handler """
+        if self.route == 'prefix':
+            if address.startswith("/muse/"):
+                target, path = self, address
+                if path not in OSC_HANDLERS:
+                    return  # e.g. /muse/acc, from a headset sending without a prefix
+            else:
+                parts = address.split("/", 2)  # ['', 'booth-7', 'muse/elements/...']
+                path = "/" + parts[2] if len(parts) == 3 else address
+                if path not in OSC_HANDLERS:
+                    return  # a message MuseConnect does not use, e.g. /booth-7/muse/acc
+                target = self.devices.get(parts[1])
+                if target is None:
+                    if not self.auto_add:
+                        self._drop_unknown(parts[1])
+                        return
+                    target = self.device(parts[1])
+        else:
+            path = address
+            if path not in OSC_HANDLERS:
+                return
+            ip, port = client_address[:2]
+            device_id = self._sources.get("%s:%s" % (ip, port)) or self._sources.get(ip)
+            if device_id is None:
+                device_id = "%s:%s" % (ip, port)
+                if not self.auto_add:
+                    self._drop_unknown(device_id)
+                    return
+                self.device(device_id, device_id)
+            target = self.devices[device_id]
+        method, name = OSC_HANDLERS[path]
+        if method == "eeg_handler" and not target.ingest_raw:
+            return
+        if name is None:
+            getattr(target, method)(address, *args)
+        else:
+            getattr(target, method)(address, [name], *args)
+
+    def _drop_unknown(self, source):
+        self.dropped += 1
+        log.warning("message from unknown Muse headset %s dropped", source, extra={'rate_limited': True})
+
+    def vprint(self, msg, *args):
         """
-        verbose print, only if verbose is on
+        verbose print, only if verbose is on: a debug log record, formatted (msg % args)
+        only if it is going to be shown
         """
         if self.verbose:
-            print(value, flush=True)
+            log.debug(msg, *args)
 
     def _timestamp(self, ts, tsms):
         """
@@ -132,54 +338,115 @@ class MuseConnect(object):
         updates at 0.1 Hz
         """
         # print("battery:", name, ":", chargePercent, fuelgaugeBattVolt, ADCBattVolt, temperature, ts, tsms)
-        self.vprint("battery: {}".format(chargePercent / 100.))
+        self.vprint("battery: %s", chargePercent / 100.)
         element = (self._timestamp(ts, tsms), chargePercent / 100.)
         self.battery.append(element)  # return percent charge in floating point
 
-    def touchingforehead_handler(self, address, name, touchingforehead):
+    def touchingforehead_handler(self, address, name, touchingforehead, ts=None, tsms=None):
         """
         returns value 1 if touching forehead, 0 if not
         updated at 1 Hz
         """
-        self.vprint("touchingforehead: {}".format(touchingforehead))
+        self.vprint("touchingforehead: %s", touchingforehead)
         # print("touchingforehead: {}".format(touchingforehead), flush=True)
         curtime = time.time()
         if self.onForehead != touchingforehead:
-            print("forehead contact changed state! {} to {}".format(self.onForehead, touchingforehead), flush=True)
+            log.info("forehead contact changed state! %s to %s", self.onForehead, touchingforehead)
             self._contactTransTime = curtime
         self.onForehead = touchingforehead
         self.sec_since_last_forehead_trans = curtime - self._contactTransTime
+        self.contact_notifier.update(bool(touchingforehead), curtime if ts is None else self._timestamp(ts, tsms))
 
-    def horseshoe_handler(self, address, name, ch1, ch2, ch3, ch4):
+    def horseshoe_handler(self, address, name, ch1, ch2, ch3, ch4, ts=None, tsms=None):
         """
         status indicator for each of the Muse channels
         1 = good, 2 = ok, >=3 bad
         """
         horseshoe = list(map(int, [ch1, ch2, ch3, ch4]))  # convert to ints, cause thats what we expect
-        self.vprint("horseshoe: {}".format(horseshoe))
+        self.vprint("horseshoe: %s", horseshoe)
         # print("horseshoe: {}".format(horseshoe), flush=True)
         # element = (self.timestamp(ts, tsms), horseshoe)
         # self.horseshoe.append(horseshoe)
         self.curSensorState = horseshoe
+        self.horseshoe_notifier.update(horseshoe, time.time() if ts is None else self._timestamp(ts, tsms))
 
-    def eeg_bandpower_handler(self, address, name, ch1, ch2, ch3, ch4):
+    def eeg_bandpower_handler(self, address, name, ch1, ch2, ch3, ch4, ts=None, tsms=None):
         """
-        uses class attributes to append values to the correct attribute queue
+        uses class attributes to append values to the correct band buffer.
+        ts and tsms are the device time muse-io adds with --osc-timestamp; without them
+        the host arrival time stands in for the device time
         """
-        attr = self.__getattribute__(name[0])
-        values = [ch1, ch2, ch3, ch4]
-        out = self._averageFront(values)
-        # print("{}: {}, queuelen={}".format(name[0], out, len(attr)), flush=True)
-        self.vprint("{}: {}, queuelen={}".format(name[0], out, len(attr)))
-        attr.append(out)
-        if len(attr) > 30:
-            print("{} pop: {}".format(name[0], self.popAll(name[0])))
+        host_time = time.time()
+        device_time = self._timestamp(ts, tsms) if ts is not None else host_time
+        unread = self._append_band(name[0], device_time, host_time, ch1, ch2, ch3, ch4)
+        # print("{}: {}, queuelen={}".format(name[0], out, unread), flush=True)
+        if self.verbose and log.isEnabledFor(logging.DEBUG):
+            log.debug("%s: %s, queuelen=%i", name[0], self._averageFront([ch1, ch2, ch3, ch4]), unread)
+
+    def _append_band(self, name, device_time, host_time, ch1, ch2, ch3, ch4):
+        """ store one row of band "name" (and publish it), returning how many rows popAll has not had """
+        attr = self.__getattribute__(name)
+        attr.append(device_time, host_time, ch1, ch2, ch3, ch4)
+        ring = self.shared_rings.get(name)
+        if ring is not None:
+            ring.write(timestamp=device_time, host_time=host_time, ch1=ch1, ch2=ch2, ch3=ch3, ch4=ch4)
+        unread = attr.next_seq - self._popped[name]
+        if unread > self.unread_high_water[name]:
+            self.unread_high_water[name] = unread
+        return unread
+
+    def eeg_handler(self, address, *args):
+        """
+        one raw EEG sample, microvolts per channel; with --osc-timestamp the last two
+        arguments are the device time (ts, tsms). Only the first four channels are kept.
+        Once band_step new samples are in, the band powers are brought up to date.
+        """
+        host_time = time.time()
+        if len(args) > 4 and isinstance(args[-1], int) and isinstance(args[-2], int):
+            device_time = self._timestamp(args[-2], args[-1])
+            args = args[:-2]
+        else:
+            device_time = host_time
+        self.raw_eeg.append(device_time, host_time, args)
+        if self.raw_eeg.written >= self.band_power.next_end and self._spectral_lock.acquire(blocking=False):
+            # a handler thread already computing will pick these samples up as well
+            try:
+                self._update_band_power(host_time)
+            finally:
+                self._spectral_lock.release()
+
+    def _update_band_power(self, host_time):
+        """ compute the windows that are due, into the *_computed band buffers """
+        device_time, absolute, relative = self.band_power.update()
+        for k in range(len(device_time)):
+            for j, (band, _lo, _hi) in enumerate(spectral.BANDS):
+                self._append_band(band + "_absolute_computed", device_time[k], host_time, *absolute[k, :, j])
+                self._append_band(band + "_relative_computed", device_time[k], host_time, *relative[k, :, j])
+
+    def read_since(self, name, seq):
+        """
+        (columns, next_seq) of band "name" from sequence number seq on, without consuming
+        anything: columns is a dict of NumPy views, see BandBuffer.read_since
+        """
+        return self.__getattribute__(name).read_since(seq)
+
+    def consume(self, name):
+        """
+        the rows of band "name" not consumed yet, as a dict of read-only views (see
+        read_since), marking them consumed; no copy, no lock and no per-row work
+        """
+        cols, next_seq = self.read_since(name, self._popped[name])
+        self.missed[name] += next_seq - self._popped[name] - len(cols['seq'])
+        self._popped[name] = next_seq
+        return cols
 
     def popAll(self, name):
         """
         clear the queue, using muse attribute "name", e.g. "alpha_absolute"
         """
         attr = self.__getattribute__(name)
+        if isinstance(attr, BandBuffer):
+            return BandBuffer.front_average(self.consume(name)).tolist()
         return [attr.popleft() for _i in range(len(attr))]
 
     def pop(self, name):
@@ -187,19 +454,63 @@ class MuseConnect(object):
         get oldest value in attribute with name, e.g. "alpha_absolute"
         """
         attr = self.__getattribute__(name)
+        if isinstance(attr, BandBuffer):
+            cols, _next_seq = attr.read_since(self._popped[name])
+            if not len(cols['seq']):
+                raise IndexError("pop from an empty band buffer")
+            self.missed[name] += int(cols['seq'][0]) - self._popped[name]
+            self._popped[name] = int(cols['seq'][0]) + 1
+            return self._averageFront([cols[c][0] for c in ('ch1', 'ch2', 'ch3', 'ch4')])
         return attr.popleft()
 
+    def bufferStats(self, name):
+        """
+        overflow counters and high-water marks of band "name", as a dict
+        """
+        buf = self.__getattribute__(name)
+        return {'held': len(buf), 'high_water': buf.high_water, 'overflows': buf.overflows,
+                'dropped': buf.dropped, 'spilled': buf.spilled,
+                'unread': buf.next_seq - self._popped[name],
+                'unread_high_water': self.unread_high_water[name], 'missed': self.missed[name]}
+
+    def crossCheck(self, band="alpha_absolute"):
+        """
+        compare the computed band (e.g. "alpha_absolute_computed") with the one muse-io
+        sent over everything held, without consuming either; band must be mapped in the
+        dispatcher. Returns spectral.cross_check's dict (pairs, correlation, differences)
+        """
+        computed, _next_seq = self.read_since(band + "_computed", 0)
+        elements, _next_seq = self.read_since(band, 0)
+        return spectral.cross_check(computed, elements)
+
+    def _alpha_name(self):
+        return "alpha_absolute" if self.alpha_source == 'elements' else "alpha_absolute_computed"
+
     def get_alpha(self):
         """
         the specific function used in Change Your Mind to get
-        the absolute alpha power
+        the absolute alpha power, from muse-io or computed here (see alpha_source)
         """
-        if not self.alpha_absolute:
-            print("nothing in alpha", flush=True)
-        alpha_buffer = self.popAll("alpha_absolute")
-        print("popping {} alpha values".format(len(alpha_buffer)), flush=True)
+        name = self._alpha_name()
+        missed = self.missed[name]
+        alpha_buffer = self.popAll(name)
+        if self.missed[name] != missed:
+            log.warning("alpha buffer overflowed, %i values lost since the last read", self.missed[name] - missed)
+        if not alpha_buffer:
+            log.info("nothing in alpha", extra={'rate_limited': True})
+        log.debug("popping %i alpha values", len(alpha_buffer))
         return alpha_buffer
 
+    def get_alpha_block(self):
+        """
+        like get_alpha, but return the new alpha rows as a dict of arrays:
+        'value' (the front average get_alpha returns), 'device_time', 'host_time'
+        and the four channels 'ch1'..'ch4'
+        """
+        cols = dict(self.consume(self._alpha_name()))
+        cols['value'] = BandBuffer.front_average(cols)
+        return cols
+
     def is_on_forehead(self):
         return self.onForehead
 
@@ -225,10 +536,23 @@ if __name__ == "__main__":
                         type=int,
                         default=5000,
                         help="The port to listen on")
+    parser.add_argument("--server",
+                        default="threading",
+                        choices=sorted(OSC_SERVERS),
+                        help="How to receive the OSC datagrams")
+    parser.add_argument("--alpha",
+                        default="elements",
+                        choices=["elements", "computed"],
+                        help="Serve muse-io's alpha_absolute or the one computed from /muse/eeg")
+    parser.add_argument("--record",
+                        default=None,
+                        help="Append every OSC datagram to this capture file, see osc_replay.py")
     args = parser.parse_args()
 
+    from logconfig import setup_logging  # at the repository root, run this as python -m museEEG.museconnect
+    setup_logging(logging.DEBUG)
     #muse = MuseConnect(args.ip, args.port, verbose=True)
-    muse = MuseConnect(verbose=True)
+    muse = MuseConnect(verbose=True, server=args.server, alpha_source=args.alpha, record_path=args.record)
     muse.start()
 
     # catch the kill stroke
@@ -238,5 +562,5 @@ if __name__ == "__main__":
             print(muse.get_alpha())
 
     except KeyboardInterrupt :
-        print("\nClosing OSCServer.")
+        log.info("Closing OSCServer.")
         muse.shutdown()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+AsyncOSCReceiver
+OSC over UDP dispatched from one asyncio event loop
+
+pythonosc's ThreadingOSCUDPServer starts a thread per datagram, which at Muse element
+and raw EEG rates means hundreds of thread starts a second. This receiver hands every
+datagram to the dispatcher from a single event loop thread instead, using pythonosc's
+AsyncIOOSCUDPServer, and offers the serve_forever/shutdown/server_address interface
+of the socketserver based servers so MuseConnect can use either.
+"""
+
+import asyncio
+
+from pythonosc import osc_server
+
+
+class AsyncOSCReceiver(object):
+    """
+    binds server_address right away, like the socketserver servers; serve_forever()
+    then runs the event loop in the calling thread until shutdown()
+    """
+
+    def __init__(self, server_address, dispatcher):
+        self.loop = asyncio.new_event_loop()
+        self._server = osc_server.AsyncIOOSCUDPServer(server_address, dispatcher, self.loop)
+        self.transport, self.protocol = self.loop.run_until_complete(self._server.create_serve_endpoint())
+        self.server_address = self.transport.get_extra_info('sockname')
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.transport.close()
+            self.loop.run_until_complete(asyncio.sleep(0))  # let the transport finish closing
+            self.loop.close()
+
+    def shutdown(self):
+        """ stop the loop; safe to call from any thread """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def server_close(self):
+        if not self.loop.is_running() and not self.loop.is_closed():
+            self.transport.close()
+            self.loop.close()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Muse OSC capture and replay
+
+RecordingDispatcher is a pythonosc Dispatcher that appends every datagram it is
+given to a capture file, with the host time it arrived, before dispatching it as
+usual; MuseConnect(record_path=...) uses one, so a session is recorded exactly as
+MuseConnect received it. OSCReplayer sends a capture file back out over UDP at the
+recorded pace, N times faster, or as fast as possible, so a visitor session can be
+played into MuseConnect (or the whole booth) without a headset or muse-io:
+
+    python -m museEEG.osc_replay session.bin --port 5000 --speed 4
+    python -m museEEG.osc_replay session.bin --port 5000 --speed max
+
+Capture file layout, the same as ecg/serial_replay.py's: the MAGIC header, then one
+record per datagram of
+    float64 host time (unix epoch seconds), uint32 length, length bytes of datagram
+all little endian. Records are only ever appended.
+"""
+
+import argparse
+import socket
+import struct
+import threading
+import time
+
+from pythonosc import dispatcher
+
+MAGIC = b'CYMOSC1\n'
+_RECORD = struct.Struct('<dI')
+
+
+def read_capture(path):
+    """ return the list of (host time, datagram) records in a capture file """
+    records = []
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an OSC capture file".format(path))
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            t, n = _RECORD.unpack(header)
+            data = f.read(n)
+            if len(data) < n:
+                break  # cut short, e.g. the recorder was killed mid write
+            records.append((t, data))
+    return records
+
+
+class RecordingDispatcher(dispatcher.Dispatcher):
+    """
+    Dispatcher that records every datagram to path (appending, if the file is already
+    a capture) before handling it. The writes are buffered; close_recording() or
+    flush() get them onto disk.
+    """
+
+    def __init__(self, path):
+        super(RecordingDispatcher, self).__init__()
+        self.path = path
+        self.recorded = 0
+        self._lock = threading.Lock()  # the threading OSC server dispatches from several threads
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def call_handlers_for_packet(self, data, client_address):
+        with self._lock:
+            # stamped under the lock, so the capture's times never go backwards
+            if self._file is not None:
+                self._file.write(_RECORD.pack(time.time(), len(data)))
+                self._file.write(data)
+                self.recorded += 1
+        return super(RecordingDispatcher, self).call_handlers_for_packet(data, client_address)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close_recording(self):
+        """ write out what is buffered and close the capture file; dispatching goes on """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class OSCReplayer(object):
+    """
+    sends the datagrams of a capture file to (host, port) over UDP.
+    speed is the playback rate relative to the recording, None (or 0) for as fast
+    as possible; loop=True starts over at the end until stop().
+    """
+
+    def __init__(self, path, host="127.0.0.1", port=5000, speed=1., loop=False):
+        self.records = read_capture(path)
+        self.address = (host, port)
+        self.speed = speed or None
+        self.loop = loop
+        self.sent = 0
+        self._stop = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def run(self):
+        """ send the capture (over and over, with loop) in the calling thread; returns the datagrams sent """
+        while not self._stop.is_set():
+            self._play_once()
+            if not self.loop or not self.records:
+                break
+        return self.sent
+
+    def _play_once(self):
+        if not self.records:
+            return
+        t_first = self.records[0][0]
+        start = time.monotonic()
+        for t, data in self.records:
+            if self._stop.is_set():
+                return
+            if self.speed is not None:
+                wait = (t - t_first) / self.speed - (time.monotonic() - start)
+                if wait > 0:
+                    self._stop.wait(wait)
+            self._sock.sendto(data, self.address)
+            self.sent += 1
+
+    def start(self):
+        """ run() in a daemon thread, returned """
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+        return t
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        self.stop()
+        self._sock.close()
+
+    def duration(self):
+        """ recorded seconds from the first datagram to the last """
+        return self.records[-1][0] - self.records[0][0] if self.records else 0.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", help="capture file written by MuseConnect(record_path=...)")
+    parser.add_argument("--ip", default="127.0.0.1", help="The ip to send to")
+    parser.add_argument("--port", type=int, default=5000, help="The port to send to")
+    parser.add_argument("--speed", default="1", help="playback rate, e.g. 1, 4, or max")
+    parser.add_argument("--loop", action="store_true", help="start over at the end")
+    args = parser.parse_args()
+
+    replayer = OSCReplayer(args.capture, args.ip, args.port,
+                           speed=None if args.speed == "max" else float(args.speed), loop=args.loop)
+    print("replaying {} datagrams ({:.1f} s recorded) to {}:{}".format(
+        len(replayer.records), replayer.duration(), args.ip, args.port))
+    t0 = time.monotonic()
+    try:
+        replayer.run()
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - t0
+    print("sent {} datagrams in {:.2f} s ({:.0f}/s)".format(replayer.sent, elapsed, replayer.sent / max(elapsed, 1e-9)))
+    replayer.close()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Band power from raw Muse EEG
+
+RawEEGBuffer keeps the raw 4 channel samples from /muse/eeg in preallocated arrays.
+SlidingBandPower turns them into delta/theta/alpha/beta/gamma power every `step`
+samples, over the last `window` samples, with Welch's method (Hamming windowed,
+half overlapping segments) computed for all channels, and for every window that is
+due, in one batch of FFTs.
+
+The outputs follow muse-io's definitions, so they can be compared with the
+/muse/elements/*_absolute and *_relative messages (see cross_check):
+    absolute  log10 of the summed power spectral density over the band
+    relative  the band's (linear) power over the sum of all five bands
+muse-io uses 1 s windows at 10 Hz; window and step set the latency and rate here.
+"""
+
+import threading
+
+import numpy as np
+
+# Hz, as in the muse-io documentation; alpha and theta overlap at 7.5-8 Hz
+BANDS = [('delta', 1., 4.), ('theta', 4., 8.), ('alpha', 7.5, 13.), ('beta', 13., 30.), ('gamma', 30., 44.)]
+
+
+class RawEEGBuffer(object):
+    """
+    the last capacity raw samples: device_time, host_time and a (capacity, channels)
+    array of EEG values in microvolts. Samples have sequence numbers like BandBuffer rows.
+    """
+
+    def __init__(self, capacity=256 * 60, channels=4):
+        self.capacity = capacity
+        self.channels = channels
+        self.device_time = np.zeros(capacity)
+        self.host_time = np.zeros(capacity)
+        self.eeg = np.zeros((capacity, channels), dtype=np.float32)
+        self.written = 0  # total samples, the sequence number of the next one
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, device_time, host_time, values):
+        with self._lock:
+            i = self.written % self.capacity
+            self.device_time[i] = device_time
+            self.host_time[i] = host_time
+            self.eeg[i] = values[:self.channels]
+            self.written += 1
+
+    def read(self, start_seq, stop_seq=None):
+        """
+        copies of (device_time, host_time, eeg) for sequence numbers start_seq up to
+        stop_seq (default: everything written), limited to what is still held
+        """
+        with self._lock:
+            stop = self.written if stop_seq is None else min(stop_seq, self.written)
+            start = max(start_seq, self.written - self.capacity, 0)
+            idx = np.arange(start, max(start, stop)) % self.capacity
+            return self.device_time[idx], self.host_time[idx], self.eeg[idx]
+
+
+def welch_psd(x, Fs, nperseg):
+    """
+    Welch power spectral density along the last axis of x (any leading shape),
+    Hamming windowed segments of nperseg with 50% overlap.
+    Returns (frequencies, psd) with psd shaped x.shape[:-1] + (nperseg // 2 + 1,)
+    """
+    step = nperseg // 2
+    n_seg = (x.shape[-1] - nperseg) // step + 1
+    starts = np.arange(n_seg) * step
+    segments = x[..., starts[:, None] + np.arange(nperseg)]  # (..., n_seg, nperseg)
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    w = np.hamming(nperseg)
+    spectrum = np.fft.rfft(segments * w, axis=-1)
+    psd = (spectrum.real ** 2 + spectrum.imag ** 2) / (Fs * (w * w).sum())
+    psd[..., 1:-1] *= 2  # one sided
+    return np.fft.rfftfreq(nperseg, 1. / Fs), psd.mean(axis=-2)
+
+
+def band_powers(freqs, psd):
+    """ (absolute, relative) band powers, each shaped psd.shape[:-1] + (len(BANDS),) """
+    linear = np.stack([psd[..., (freqs >= lo) & (freqs < hi)].sum(axis=-1) for _name, lo, hi in BANDS],
+                      axis=-1)
+    absolute = np.log10(np.maximum(linear, 1e-12))
+    relative = linear / np.maximum(linear.sum(axis=-1, keepdims=True), 1e-12)
+    return absolute, relative
+
+
+class SlidingBandPower(object):
+    """
+    band powers of the last window samples, every step samples, of a RawEEGBuffer.
+    update() computes every window that became due since the last call at once and
+    returns them; nperseg is the Welch segment length (default: window / 2).
+    """
+
+    def __init__(self, raw, Fs=220, window=None, step=None, nperseg=None):
+        self.raw = raw
+        self.Fs = Fs
+        self.window = window or int(Fs)  # 1 s, like muse-io
+        self.step = step or max(1, int(round(Fs / 10.)))  # 10 Hz, like muse-io
+        self.nperseg = nperseg or self.window // 2
+        self.next_end = self.window  # sequence number one past the last sample of the next window
+
+    def update(self):
+        """
+        returns (device_time, absolute, relative): the device time of each new window's
+        last sample, shape (n,), and its powers, shape (n, channels, len(BANDS))
+        """
+        written = self.raw.written
+        if self.next_end < written - self.raw.capacity + self.window:
+            # fell more than a buffer behind, continue with the newest windows held
+            behind = written - self.raw.capacity + self.window - self.next_end
+            self.next_end += -(-behind // self.step) * self.step
+        if written < self.next_end:
+            empty = np.zeros((0, self.raw.channels, len(BANDS)))
+            return np.zeros(0), empty, empty
+        ends = np.arange(self.next_end, written + 1, self.step)
+        self.next_end = ends[-1] + self.step
+        device_time, _host, eeg = self.raw.read(ends[0] - self.window, ends[-1])
+        # (n windows, channels, window samples), gathered from the one block read
+        offsets = ends - ends[0]
+        x = eeg.T.astype(np.float64)[:, offsets[:, None] + np.arange(self.window)]
+        freqs, psd = welch_psd(np.swapaxes(x, 0, 1), self.Fs, self.nperseg)
+        absolute, relative = band_powers(freqs, psd)
+        return device_time[offsets + self.window - 1], absolute, relative
+
+
+def cross_check(computed, elements):
+    """
+    compare a computed band stream with the one muse-io sent, both dicts with
+    'device_time' and 'ch1'..'ch4' (e.g. from MuseConnect.read_since), matching
+    each computed row to the nearest muse-io row in device time.
+    Returns a dict with the number of pairs, the correlation, and the mean and
+    standard deviation of computed - muse-io, over all channels.
+    """
+    t = np.asarray(elements['device_time'])
+    if len(t) == 0 or len(computed['device_time']) == 0:
+        return {'pairs': 0, 'correlation': np.nan, 'mean_difference': np.nan, 'std_difference': np.nan}
+    i = np.clip(np.searchsorted(t, computed['device_time']), 1, max(len(t) - 1, 1))
+    left = np.abs(t[i - 1] - computed['device_time']) <= np.abs(t[np.minimum(i, len(t) - 1)] - computed['device_time'])
+    nearest = np.where(left, i - 1, np.minimum(i, len(t) - 1))
+    a = np.concatenate([np.asarray(computed[c], dtype=float) for c in ('ch1', 'ch2', 'ch3', 'ch4')])
+    b = np.concatenate([np.asarray(elements[c], dtype=float)[nearest] for c in ('ch1', 'ch2', 'ch3', 'ch4')])
+    ok = np.isfinite(a) & np.isfinite(b)
+    a, b = a[ok], b[ok]
+    corr = np.corrcoef(a, b)[0, 1] if len(a) > 1 and a.std() > 0 and b.std() > 0 else np.nan
+    return {'pairs': len(a) // 4, 'correlation': corr,
+            'mean_difference': (a - b).mean() if len(a) else np.nan,
+            'std_difference': (a - b).std() if len(a) else np.nan}
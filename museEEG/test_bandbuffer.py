@@ -0,0 +1,91 @@
+"""
+Tests for the columnar band power buffer, run with pytest from the repository root
+"""
+import threading
+
+import numpy as np
+
+from .bandbuffer import BandBuffer
+
+
+def fill(buf, n, start=0, rate=10.):
+    for k in range(start, start + n):
+        t = 1000. + k / rate
+        buf.append(t - 0.05, t, k, k + 1, k + 2, k + 3)
+
+
+def test_read_since_returns_new_rows_as_stable_views():
+    buf = BandBuffer(retention=60., initial_capacity=4)
+    fill(buf, 10)
+    cols, seq = buf.read_since(0)
+    assert seq == 10 and cols['ch1'].tolist() == list(range(10))
+    assert np.allclose(cols['host_time'] - cols['device_time'], 0.05)
+    fill(buf, 100, start=10)  # grows the arrays several times
+    assert cols['ch1'].tolist() == list(range(10))  # the earlier views still hold their rows
+    new, seq = buf.read_since(seq)
+    assert new['ch1'].tolist() == list(range(10, 110)) and seq == 110
+    assert np.allclose(BandBuffer.front_average(new), np.arange(10, 110) + 1.5)
+
+
+def test_rows_older_than_the_retention_window_are_dropped():
+    buf = BandBuffer(retention=5., initial_capacity=16)
+    fill(buf, 2000)  # 200 s at 10 Hz
+    assert len(buf) <= 2 * 51 + 16
+    cols, seq = buf.read_since(0)  # too old, starts at the oldest row held
+    assert seq == 2000 and cols['ch1'][0] == buf.first_seq
+    assert cols['host_time'][-1] - cols['host_time'][0] >= 5.
+
+
+def test_overflow_policies_keep_counts():
+    drop = BandBuffer(retention=1e9, initial_capacity=8, max_rows=100)
+    fill(drop, 1000)
+    assert len(drop) <= 100 and drop.high_water == 100
+    assert drop.dropped == 1000 - len(drop) and drop.overflows > 0
+    cols, seq = drop.read_since(0)
+    assert cols['seq'].tolist() == list(range(1000 - len(drop), 1000))
+
+    dec = BandBuffer(retention=1e9, initial_capacity=8, max_rows=100, overflow='decimate')
+    fill(dec, 1000)
+    cols, seq = dec.read_since(0)
+    assert cols['seq'][0] == 0  # still covers the whole session, more sparsely
+    assert cols['seq'][-1] == 999 and dec.dropped == 1000 - len(dec)
+    assert (np.diff(cols['seq']) > 0).all()
+
+
+def test_spill_writes_the_overflow_to_disk(tmp_path):
+    spill = BandBuffer(retention=1e9, initial_capacity=8, max_rows=100, overflow='spill',
+                       spill_path=str(tmp_path / 'alpha.bin'))
+    fill(spill, 1000)
+    on_disk = spill.read_spilled()
+    cols, seq = spill.read_since(0)
+    assert spill.spilled == len(on_disk) and spill.dropped == 0
+    assert on_disk['seq'].tolist() + cols['seq'].tolist() == list(range(1000))
+    assert np.array_equal(on_disk['ch4'], on_disk['seq'] + 3)
+
+
+def test_spill_from_several_writers_keeps_the_file_in_order(tmp_path):
+    spill = BandBuffer(retention=1e9, initial_capacity=8, max_rows=64, overflow='spill',
+                       spill_path=str(tmp_path / 'alpha.bin'))
+    writers = [threading.Thread(target=fill, args=(spill, 2000)) for _ in range(4)]
+    for w in writers:
+        w.start()
+    for w in writers:
+        w.join()
+    on_disk = spill.read_spilled()
+    cols, seq = spill.read_since(0)
+    assert spill.spilled == len(on_disk)
+    assert on_disk['seq'].tolist() + cols['seq'].tolist() == list(range(8000))
+
+
+def test_reader_gets_every_row_once_while_the_writer_appends():
+    buf = BandBuffer(retention=1e9, initial_capacity=4, max_rows=1 << 16)
+    n = 20000
+    writer = threading.Thread(target=fill, args=(buf, n))
+    writer.start()
+    seen, seq = [], 0
+    while seq < n:
+        cols, seq = buf.read_since(seq)
+        seen.append(np.array(cols['seq']))
+        assert (cols['ch1'] == cols['seq']).all()  # every row handed over is complete
+    writer.join()
+    assert np.concatenate(seen).tolist() == list(range(n))
@@ -0,0 +1,128 @@
+"""
+Tests for MuseConnect's OSC receiving, run with pytest from the repository root
+"""
+import time
+
+import pytest
+from pythonosc import udp_client
+
+from .museconnect import MuseConnect
+
+
+@pytest.mark.parametrize("server", ["asyncio", "blocking", "threading"])
+def test_each_server_type_feeds_the_same_handlers(server):
+    muse = MuseConnect(port=0, verbose=False, server=server)
+    muse.start()
+    try:
+        client = udp_client.SimpleUDPClient("127.0.0.1", muse.oscServer.server_address[1])
+        for k in range(20):
+            client.send_message("/muse/elements/alpha_absolute", [0.1, 0.2, 0.4, 0.5, 1700000000 + k, 500000])
+        client.send_message("/muse/elements/horseshoe", [1., 2., 1., 4.])
+        deadline = time.time() + 2
+        while (muse.alpha_absolute.next_seq < 20 or muse.curSensorState is None) and time.time() < deadline:
+            time.sleep(0.01)
+        block = muse.get_alpha_block()
+        assert block['device_time'].tolist() == [1700000000.5 + k for k in range(20)]
+        assert muse.curSensorState == [1, 2, 1, 4]
+    finally:
+        muse.shutdown()
+        muse.oscServer.server_close()
+
+
+def test_prefix_routing_keeps_headsets_apart():
+    muse = MuseConnect(port=0, verbose=False, server="blocking", route="prefix", devices=["booth-1"],
+                       auto_add=True)
+    booth1 = muse.device("booth-1")
+    muse.start()
+    try:
+        client = udp_client.SimpleUDPClient("127.0.0.1", muse.oscServer.server_address[1])
+        for k in range(5):
+            client.send_message("/booth-1/muse/elements/alpha_absolute", [1., 1., 1., 1.])
+            client.send_message("/booth-2/muse/elements/alpha_absolute", [2., 2., 2., 2.])
+        client.send_message("/booth-2/muse/elements/touching_forehead", 1)
+        client.send_message("/booth-2/muse/acc", [0., 0., 1.])  # not used, ignored
+        client.send_message("/muse/elements/alpha_absolute", [3., 3., 3., 3.])
+        deadline = time.time() + 2
+        while (muse.alpha_absolute.next_seq < 1 or "booth-2" not in muse.devices
+               or muse.devices["booth-2"].onForehead is None) and time.time() < deadline:
+            time.sleep(0.01)
+        booth2 = muse.device("booth-2")
+        assert muse.device("booth-1") is booth1
+        assert booth1.get_alpha() == [1.] * 5
+        assert booth2.get_alpha() == [2.] * 5
+        assert muse.get_alpha() == [3.]  # no prefix: this MuseConnect's own
+        assert booth2.is_on_forehead() == 1 and booth1.is_on_forehead() is None
+    finally:
+        muse.shutdown()
+        muse.oscServer.server_close()
+
+
+def test_address_routing_by_source():
+    muse = MuseConnect(port=0, verbose=False, server="blocking", route="address")
+    muse.start()
+    try:
+        port = muse.oscServer.server_address[1]
+        first = udp_client.SimpleUDPClient("127.0.0.1", port)
+        second = udp_client.SimpleUDPClient("127.0.0.1", port)
+        for client in (first, second):
+            client._sock.bind(("127.0.0.1", 0))  # fix the source port now, to name it
+        muse.device("booth-1", "127.0.0.1:%i" % first._sock.getsockname()[1])
+        for _k in range(3):
+            first.send_message("/muse/elements/alpha_absolute", [1., 1., 1., 1.])
+        second.send_message("/muse/elements/alpha_absolute", [2., 2., 2., 2.])
+        deadline = time.time() + 2
+        while (muse.device("booth-1").alpha_absolute.next_seq < 3 or len(muse.devices) < 2) \
+                and time.time() < deadline:
+            time.sleep(0.01)
+        assert muse.device("booth-1").get_alpha() == [1.] * 3
+        other = "127.0.0.1:%i" % second._sock.getsockname()[1]
+        assert muse.device(other).get_alpha() == [2.]
+    finally:
+        muse.shutdown()
+        muse.oscServer.server_close()
+
+
+def test_named_devices_drop_unknown_sources():
+    muse = MuseConnect(verbose=False, server=None, route="address", devices={"booth-1": "127.0.0.1"})
+    for port in (50001, 50002):  # muse-io restarted: a new source port, the same headset
+        muse._route(("127.0.0.1", port), "/muse/elements/alpha_absolute", 1., 1., 1., 1.)
+    muse._route(("10.0.0.9", 50003), "/muse/elements/alpha_absolute", 2., 2., 2., 2.)
+    assert muse.device("booth-1").get_alpha() == [1., 1.]
+    assert list(muse.devices) == ["booth-1"] and muse.dropped == 1
+
+def test_contact_changes_are_pushed_with_device_time():
+    muse = MuseConnect(verbose=False, server=None, contact_debounce=.5)
+    contact, sensors = [], []
+    muse.contact_notifier.subscribe(lambda on, t: contact.append((on, t)))
+    muse.horseshoe_notifier.subscribe(lambda state, t: sensors.append((state, t)))
+    for k, on in enumerate([0, 0, 1, 1, 1]):
+        muse.touchingforehead_handler("/muse/elements/touching_forehead", ["touchingforehead"], on, 1700000000 + k, 0)
+    for k, state in enumerate([[4, 4, 4, 4], [1, 4, 4, 4], [1, 1, 1, 1]]):
+        muse.horseshoe_handler("/muse/elements/horseshoe", ["horseshoe"], *state, ts=1700000000, tsms=k * 100000)
+    assert contact == [(False, 1700000000.), (True, 1700000002.)]
+    assert sensors == [([4, 4, 4, 4], 1700000000.)]  # the rest came within contact_debounce
+    assert muse.curSensorState == [1, 1, 1, 1]
+
+
+def test_raw_eeg_is_only_taken_in_when_asked_for():
+    samples = [800.] * 4 + [1700000000, 0]
+    for kwargs, expected in [({}, 0), ({'raw_eeg': True}, 1), ({'alpha_source': 'computed'}, 1)]:
+        muse = MuseConnect(verbose=False, server=None, route="prefix", **kwargs)
+        muse._route(("127.0.0.1", 50001), "/muse/eeg", *samples)
+        assert muse.raw_eeg.written == expected
+    assert not list(MuseConnect(verbose=False, server=None).oscDispatcher.handlers_for_address("/muse/eeg"))
+    assert list(MuseConnect(verbose=False, server=None, raw_eeg=True).oscDispatcher.handlers_for_address("/muse/eeg"))
+
+
+def test_spill_dir_is_made_up_front(tmp_path):
+    spill_dir = tmp_path / 'spill'
+    MuseConnect(verbose=False, server=None, overflow='spill', spill_dir=str(spill_dir))
+    assert spill_dir.is_dir()
+
+
+def test_prefix_routing_ignores_unused_unprefixed_paths():
+    muse = MuseConnect(verbose=False, server=None, route="prefix")
+    muse._route(("127.0.0.1", 50001), "/muse/acc", 0.1, 0.2, 0.9)
+    muse._route(("127.0.0.1", 50001), "/muse/elements/blink", 1)
+    muse._route(("127.0.0.1", 50001), "/muse/elements/alpha_absolute", 0.1, 0.2, 0.3, 0.4)
+    assert muse.alpha_absolute.next_seq == 1 and not muse.devices
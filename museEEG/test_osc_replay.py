@@ -0,0 +1,72 @@
+"""
+Tests for OSC capture and replay, run with pytest from the repository root
+"""
+import time
+
+from pythonosc import udp_client
+
+from .museconnect import MuseConnect
+from .osc_replay import OSCReplayer, read_capture
+
+
+def wait_for(condition, timeout=2.):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_record_then_replay_reproduces_the_session(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    muse = MuseConnect(port=0, verbose=False, server='blocking', record_path=path)
+    muse.start()
+    try:
+        client = udp_client.SimpleUDPClient("127.0.0.1", muse.oscServer.server_address[1])
+        for k in range(30):
+            client.send_message("/muse/elements/alpha_absolute", [0.1, 0.2, k, 0.5, 1700000000 + k, 0])
+        client.send_message("/muse/elements/horseshoe", [1., 1., 2., 1.])
+        wait_for(lambda: muse.alpha_absolute.next_seq == 30 and muse.curSensorState is not None)
+    finally:
+        muse.shutdown()
+        muse.oscServer.server_close()
+    records = read_capture(path)
+    assert len(records) == 31
+    assert all(a[0] <= b[0] for a, b in zip(records, records[1:]))
+
+    replayed = MuseConnect(port=0, verbose=False, server='blocking')
+    replayed.start()
+    try:
+        replayer = OSCReplayer(path, port=replayed.oscServer.server_address[1], speed=None)
+        assert replayer.run() == 31
+        wait_for(lambda: replayed.alpha_absolute.next_seq == 30 and replayed.curSensorState is not None)
+        block = replayed.get_alpha_block()
+        assert block['device_time'].tolist() == [1700000000. + k for k in range(30)]
+        assert block['ch3'].tolist() == list(range(30))
+        assert replayed.curSensorState == [1, 1, 2, 1]
+        replayer.close()
+    finally:
+        replayed.shutdown()
+        replayed.oscServer.server_close()
+
+
+def test_replay_keeps_the_recorded_pace(tmp_path):
+    path = str(tmp_path / 'paced.bin')
+    muse = MuseConnect(port=0, verbose=False, server='blocking', record_path=path)
+    muse.start()
+    try:
+        client = udp_client.SimpleUDPClient("127.0.0.1", muse.oscServer.server_address[1])
+        for k in range(5):
+            client.send_message("/muse/elements/alpha_absolute", [0.1, 0.2, 0.3, 0.4])
+            time.sleep(0.1)
+        wait_for(lambda: muse.alpha_absolute.next_seq == 5)
+    finally:
+        muse.shutdown()
+        muse.oscServer.server_close()
+
+    replayer = OSCReplayer(path, port=9, speed=2.)  # discard port, nothing needs to listen
+    recorded = replayer.duration()
+    t0 = time.monotonic()
+    replayer.run()
+    elapsed = time.monotonic() - t0
+    replayer.close()
+    # paced, at twice the speed; a loaded machine only ever makes it later
+    assert recorded / 2. - 0.05 < elapsed < recorded / 2. + 0.5
@@ -0,0 +1,79 @@
+"""
+Tests for the on-host band power computation, run with pytest from the repository root
+"""
+import numpy as np
+
+from .spectral import BANDS, RawEEGBuffer, SlidingBandPower, cross_check
+from .museconnect import MuseConnect
+
+Fs = 220
+
+
+def _fill(raw, seconds, freq, t0=1700000000., amplitude=20., start=0, rng=None):
+    rng = rng or np.random.RandomState(0)
+    n = int(seconds * Fs)
+    t = (start + np.arange(n)) / float(Fs)
+    for i in range(n):
+        noise = rng.normal(0, 1., 4)
+        raw.append(t0 + t[i], t0 + t[i], amplitude * np.sin(2 * np.pi * freq * t[i]) + noise)
+
+
+def test_alpha_sine_dominates_and_relative_sums_to_one():
+    raw = RawEEGBuffer(Fs * 10)
+    _fill(raw, 3, freq=10.)
+    device_time, absolute, relative = SlidingBandPower(raw, Fs).update()
+    # one window per 22 samples once the first second is in
+    assert len(device_time) == (3 * Fs - Fs) // 22 + 1
+    assert absolute.shape == relative.shape == (len(device_time), 4, len(BANDS))
+    alpha = [name for name, _lo, _hi in BANDS].index('alpha')
+    assert (relative.argmax(axis=-1) == alpha).all()
+    assert (relative[..., alpha] > 0.9).all()
+    np.testing.assert_allclose(relative.sum(axis=-1), 1., rtol=1e-9)
+
+
+def test_chunked_updates_match_one_update():
+    once, chunked = RawEEGBuffer(Fs * 10), RawEEGBuffer(Fs * 10)
+    _fill(once, 4, freq=6., rng=np.random.RandomState(1))
+    whole = SlidingBandPower(once, Fs, step=11).update()
+
+    stage = SlidingBandPower(chunked, Fs, step=11)
+    parts = []
+    rng = np.random.RandomState(1)
+    for k in range(8):
+        _fill(chunked, 0.5, freq=6., start=k * Fs // 2, rng=rng)
+        parts.append(stage.update())
+    for i in range(3):
+        np.testing.assert_allclose(np.concatenate([p[i] for p in parts]), whole[i])
+
+
+def test_cross_check_matches_by_device_time():
+    t = 1700000000. + np.arange(50) * 0.1
+    values = np.log10(1 + np.arange(50.))
+    elements = {'device_time': t}
+    computed = {'device_time': t[::2] + 0.02}  # half the rate, slightly later
+    for c in ('ch1', 'ch2', 'ch3', 'ch4'):
+        elements[c] = values
+        computed[c] = values[::2] + 0.1
+    result = cross_check(computed, elements)
+    assert result['pairs'] == 25
+    assert result['correlation'] > 0.999
+    assert abs(result['mean_difference'] - 0.1) < 1e-9
+
+
+def test_museconnect_serves_computed_alpha():
+    muse = MuseConnect(port=0, verbose=False, server='blocking', alpha_source='computed')
+    try:
+        for i in range(2 * Fs):
+            t = i / float(Fs)
+            ts = 1700000000 + int(t)
+            us = int(round((t % 1) * 1e6))
+            muse.eeg_handler("/muse/eeg", *([800. + 30 * np.sin(2 * np.pi * 10 * t)] * 4), ts, us)
+            if i % 22 == 0:
+                muse.eeg_bandpower_handler("/muse/elements/alpha_absolute", ["alpha_absolute"],
+                                           1., 1., 1., 1., ts, us)
+        alpha = muse.get_alpha_block()
+        assert len(alpha['value']) == (2 * Fs - Fs) // 22 + 1
+        assert alpha['device_time'][0] == 1700000000 + round((Fs - 1) / float(Fs), 6)
+        assert muse.crossCheck()['pairs'] == len(alpha['value'])
+    finally:
+        muse.oscServer.server_close()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+EEG/ECG time alignment
+
+JointFrameBuilder puts timestamped streams (alpha band power rows, HRV updates, ...)
+onto one fixed-rate time grid, using each stream's own timestamps (muse-io device
+time, the ECG SampleClock time; both unix epoch seconds) rather than the moment a
+poller happened to look at it.
+
+Each stream is resampled one of two ways:
+    'linear'  interpolated between the samples either side of a grid time; a grid
+              time is only emitted once the stream has a sample at or after it
+    'hold'    the last value at or before the grid time (for event streams like
+              HRV, updated once a beat)
+A grid time waits for its 'linear' streams for at most lookahead seconds, measured
+against `now` (by default the newest timestamp seen on any stream), and is then
+emitted with what is there, holding the last values. So every frame comes out at
+most lookahead seconds after its time, and a stalled stream (lead off, a dropped
+headset) cannot hold the others up. With max_age a stream reads NaN at grid times
+more than max_age seconds after its latest sample, instead of holding it forever.
+With start, the grid begins at start: samples from before it are only used to
+interpolate or hold from, so a builder made when a collection phase begins emits
+nothing from before the phase.
+
+    frames = JointFrameBuilder(period=0.25, lookahead=0.5)
+    frames.add_stream('alpha', 'linear', max_age=1.)
+    frames.add_stream('hrv', 'hold')
+    frames.push('alpha', alpha_block['device_time'], alpha_block['value'])
+    frames.push('hrv', ecg.get_hrv_t(), ecg.get_hrv())
+    joint = frames.pop(now=time.time())  # {'time': ..., 'alpha': ..., 'hrv': ...}
+"""
+
+import threading
+
+import numpy as np
+
+LINEAR = 'linear'
+HOLD = 'hold'
+
+
+class JointFrameBuilder(object):
+    """
+    joint frames every period seconds, on grid times that are whole multiples of
+    period (so frames built in different processes or booths line up), each
+    emitted at most lookahead seconds after its time
+    """
+
+    def __init__(self, period=0.25, lookahead=0.5, start=None):
+        self.period = period
+        self.lookahead = lookahead
+        self._streams = {}  # name -> {'mode', 'max_age', 't', 'v'}
+        # grid time of the next frame; without start, the first one after the first sample
+        self._next_t = None if start is None else np.ceil(start / period) * period
+        self.emitted = 0
+        self._lock = threading.Lock()
+
+    def add_stream(self, name, mode=LINEAR, max_age=None):
+        if mode not in (LINEAR, HOLD):
+            raise ValueError("unknown resampling mode: {}".format(mode))
+        with self._lock:
+            self._streams[name] = {'mode': mode, 'max_age': max_age, 't': np.zeros(0), 'v': np.zeros(0)}
+
+    def push(self, name, t, values):
+        """
+        add samples to stream name: timestamps t and values, arrays or scalars, in time
+        order. Samples at or before the last one already pushed are ignored, so the same
+        HRV update can be pushed on every poll
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        with self._lock:
+            s = self._streams[name]
+            if len(s['t']):
+                keep = t > s['t'][-1]
+                t, values = t[keep], values[keep]
+            if not len(t):
+                return
+            s['t'] = np.concatenate([s['t'], t])
+            s['v'] = np.concatenate([s['v'], values])
+            if self._next_t is None:
+                self._next_t = np.ceil(t[0] / self.period) * self.period
+
+    def newest(self):
+        """ the latest timestamp pushed on any stream, or None """
+        times = [s['t'][-1] for s in self._streams.values() if len(s['t'])]
+        return max(times) if times else None
+
+    def pop(self, now=None):
+        """
+        the frames that are ready, as a dict of arrays: 'time' (the grid times) and one
+        array per stream, NaN where a stream has no value; empty arrays if none are.
+        now (same clock as the timestamps, e.g. time.time()) bounds the wait for late
+        streams; by default it is the newest timestamp pushed
+        """
+        with self._lock:
+            names = list(self._streams)
+            newest = self.newest()
+            if self._next_t is None or newest is None:
+                return self._frames(np.zeros(0), names)
+            if now is None:
+                now = newest
+            # 'linear' streams need a sample at or after a grid time to interpolate it
+            waits = [s['t'][-1] if len(s['t']) else -np.inf
+                     for s in self._streams.values() if s['mode'] == LINEAR]
+            ready_until = min(waits) if waits else newest
+            ready_until = max(ready_until, now - self.lookahead)
+            n = int(np.floor((ready_until - self._next_t) / self.period + 1e-9)) + 1
+            if n <= 0:
+                return self._frames(np.zeros(0), names)
+            times = self._next_t + self.period * np.arange(n)
+            frames = self._frames(times, names)
+            self._next_t = times[-1] + self.period
+            self.emitted += n
+            self._trim()
+            return frames
+
+    def _frames(self, times, names):
+        frames = {'time': times}
+        for name in names:
+            frames[name] = self._resample(self._streams[name], times)
+        return frames
+
+    @staticmethod
+    def _resample(s, times):
+        t, v = s['t'], s['v']
+        out = np.full(len(times), np.nan)
+        if not len(t) or not len(times):
+            return out
+        # index of the last sample at or before each grid time
+        i = np.searchsorted(t, times, side='right') - 1
+        have = i >= 0
+        if s['mode'] == LINEAR:
+            # np.interp holds the last value past the end, which is what a late stream gets
+            out[have] = np.interp(times[have], t, v)
+        else:
+            out[have] = v[i[have]]
+        if s['max_age'] is not None:
+            out[have & (times - t[np.maximum(i, 0)] > s['max_age'])] = np.nan
+        return out
+
+    def _trim(self):
+        """ drop samples no longer needed: keep the last one before the next grid time """
+        for s in self._streams.values():
+            k = max(0, int(np.searchsorted(s['t'], self._next_t, side='right')) - 1)
+            if k:
+                s['t'] = s['t'][k:]
+                s['v'] = s['v'][k:]
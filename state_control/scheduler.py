@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduler
+one thread running every periodic tick and one-shot deadline of the state control
+
+Tasks sit in a heap ordered by deadline on the monotonic clock. run() pops the
+earliest, sleeps until it is due (or until a task is added from another thread),
+runs it and, for a periodic task, puts it back for its next tick. Periodic deadlines
+are start + k * period, so they do not drift however long each tick takes; ticks
+that could not run in time are skipped rather than run back to back.
+
+Tasks never call each other: a state transition schedules what comes next and
+returns, so the stack stays as deep as run() plus one task, and there is only ever
+the one thread, however many visitors pass through.
+
+    scheduler = Scheduler()
+    tick = scheduler.call_every(0.25, output_baseline)
+    scheduler.call_later(30, start_post_baseline)
+    scheduler.post(on_key, 97)  # from another thread: run as soon as possible
+    tick.cancel()
+    scheduler.run()  # in the thread that should run the tasks, until stop()
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Task(object):
+    """ a scheduled call; cancel() it to keep it from running (again) """
+
+    def __init__(self, scheduler, deadline, period, fn, args):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.start = deadline
+        self.period = period  # None for a one-shot task
+        self.fn = fn
+        self.args = args
+        self.ticks = 0  # times run
+        self.skipped = 0  # periodic ticks skipped because the scheduler was late
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """
+    runs tasks at their deadlines, one at a time, in the thread that calls run()
+    (or the one start() makes); tasks may be added and cancelled from any thread
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()  # keeps tasks with the same deadline in the order they were added
+        self._cond = threading.Condition()
+        self.running = True  # until stop(), which may come before run() does
+        self.thread = None
+
+    def __len__(self):
+        with self._cond:
+            return sum(1 for _deadline, _seq, task in self._heap if not task.cancelled)
+
+    def _push(self, task):
+        with self._cond:
+            heapq.heappush(self._heap, (task.deadline, next(self._seq), task))
+            if self._heap[0][2] is task:
+                self._cond.notify()  # earlier than what run() is sleeping towards
+
+    def call_later(self, delay, fn, *args):
+        """ run fn(*args) once, delay seconds from now """
+        task = Task(self, self.clock() + delay, None, fn, args)
+        self._push(task)
+        return task
+
+    def call_every(self, period, fn, *args, first=None):
+        """ run fn(*args) every period seconds, the first time after first seconds (default period) """
+        task = Task(self, self.clock() + (period if first is None else first), period, fn, args)
+        self._push(task)
+        return task
+
+    def post(self, fn, *args):
+        """ run fn(*args) as soon as possible, after what is already due """
+        return self.call_later(0, fn, *args)
+
+    def run(self):
+        """ run tasks until stop(); at once if it has already been called: a scheduler runs once """
+        while True:
+            with self._cond:
+                while self.running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    deadline, _seq, task = self._heap[0]
+                    if task.cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    wait = deadline - self.clock()
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(wait)
+                if not self.running:
+                    return
+            self._run_task(task)
+
+    def _run_task(self, task):
+        try:
+            task.fn(*task.args)
+        except Exception:
+            # one bad tick should not take the booth down
+            log.exception("scheduled task %s failed", getattr(task.fn, '__name__', task.fn))
+        task.ticks += 1
+        if task.period is None or task.cancelled:
+            return
+        now = self.clock()
+        k = task.ticks + task.skipped
+        if task.start + k * task.period <= now:
+            # late: skip the ticks that are already past
+            behind = int((now - task.start) // task.period) + 1
+            task.skipped += behind - k
+            k = behind
+        task.deadline = task.start + k * task.period
+        self._push(task)
+
+    def start(self):
+        """ run() in a new daemon thread, returned """
+        self.thread = threading.Thread(target=self.run, name="state-scheduler")
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
@@ -1,13 +1,18 @@
 # NOTE THIS HAS NOT BEEN RUN! 
 
+import logging
+import math
 import threading
-from threading import Timer
 import time
 import json
 import random
 import sys
 import pickle as pickle
 from .state_codes import *
+from .alignment import JointFrameBuilder, LINEAR, HOLD
+from .scheduler import Scheduler
+
+log = logging.getLogger(__name__)
 
 if sys.platform == 'win32':  # windoze
     import pyHook  # for universal keyboard input
@@ -18,16 +23,30 @@ forehead_tag_out_time = 3 #second since stopped touching forehead to tag ff
 
 setup_inst_period = .75
 
+QUESTIONS = ['Q1', 'Q2', 'Q3', 'Q4']  # subjective ratings asked after each confirmation
+
+# the visualization's start screen, put back when a session is given up
+WELCOME_TEXT = ('Explore how intentional activity can change your mind (alpha brain oscillations: EEG) and body '
+                '(Heart Rate Variability: ECG).<br/>This experience will take 3 minutes to complete.<br/>'
+                'Please place your hands on the white sensors to begin.')
+
+# key IDs of the digits 0-9; each key has 2 IDs because of Num Lock
+KEY_DIGITS = {96: 0, 45: 0, 97: 1, 35: 1, 98: 2, 40: 2, 99: 3, 34: 3, 100: 4, 37: 4,
+              101: 5, 12: 5, 102: 6, 39: 6, 103: 7, 36: 7, 104: 8, 38: 8, 105: 9, 33: 9}
+
 class ChangeYourBrainStateControl(object):
     """
     Creates the experiment state machine, sending data to the node.js server
-    that runs the visualization
+    that runs the visualization. Every tick and timer of it runs on one Scheduler;
+    run() runs that in the calling thread
     """
-    def __init__(self, client_name, sb_server, eeg, ecg, vis_period_sec=.25, baseline_sec=30, condition_sec=90, baseline_inst_sec=10, condition_inst_sec=20):
+    def __init__(self, client_name, sb_server, eeg, ecg, vis_period_sec=.25, baseline_sec=30, condition_sec=90, baseline_inst_sec=10, condition_inst_sec=20, align_lookahead_sec=.5, keyboard=True, lead_period_sec=.25, input_timeout_sec=120):
         self.client_name = client_name
         self.sb_server = sb_server
         self.ecg = ecg
         self.eeg = eeg
+        self.scheduler = Scheduler()
+        self.phase_tasks = []  # ticks and timers of the current state, cancelled when it changes
         self.set_state(NO_EXPERIMENT)
         self.tag_time = None # last time someone tagged in
         self.vis_period = vis_period_sec
@@ -35,9 +54,15 @@ class ChangeYourBrainStateControl(object):
         self.condition_seconds = condition_sec
         self.baseline_instruction_seconds = baseline_inst_sec 
         self.condition_instruction_seconds = condition_inst_sec
+        self.align_lookahead = align_lookahead_sec  # most a joint frame waits for late EEG (see alignment.py)
+        self.input_timeout = input_timeout_sec  # most a confirmation or answer is waited for
+        self.input_timer = None
+        self.joint_frames = None  # alpha and HRV on one vis_period grid, new for each collection phase
 
         # keyboard input (or fake if not windows)
-        if sys.platform == 'win32':  # windoze
+        if not keyboard:
+            self.kInputThread = None
+        elif sys.platform == 'win32':  # windoze
             self.kInputThread = WindowsKeyboardInput(self)
             self.kInputThread.daemon = True
             self.kInputThread.start()
@@ -49,14 +74,25 @@ class ChangeYourBrainStateControl(object):
         # self.kInputThread.start()
 
         self.alpha_buffer = []  # buffering eeg alpha freq
-        self.poll_answer = False  # temp holding of subjective rating
         self.ecg_leadon = False  # start with lead off as current state
         self.eeg_leadon = False  # will track eeg.touchingforehead
         self.eegSensorState = [4, 4, 4, 4]  # start with all off
         self.filename_prepend = "transtech_cym"
         self.meta_data = {'time': [], 'value':[]} #program state etc
 
-        self.do_every_while(self.vis_period, NO_EXPERIMENT, self.check_for_tag_out_in) #start looking for EEG 'tag in'
+        # leads and tag out/in are watched in every state; start looking for EEG 'tag in'.
+        # Lead changes are pushed by devices that can, only the others are polled
+        self.lead_task = None
+        if not self.subscribe_leads():
+            self.lead_task = self.scheduler.call_every(lead_period_sec, self.check_leads)
+        self.tag_task = self.scheduler.call_every(self.vis_period, self.check_for_tag_out_in)
+
+    def run(self):
+        """run the state machine in the calling thread, until stop()"""
+        self.scheduler.run()
+
+    def stop(self):
+        self.scheduler.stop()
 
     # ## CALLED VIA _________ ############
     def process_eeg_alpha(self, values):
@@ -65,13 +101,16 @@ class ChangeYourBrainStateControl(object):
     def tag_in(self, muse_id='0000'):
         # devNote: put here possible confirmation of user change if in middle of experiment
         self.tag_time = time.time()
-        print('tagged in at', self.tag_time)
+        log.info('tagged in at %s', self.tag_time)
         self.alpha_save_condition = {'time': [], 'value':[], 'device_time': [], 'all': []}
         self.hrv_save_condition = {'time': [], 'value': [], 'rri': [], 'device_time': []}
 
         self.alpha_save_baseline = {'time': [], 'value':[], 'device_time': [], 'all': []}
         self.hrv_save_baseline = {'time': [], 'value':[], 'rri': [], 'device_time': []}
 
+        self.joint_save_baseline = {'time': [], 'alpha': [], 'hrv': []}
+        self.joint_save_condition = {'time': [], 'alpha': [], 'hrv': []}
+
         self.meta_data = {'time': [time.time(),], 'value':['TAG_IN',]} #program state etc
 
         self.start_setup_instructions()
@@ -85,19 +124,23 @@ class ChangeYourBrainStateControl(object):
             if (not self.eeg.is_on_forehead() and 
                 self.eeg.get_sec_since_last_forehead_trans() > forehead_tag_out_time):
                 self.tag_time = None
-                print(">>>>> TAGGED OUT")
+                log.info(">>>>> TAGGED OUT")
         else: #check for tag in
             # print('last tagged out. checking for tag in')
             if (self.eeg.is_on_forehead() and 
                 self.eeg.get_sec_since_last_forehead_trans() > forehead_tag_in_time):
                 self.tag_in()
-                print(">>>>> TAGGED IN")
+                log.info(">>>>> TAGGED IN")
 
     ######################################################
     # ## STATE CHANGING ############
     def set_state(self, state):
         self.experiment_state = state
-        print('setting state at {} to {}'.format(time.time(), state))
+        for task in self.phase_tasks:
+            task.cancel()
+        self.phase_tasks = []
+        self.input_timer = None
+        log.info('setting state at %s to %s', time.time(), state)
 
     def start_setup_instructions(self):
         # devNote: possibly add both time-in and time-out timer here which takes us back to (no experiment)
@@ -110,8 +153,7 @@ class ChangeYourBrainStateControl(object):
             return
         self.set_state(BASELINE_INSTRUCTIONS)
         self.output_instruction()
-        instruction_timer = Timer(self.baseline_instruction_seconds,self.start_baseline_collection) 
-        instruction_timer.start()
+        self.do_after(self.baseline_instruction_seconds, self.start_baseline_collection)
 
     def start_baseline_collection(self):
         if self.experiment_state != BASELINE_INSTRUCTIONS:
@@ -119,16 +161,16 @@ class ChangeYourBrainStateControl(object):
         self.set_state(BASELINE_COLLECTION)
         self.meta_data['value'].append(('state','BASELINE_COLLECTION'))
         self.meta_data['time'].append(time.time())
+        self._new_joint_frames()
 
         # tell viz to go to the baseline screen 
         instruction = {"message": {
              "value" : {'instruction_name': 'BASELINE_COLLECTION', 'display_seconds': self.baseline_seconds},
              "type": "string", "name": "instruction", "clientName": self.client_name}}    
         self.sb_server.ws.send(json.dumps(instruction))
-        print("start baseline collection") 
+        log.info("start baseline collection")
 
-        baseline_timer = Timer(self.baseline_seconds,self.start_post_baseline)
-        baseline_timer.start()
+        self.do_after(self.baseline_seconds, self.start_post_baseline)
         self.do_every_while(self.vis_period,BASELINE_COLLECTION,self.output_baseline) # instruct vis to start plotting 
 
     def start_post_baseline(self):
@@ -138,31 +180,9 @@ class ChangeYourBrainStateControl(object):
         self.set_state(BASELINE_CONFIRMATION)
         # self.baseline_confirmation = 1 ###TEMP!
         self.baseline_confirmation = 0 #confirmed = 1, disconfirmed = -1
-        self.output_instruction('CONFIRMATION')
-        while not self.baseline_confirmation: #neither confirmed nor disconfirmed
-            self.check_eeg_lead()
-            self.check_ecg_lead() #should turn on ECG cconnection 
-            continue
-        if self.baseline_confirmation < 0: 
-            self.start_baseline_instructions()
-            print('returning from post_baseline after disconfirmation of correct collection')
-            return
-        ### collect subj info
         self.baseline_subj = []
-        for question in ['Q1','Q2','Q3','Q4']:
-            self.output_instruction(question)
-            while not self.poll_answer:
-                self.check_eeg_lead()
-                self.check_ecg_lead() #should turn on ECG cconnection 
-                if self.experiment_state != BASELINE_CONFIRMATION: #ensure we are in right state
-                    return
-                continue
-            print(self.baseline_subj)
-            self.baseline_subj.append(self.poll_answer)
-            self.poll_answer = False
-
-        print('baseline user answers: ', self.baseline_subj)
-        self.start_condition_instructions()
+        self.output_instruction('CONFIRMATION')
+        self.wait_for_input()
 
     def start_condition_instructions(self):
         if self.experiment_state not in [BASELINE_CONFIRMATION,CONDITION_CONFIRMATION]:
@@ -170,8 +190,7 @@ class ChangeYourBrainStateControl(object):
         ### differentiate between the three possible conditions (currently assuming breathing)
         self.set_state(CONDITION_INSTRUCTIONS)
         self.output_instruction()
-        instruction_timer = Timer(self.condition_instruction_seconds,self.start_condition_collection) 
-        instruction_timer.start()
+        self.do_after(self.condition_instruction_seconds, self.start_condition_collection)
 
     def start_condition_collection(self):
         if self.experiment_state != CONDITION_INSTRUCTIONS: 
@@ -179,6 +198,7 @@ class ChangeYourBrainStateControl(object):
         self.set_state(CONDITION_COLLECTION)
         self.meta_data['value'].append(('state',CONDITION_COLLECTION))
         self.meta_data['time'].append(time.time())
+        self._new_joint_frames()
 
         ### make sure to change this to average from start of baseline collection
         if self.alpha_save_baseline['value']:
@@ -198,13 +218,12 @@ class ChangeYourBrainStateControl(object):
                          'baseline_hrv' : self.baseline_hrv},
              "type": "string", "name": "instruction", "clientName": self.client_name}}    
         self.sb_server.ws.send(json.dumps(instruction))
-        print("start condition collection") #^^^
-        print('display_seconds:', self.condition_seconds)
-        print('baseline_alpha',self.baseline_alpha)
-        print('baseline_hrv', self.baseline_hrv)
+        log.info("start condition collection") #^^^
+        log.info('display_seconds: %s', self.condition_seconds)
+        log.info('baseline_alpha %s', self.baseline_alpha)
+        log.info('baseline_hrv %s', self.baseline_hrv)
 
-        condition_timer = Timer(self.condition_seconds,self.start_post_condition) 
-        condition_timer.start()
+        self.do_after(self.condition_seconds, self.start_post_condition)
         ### ??? send instructor
         self.do_every_while(self.vis_period,CONDITION_COLLECTION,self.output_condition) # instruct vis to start plotting 
 
@@ -215,30 +234,60 @@ class ChangeYourBrainStateControl(object):
         self.set_state(CONDITION_CONFIRMATION)
         # self.condition_confirmation = 1 #TEMP
         self.condition_confirmation = 0 #confirmed = 1, disconfirmed = -1
+        self.condition_subj = []
         self.output_instruction('CONFIRMATION')
-        while not self.condition_confirmation: #neither confirmed nor disconfirmed
-            self.check_eeg_lead()
-            self.check_ecg_lead() #should turn on ECG cconnection 
-            continue
-        if self.condition_confirmation < 0: 
-            self.start_condition_instructions()
-            print('returning from post_condition')
+        self.wait_for_input()
+
+    def confirmation_input(self, digit, part, answers, redo, proceed):
+        """
+        a digit typed after the baseline or condition part: first the confirmation
+        (1 yes, redo() it on 0), then one answer per QUESTION, proceed() after the last
+        """
+        if not getattr(self, part + '_confirmation'): #neither confirmed nor disconfirmed
+            if digit == 0:
+                log.info('%s disconfirmed', part)
+                setattr(self, part + '_confirmation', -1)
+                redo()
+            elif digit == 1:
+                log.info('%s confirmed', part)
+                setattr(self, part + '_confirmation', 1)
+                self.ask(answers)
             return
-        self.condition_subj = []
-        #collect subj info
-        for question in ['Q1','Q2','Q3','Q4']:
-            self.output_instruction(question)
-            while not self.poll_answer:
-                self.check_eeg_lead()
-                self.check_ecg_lead() #should turn on ECG cconnection 
-                if self.experiment_state != CONDITION_CONFIRMATION: #ensure we are in right state
-                    return
-                continue
-            self.condition_subj.append(self.poll_answer)
-            self.poll_answer = False
-
-        print('condition user answers: ',self.condition_subj)
-        self.start_post_experiment()
+        if not digit:  # ratings are 1-9
+            return
+        answers.append(digit)
+        log.debug('%s answers so far: %s', part, list(answers))
+        if len(answers) < len(QUESTIONS):
+            self.ask(answers)
+        else:
+            log.info('%s user answers: %s', part, list(answers))
+            proceed()
+
+    def ask(self, answers):
+        """put up the next of the QUESTIONS and wait for its answer"""
+        self.output_instruction(QUESTIONS[len(answers)])
+        self.wait_for_input()
+
+    def wait_for_input(self):
+        """(re)start the wait for the visitor's next key, given up after input_timeout seconds"""
+        if self.input_timer is not None:
+            self.input_timer.cancel()
+        self.input_timer = self.do_after(self.input_timeout, self.input_timed_out)
+
+    def input_timed_out(self):
+        """
+        nobody answered: save what there is of the session, put the visualization back
+        to its start screen; the next visitor tags in as usual
+        """
+        log.warning('no keyboard input for %s s in state %s, ending the session', self.input_timeout, self.experiment_state)
+        self.meta_data['value'].append(('input_timeout', self.experiment_state))
+        self.meta_data['time'].append(time.time())
+        self.set_state(NO_EXPERIMENT)
+        self.save_session('_partial')
+        instruction = {"message": {
+            "value": {'instruction_name': 'RESET', 'instruction_text': WELCOME_TEXT},
+            "type": "string", "name": "instruction", "clientName": self.client_name}}
+        self.sb_server.ws.send(json.dumps(instruction))
 
     def start_post_experiment(self):
         """display aggregates and wait for new tag in!"""
@@ -246,7 +295,7 @@ class ChangeYourBrainStateControl(object):
             return
         self.set_state(POST_EXPERIMENT)
         self.output_post_experiment()
-        self.do_every_while(self.vis_period,POST_EXPERIMENT,self.check_for_tag_out_in) # instruct to look continually for tag out/in
+        # tag_task goes on looking for tag out/in
 
     ######################################################
     ### OUTPUT TO VISUALIZTION ###########################
@@ -275,7 +324,7 @@ class ChangeYourBrainStateControl(object):
                 raise Exception ('Unkown sub_state for instruction sent in state ' + str(self.experiment_state))
         else:
             raise Exception ('Unkown state ({}) for instruction sent'.format(self.experiment_state))
-        print("output instruction: {}".format(instruction_text)) 
+        log.info("output instruction: %s", instruction_text)
         instruction = {"message": {
             "value" : {'instruction_name': 'DISPLAY_INSTRUCTION', 'instruction_text': instruction_text},
             "type": "string", "name": "instruction", "clientName": self.client_name}}    
@@ -283,27 +332,68 @@ class ChangeYourBrainStateControl(object):
         self.meta_data['value'].append(('state',self.experiment_state))
         self.meta_data['time'].append(time.time())
 
+    @staticmethod
+    def _last_alpha_row(alpha_block):
+        """ the newest alpha packet as [ch1, ch2, ch3, ch4, device_time] """
+        return [float(alpha_block[c][-1]) for c in ('ch1', 'ch2', 'ch3', 'ch4', 'device_time')]
+
+    def _new_joint_frames(self):
+        """
+        alpha and HRV aligned by their own timestamps, one frame per vis_period, from now
+        on: a collection phase does not get frames of the pause before it
+        """
+        self.joint_frames = JointFrameBuilder(self.vis_period, self.align_lookahead, start=time.time())
+        self.joint_frames.add_stream('alpha', LINEAR, max_age=2.)
+        self.joint_frames.add_stream('hrv', HOLD, max_age=5.)  # a few beats; NaN once the lead is off for longer
+
+    def _update_joint_frames(self, alpha_block, save):
+        """
+        feed the new alpha rows and the current HRV to the frame builder, save the frames
+        that are ready into save, and return the newest one as (alpha, hrv), None if none
+        is ready; either value is NaN while its stream has nothing to say
+        """
+        self.joint_frames.push('alpha', alpha_block['device_time'], alpha_block['value'])
+        hrv_t = self.ecg.get_hrv_t()
+        if hrv_t is not None and hrv_t > 0:
+            self.joint_frames.push('hrv', hrv_t, self.ecg.get_hrv())
+        frames = self.joint_frames.pop(now=time.time())
+        for key in ('time', 'alpha', 'hrv'):
+            save[key].extend(frames[key].tolist())
+        if not len(frames['time']):
+            return None
+        return float(frames['alpha'][-1]), float(frames['hrv'][-1])
+
+    @staticmethod
+    def _joint_or(joint, alpha, hrv):
+        """ the joint frame's (alpha, hrv), falling back to the polled values where it has none """
+        if joint is None:
+            return alpha, hrv
+        return (alpha if math.isnan(joint[0]) else joint[0]), (hrv if math.isnan(joint[1]) else joint[1])
+
     def output_baseline(self):
         """output aggregated EEG and HRV values"""
         #devNote: possibly switch to outputting raw ECG (or heart rate!) instead of HRV during baseline
-        self.alpha_buffer = self.eeg.get_alpha()
+        alpha_block = self.eeg.get_alpha_block()
+        self.alpha_buffer = alpha_block['value']
         if len(self.alpha_buffer) != 0:
             alpha_out = sum(v for v in self.alpha_buffer)/len(self.alpha_buffer) #note: if change order of tuple must change line below
-            print('alpha_out!',sum(v for v in self.alpha_buffer), len(self.alpha_buffer))
+            log.debug('alpha_out! %s %i', alpha_out, len(self.alpha_buffer))
             self.alpha_save_baseline['time'].append(time.time())
             self.alpha_save_baseline['value'].append(alpha_out)
-            # self.alpha_save_baseline['device_time'].append(self.alpha_buffer[-1][0])
-            #self.alpha_save_baseline['all'].append(self.alpha_buffer[-1]) #for saving. format: 4 sensor vals + device time (s) + d time(micros)
+            self.alpha_save_baseline['device_time'].append(float(alpha_block['device_time'][-1]))
+            self.alpha_save_baseline['all'].append(self._last_alpha_row(alpha_block)) #for saving. format: 4 sensor vals + device time (s)
         else: 
             alpha_out = 0 # random.random() ###
-            print('baseline: alpha_buffer empty!')
+            log.info('baseline: alpha_buffer empty!', extra={'rate_limited': True})
         self.alpha_buffer = []
 
         self.hrv_save_baseline['time'].append(time.time())
         self.hrv_save_baseline['value'].append(self.ecg.get_hrv())
         self.hrv_save_baseline['device_time'].append(self.ecg.get_hrv_t())
         self.hrv_save_baseline['rri'].append(self.ecg.get_rri())
-        value_out = "{:.1f},{:.2f},{:.2f}".format(time.time()-self.tag_time, alpha_out, self.ecg.get_hrv())
+        alpha_out, hrv_out = self._joint_or(self._update_joint_frames(alpha_block, self.joint_save_baseline),
+                                            alpha_out, self.ecg.get_hrv())
+        value_out = "{:.1f},{:.2f},{:.2f}".format(time.time()-self.tag_time, alpha_out, hrv_out)
         #print(value_out)
         message = {"message": { #send synced EEG & ECG data here
              "value": value_out,
@@ -314,13 +404,14 @@ class ChangeYourBrainStateControl(object):
     def output_condition(self):
         """output aggregated EEG and HRV values"""
         # note: currently the same as output_baseline
-        self.alpha_buffer = self.eeg.get_alpha()
+        alpha_block = self.eeg.get_alpha_block()
+        self.alpha_buffer = alpha_block['value']
         if len(self.alpha_buffer) != 0:
             alpha_out = sum(v for v in self.alpha_buffer)/len(self.alpha_buffer) #note: if change order of tuple must change line below
             self.alpha_save_condition['time'].append(time.time())
             self.alpha_save_condition['value'].append(alpha_out)
-            # self.alpha_save_condition['device_time'].append(self.alpha_buffer[-1][0])
-            #self.alpha_save_condition['all'].append(self.alpha_buffer[-1]) #for saving. format: 4 sensor vals + time (s) + time(micros)
+            self.alpha_save_condition['device_time'].append(float(alpha_block['device_time'][-1]))
+            self.alpha_save_condition['all'].append(self._last_alpha_row(alpha_block)) #for saving. format: 4 sensor vals + device time (s)
         else: 
             alpha_out = 0 #random.random()
         self.alpha_buffer = []
@@ -330,7 +421,9 @@ class ChangeYourBrainStateControl(object):
         self.hrv_save_condition['device_time'].append(self.ecg.get_hrv_t())
         self.hrv_save_condition['rri'].append(self.ecg.get_rri())
 
-        value_out = "{:.1f},{:.2f},{:.2f}".format(time.time()-self.tag_time, alpha_out, self.ecg.get_hrv())
+        alpha_out, hrv_out = self._joint_or(self._update_joint_frames(alpha_block, self.joint_save_condition),
+                                            alpha_out, self.ecg.get_hrv())
+        value_out = "{:.1f},{:.2f},{:.2f}".format(time.time()-self.tag_time, alpha_out, hrv_out)
         message = {"message": { #send synced EEG & ECG data here
              "value": value_out,
              "type": "string", "name": "eeg_ecg", "clientName": self.client_name}}
@@ -348,7 +441,7 @@ class ChangeYourBrainStateControl(object):
             condition_hrv = self.hrv_save_condition['value'][-1]
         else:
             condition_hrv = 0 ### change me
-            print('no hrv collected for condition!')
+            log.info('no hrv collected for condition!')
 
         #output to vis
         value_out = {"instruction_name":"POST_EXPERIMENT",
@@ -362,42 +455,47 @@ class ChangeYourBrainStateControl(object):
              "value": value_out,
              "type": "string", "name": "instruction", "clientName": self.client_name}}
         self.sb_server.ws.send(json.dumps(message))
+        self.save_session()
+
+        log.info("output post experiment %s", value_out)
 
-        # save data to file
+    def save_session(self, suffix=''):
+        """pickle the session's data to data/, suffix marks a session that did not finish"""
         # ew, there are better ways to do this time string
         (tm_year,tm_mon,tm_mday,tm_hour,tm_min,tm_sec,tm_wday,tm_yday,tm_isdst) = time.localtime() #get local time
-        filename = 'data/%s_%d.%02d.%02d_%d.%d.%d.pkl' % (self.filename_prepend,tm_year,tm_mon,tm_mday,tm_hour,tm_min,tm_sec) 
+        filename = 'data/%s_%d.%02d.%02d_%d.%d.%d%s.pkl' % (self.filename_prepend,tm_year,tm_mon,tm_mday,tm_hour,tm_min,tm_sec,suffix)
         output_dict = {
             'metadata': self.meta_data,
             'hrv baseline': self.hrv_save_baseline,
             'hrv condition': self.hrv_save_condition,
             'alpha baseline': self.alpha_save_baseline,
             'alpha condition': self.alpha_save_condition,
+            'joint baseline': self.joint_save_baseline,  # alpha and hrv aligned on the vis_period grid
+            'joint condition': self.joint_save_condition,
         }
-        pickle.dump(output_dict, open(filename, "wb"))
-
-        print("output post experiment", value_out) 
+        with open(filename, "wb") as f:
+            pickle.dump(output_dict, f)
+        log.info("session saved to %s", filename)
 
     ######################################################
     # ## HELPER ###########################################
 
     def do_every_while(self, period, state, f, *args):
         """Run function f() every period seconds while experiment_state == state."""
-        def g_tick():
-            t = time.time()
-            count = 0
-            while True:
-                count += 1
-                yield max(0, t + count * period - time.time())
-        g = g_tick()
-        while self.experiment_state == state:
-            self.check_eeg_lead()   
-            self.check_ecg_lead()  # should turn on ECG cconnection indicator
-            self.check_for_tag_out_in() # check if someone leaves experiment early
-            time.sleep(next(g))  # wait for a bit, based on the period
-            # self.check_eeg_lead()
-            # self.check_ecg_lead()  # check the ECG lead here
+        def tick():
+            if self.experiment_state != state:
+                task.cancel()
+                return
             f(*args)
+        task = self.scheduler.call_every(period, tick)
+        self.phase_tasks.append(task)
+        return task
+
+    def do_after(self, delay, f, *args):
+        """Run function f() once after delay seconds, unless the state changes first."""
+        task = self.scheduler.call_later(delay, f, *args)
+        self.phase_tasks.append(task)
+        return task
 
     def start_on_ecg_lead(self):
         if self.check_ecg_lead():
@@ -408,51 +506,92 @@ class ChangeYourBrainStateControl(object):
         check to see state of all of the EEG sensors, and send a message if they have changed
         """
         if self.eeg_leadon != self.eeg.onForehead:
-            self.eeg_leadon = self.eeg.onForehead
-            if self.eeg_leadon:
-                instruction = {"message": {
-                    "value": {'instruction_name': 'CONNECTED', 'type': 'eeg'},
-                    "type": "string", "name": "instruction", "clientName": self.client_name}}
-                print("Muse headset CONNECTED")
-            else:
-                instruction = {"message": {
-                    "value": {'instruction_name': 'DISCONNECTED', 'type': 'eeg'},
-                    "type": "string", "name": "instruction", "clientName": self.client_name}}
-                print("Muse headset DISCONNECTED")
-            self.sb_server.ws.send(json.dumps(instruction))
-            self.meta_data['time'].append(time.time())
-            self.meta_data['value'].append(('eeg_leadon', self.eeg_leadon))  # record this in metadata
-
-        # construct the message to send all 4 sensor states and parse it
+            self.eeg_lead_changed(self.eeg.onForehead)
         if self.eeg.curSensorState != self.eegSensorState:
-            print("sensor state changed from {} to {}".format(self.eegSensorState, self.eeg.curSensorState))
-            self.eegSensorState = self.eeg.curSensorState
-
-            instruction = {"message": {
-                    "value": {'instruction_name': 'EEG_SENSOR', 'sensorstate': self.eegSensorState},
-                    "type": "string", "name": "instruction", "clientName": self.client_name}}
-            print("Muse headset sensorstate", self.eegSensorState)
-            self.sb_server.ws.send(json.dumps(instruction))
+            self.eeg_sensors_changed(self.eeg.curSensorState)
 
     def check_ecg_lead(self):
         """ check to see the current state of the ECG lead, and send a message if it changes """
-        if self.ecg.is_lead_on() != self.ecg_leadon:
-            self.ecg_leadon = self.ecg.is_lead_on()
-            if self.ecg_leadon:
-                instruction = {"message": {
-                    "value": {'instruction_name': 'CONNECTED', 'type': 'ecg'},
-                    "type": "string", "name": "instruction", "clientName": self.client_name}}
-                print("ECG CONNECTED")  # ^^^
-            else:
-                instruction = {"message": {
-                    "value": {'instruction_name': 'DISCONNECTED', 'type': 'ecg'},
-                    "type": "string", "name": "instruction", "clientName": self.client_name}}
-                print("ECG DISCONNECTED")  # ^^^
-            self.sb_server.ws.send(json.dumps(instruction))
-            self.meta_data['time'].append(time.time())
-            self.meta_data['value'].append(('ecg_leadon', self.ecg_leadon))  # record this in metadata
+        if not self.ecg_pushed and self.ecg.is_lead_on() != self.ecg_leadon:
+            self.ecg_lead_changed(self.ecg.is_lead_on())
         return self.ecg_leadon
 
+    def subscribe_leads(self):
+        """
+        have the devices that can tell us about lead and contact changes do so (see
+        streams/notify.py), instead of polling them; returns True if none is left to poll
+        """
+        post = self.scheduler.post
+        eeg_contact = getattr(self.eeg, 'contact_notifier', None)
+        eeg_sensors = getattr(self.eeg, 'horseshoe_notifier', None)
+        ecg_lead = getattr(self.ecg, 'lead_notifier', None)
+        self.eeg_pushed = eeg_contact is not None and eeg_sensors is not None
+        self.ecg_pushed = ecg_lead is not None
+        if self.eeg_pushed:
+            eeg_contact.subscribe(lambda on, t: post(self.eeg_lead_changed, on, t))
+            eeg_sensors.subscribe(lambda state, t: post(self.eeg_sensors_changed, state, t))
+            post(self.check_eeg_lead)  # whatever it is now
+        if self.ecg_pushed:
+            ecg_lead.subscribe(lambda on, t: post(self.ecg_lead_changed, on, t))
+            post(self.ecg_lead_changed, bool(self.ecg.is_lead_on()))
+        return self.eeg_pushed and self.ecg_pushed
+
+    def check_leads(self):
+        """ poll the devices that do not tell us about their changes """
+        if not self.eeg_pushed:
+            self.check_eeg_lead()
+        if not self.ecg_pushed:
+            self.check_ecg_lead()  # should turn on ECG cconnection indicator
+
+    def eeg_lead_changed(self, on_forehead, device_time=None):
+        if self.eeg_leadon == on_forehead:
+            return
+        self.eeg_leadon = on_forehead
+        if self.eeg_leadon:
+            instruction = {"message": {
+                "value": {'instruction_name': 'CONNECTED', 'type': 'eeg'},
+                "type": "string", "name": "instruction", "clientName": self.client_name}}
+            log.info("Muse headset CONNECTED")
+        else:
+            instruction = {"message": {
+                "value": {'instruction_name': 'DISCONNECTED', 'type': 'eeg'},
+                "type": "string", "name": "instruction", "clientName": self.client_name}}
+            log.info("Muse headset DISCONNECTED")
+        self.sb_server.ws.send(json.dumps(instruction))
+        self.meta_data['time'].append(time.time() if device_time is None else device_time)
+        self.meta_data['value'].append(('eeg_leadon', self.eeg_leadon))  # record this in metadata
+
+    def eeg_sensors_changed(self, sensor_state, device_time=None):
+        # construct the message to send all 4 sensor states and parse it
+        if sensor_state == self.eegSensorState:
+            return
+        log.info("sensor state changed from %s to %s", self.eegSensorState, sensor_state)
+        self.eegSensorState = sensor_state
+
+        instruction = {"message": {
+                "value": {'instruction_name': 'EEG_SENSOR', 'sensorstate': self.eegSensorState},
+                "type": "string", "name": "instruction", "clientName": self.client_name}}
+        log.debug("Muse headset sensorstate %s", self.eegSensorState)
+        self.sb_server.ws.send(json.dumps(instruction))
+
+    def ecg_lead_changed(self, lead_on, device_time=None):
+        if self.ecg_leadon == lead_on:
+            return
+        self.ecg_leadon = lead_on
+        if self.ecg_leadon:
+            instruction = {"message": {
+                "value": {'instruction_name': 'CONNECTED', 'type': 'ecg'},
+                "type": "string", "name": "instruction", "clientName": self.client_name}}
+            log.info("ECG CONNECTED")  # ^^^
+        else:
+            instruction = {"message": {
+                "value": {'instruction_name': 'DISCONNECTED', 'type': 'ecg'},
+                "type": "string", "name": "instruction", "clientName": self.client_name}}
+            log.info("ECG DISCONNECTED")  # ^^^
+        self.sb_server.ws.send(json.dumps(instruction))
+        self.meta_data['time'].append(time.time() if device_time is None else device_time)
+        self.meta_data['value'].append(('ecg_leadon', self.ecg_leadon))  # record this in metadata
+
     def keyboard_input(self):
         # devNote: could do this smarter by not calling this function unless in one of the appropriate states
         if self.experiment_state == SETUP_CONFIRMATION:
@@ -461,7 +600,7 @@ class ChangeYourBrainStateControl(object):
                 print('When you are set up and seated, type \'1\' and press enter')
                 input = input()
             ### select condition
-            print("SHOULDN'T EVER GET HERE*****")
+            log.error("SHOULDN'T EVER GET HERE*****")
             self.start_baseline_instructions()
         elif self.experiment_state == BASELINE_CONFIRMATION:
             pass
@@ -472,63 +611,19 @@ class ChangeYourBrainStateControl(object):
         # (otherwise do nothing!)
 
     def win_keyboard_input(self,key_ID):
+        """called from the keyboard thread: hand digits over to the state machine"""
         # TODO: Press SOME_KEY 3 times in 2 seconds will "tag in"
+        digit = KEY_DIGITS.get(key_ID)
+        if digit is not None:
+            self.scheduler.post(self.digit_input, digit)
 
-        # note: each key has 2 IDs because of Num Lock
+    def digit_input(self, digit):
         if self.experiment_state == BASELINE_CONFIRMATION:
-            if not self.baseline_confirmation:
-                if key_ID in [96,45]: #zero
-                    print('baseline disconfirmed')
-                    self.baseline_confirmation = -1
-                elif key_ID in [97,35]: #one
-                    print('baseline confirmed')
-                    self.baseline_confirmation = 1
-            elif not self.poll_answer:
-                if key_ID in [97,35]: 
-                    self.poll_answer = 1
-                elif key_ID in [98,40]: 
-                    self.poll_answer = 2
-                elif key_ID in [99,34]: 
-                    self.poll_answer = 3
-                elif key_ID in [100,37]: 
-                    self.poll_answer = 4
-                elif key_ID in [101,12]: 
-                    self.poll_answer = 5
-                elif key_ID in [102,39]: 
-                    self.poll_answer = 6
-                elif key_ID in [103,36]: 
-                    self.poll_answer = 7
-                elif key_ID in [104,38]: 
-                    self.poll_answer = 8
-                elif key_ID in [105,33]: 
-                    self.poll_answer = 9
+            self.confirmation_input(digit, 'baseline', self.baseline_subj,
+                                    self.start_baseline_instructions, self.start_condition_instructions)
         elif self.experiment_state == CONDITION_CONFIRMATION:
-            if not self.condition_confirmation:
-                if key_ID in [96,45]: #zero
-                    print('condition disconfirmed')
-                    self.condition_confirmation = -1
-                elif key_ID in [97,35]: #one
-                    print('condition confirmed')
-                    self.condition_confirmation = 1
-            elif not self.poll_answer:
-                if key_ID in [97,35]: 
-                    self.poll_answer = 1
-                elif key_ID in [98,40]: 
-                    self.poll_answer = 2
-                elif key_ID in [99,34]: 
-                    self.poll_answer = 3
-                elif key_ID in [100,37]: 
-                    self.poll_answer = 4
-                elif key_ID in [101,12]: 
-                    self.poll_answer = 5
-                elif key_ID in [102,39]: 
-                    self.poll_answer = 6
-                elif key_ID in [103,36]: 
-                    self.poll_answer = 7
-                elif key_ID in [104,38]: 
-                    self.poll_answer = 8
-                elif key_ID in [105,33]: 
-                    self.poll_answer = 9
+            self.confirmation_input(digit, 'condition', self.condition_subj,
+                                    self.start_condition_instructions, self.start_post_experiment)
         #(otherwise do nothing!)
 
 class ConsoleKeyboardInputThread ( threading.Thread ):
@@ -564,7 +659,7 @@ class WindowsKeyboardInput ( threading.Thread ):
 
     def OnKeyboardEvent(self,event):
         # print('Key:', event.Key)
-        print('KeyID:', event.KeyID)
+        log.debug('KeyID: %s', event.KeyID)
         self.state_control.win_keyboard_input(event.KeyID)
 
         # return True to pass the event to other handlers
@@ -0,0 +1,80 @@
+"""
+Tests for the EEG/ECG frame builder, run with pytest from the repository root
+"""
+import numpy as np
+
+from .alignment import JointFrameBuilder, LINEAR, HOLD
+
+
+def builder(**kw):
+    frames = JointFrameBuilder(period=0.25, **kw)
+    frames.add_stream('alpha', LINEAR)
+    frames.add_stream('hrv', HOLD)
+    return frames
+
+
+def test_linear_and_hold_resampling_on_the_grid():
+    frames = builder(lookahead=0.5)
+    t = 100. + np.arange(11) * 0.1  # 100.0 .. 101.0 at 10 Hz
+    frames.push('alpha', t, t - 100.)  # alpha equals seconds past 100
+    frames.push('hrv', [100.1, 100.6], [50., 60.])
+    joint = frames.pop()
+    assert joint['time'].tolist() == [100., 100.25, 100.5, 100.75, 101.]
+    np.testing.assert_allclose(joint['alpha'], [0., 0.25, 0.5, 0.75, 1.])
+    assert np.isnan(joint['hrv'][0])
+    assert joint['hrv'][1:].tolist() == [50., 50., 60., 60.]
+    assert len(frames.pop()['time']) == 0  # nothing new
+
+
+def test_frames_wait_for_late_eeg_up_to_the_lookahead():
+    frames = builder(lookahead=0.5)
+    frames.push('alpha', [100.], [1.])
+    frames.push('hrv', [100.1], [50.])
+    assert frames.pop(now=100.2)['time'].tolist() == [100.]
+    # no alpha after 100.0 yet: 100.25 is only given up on at 100.75
+    assert len(frames.pop(now=100.7)['time']) == 0
+    joint = frames.pop(now=100.8)
+    assert joint['time'].tolist() == [100.25]
+    assert joint['alpha'].tolist() == [1.] and joint['hrv'].tolist() == [50.]  # held
+
+
+def test_chunked_pushes_give_the_same_frames():
+    t = 200. + np.arange(100) * 0.1
+    alpha = np.sin(t)
+    beats = 200. + np.cumsum(np.full(9, 0.9))
+    whole = builder(lookahead=0.3)
+    whole.push('alpha', t, alpha)
+    whole.push('hrv', beats, np.arange(9.))
+    expected = whole.pop()
+
+    chunked = builder(lookahead=0.3)
+    got = []
+    for k in range(0, 100, 7):
+        chunked.push('alpha', t[k:k + 7], alpha[k:k + 7])
+        chunked.push('hrv', beats[beats <= t[min(k + 6, 99)]], np.arange(9.)[beats <= t[min(k + 6, 99)]])
+        got.append(chunked.pop())
+    for key in ('time', 'alpha', 'hrv'):
+        np.testing.assert_allclose(np.concatenate([g[key] for g in got]), expected[key])
+
+
+def test_max_age_marks_stalled_streams():
+    frames = JointFrameBuilder(period=0.5, lookahead=0.)
+    frames.add_stream('alpha', LINEAR, max_age=1.)
+    frames.push('alpha', [10., 10.5], [1., 2.])
+    joint = frames.pop(now=12.)
+    assert joint['time'].tolist() == [10., 10.5, 11., 11.5, 12.]
+    assert joint['alpha'][:4].tolist() == [1., 2., 2., 2.]  # 11.5 is just max_age after 10.5
+    assert np.isnan(joint['alpha'][4])
+
+
+def test_start_skips_the_pause_before_a_phase():
+    # the samples of a 120 s pause arrive in the first poll of the phase after it
+    frames = JointFrameBuilder(period=0.25, lookahead=0.5, start=1120.)
+    frames.add_stream('alpha', LINEAR)
+    frames.add_stream('hrv', HOLD, max_age=5.)
+    t = np.arange(1000., 1121., 0.1)
+    frames.push('alpha', t, np.ones(len(t)))
+    frames.push('hrv', 1000., 50.)  # the last beat was long ago
+    out = frames.pop(now=1121.)
+    assert out['time'].tolist() == [1120., 1120.25, 1120.5, 1120.75]
+    assert np.isnan(out['hrv']).all()  # too old to hold
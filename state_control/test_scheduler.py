@@ -0,0 +1,182 @@
+"""
+Tests for the state scheduler, and for the state machine running on it, run with
+pytest from the repository root
+"""
+import inspect
+import json
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from streams.notify import ChangeNotifier
+
+from . import state_control
+from .scheduler import Scheduler
+from .state_codes import BASELINE_CONFIRMATION, NO_EXPERIMENT, POST_EXPERIMENT
+from .state_control import ChangeYourBrainStateControl
+
+
+def test_periodic_ticks_do_not_drift():
+    s = Scheduler()
+    times = []
+
+    def tick():
+        times.append(time.monotonic())
+        time.sleep(0.004)  # work that would add up with sleep(period) between ticks
+        if len(times) == 40:
+            s.stop()
+
+    task = s.call_every(0.01, tick)
+    s.run()
+    late = np.asarray(times) - (task.start + 0.01 * np.arange(40))
+    assert late.min() >= 0
+    assert late[-10:].mean() < 0.005  # no worse at the end than any one tick
+    assert task.skipped == 0
+
+
+def test_order_cancel_and_post_from_another_thread():
+    s = Scheduler()
+    ran = []
+    s.call_later(0.03, ran.append, 'c')
+    s.call_later(0.01, ran.append, 'a')
+    s.call_later(0.02, ran.append, 'b')
+    s.call_later(0.015, ran.append, 'cancelled').cancel()
+    s.call_later(0.05, s.stop)
+    t = threading.Thread(target=lambda: (time.sleep(0.005), s.post(ran.append, 'posted')))
+    t.start()
+    s.run()
+    t.join()
+    assert ran == ['posted', 'a', 'b', 'c']
+    assert len(s) == 0
+
+
+def test_stop_before_run_is_not_lost():
+    s = Scheduler()
+    ran = []
+    s.call_later(0, ran.append, 'too late')
+    t = threading.Thread(target=s.run)
+    s.stop()  # e.g. a signal handler, before the thread got going
+    t.start()
+    t.join(1)
+    assert not t.is_alive()
+    assert ran == []
+
+
+class _Socket(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+class _Server(object):
+    def __init__(self):
+        self.ws = _Socket()
+
+
+class _EEG(object):
+    onForehead = True
+    curSensorState = [1, 1, 1, 1]
+
+    def is_on_forehead(self):
+        return True
+
+    def get_sec_since_last_forehead_trans(self):
+        return 0.  # never tags in by itself; the test tags in
+
+    def get_alpha_block(self):
+        now = time.time()
+        return {'value': np.array([0.5]), 'device_time': np.array([now]),
+                'ch1': [0.5], 'ch2': [0.5], 'ch3': [0.5], 'ch4': [0.5]}
+
+
+class _ECG(object):
+    def is_lead_on(self):
+        return True
+
+    def get_hrv(self):
+        return 50.
+
+    def get_hrv_t(self):
+        return time.time()
+
+    def get_rri(self):
+        return 800.
+
+
+def test_visitors_keep_stack_and_threads_flat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    monkeypatch.setattr(state_control, 'setup_inst_period', .001)
+    sc = ChangeYourBrainStateControl('test', _Server(), _EEG(), _ECG(), vis_period_sec=.001, baseline_sec=.003,
+                                     condition_sec=.003, baseline_inst_sec=.001, condition_inst_sec=.001,
+                                     keyboard=False)
+    visitors = 100
+    depths = set()
+    done = []
+
+    def keys():
+        depths.add(len(inspect.stack(0)))
+        sc.win_keyboard_input(97)  # confirm, then answer 1 to every question
+        if sc.experiment_state == POST_EXPERIMENT:
+            done.append(sc.condition_subj)
+            if len(done) == visitors:
+                sc.stop()
+            else:
+                sc.tag_in()
+
+    threads = threading.active_count()
+    sc.scheduler.call_every(.001, keys)
+    sc.scheduler.post(sc.tag_in)
+    sc.run()
+    assert done == [[1, 1, 1, 1]] * visitors
+    assert len(depths) == 1
+    assert threading.active_count() == threads
+    assert len(sc.scheduler) <= 4  # the lead and tag checks, keys and at most a last key posted: nothing piles up
+
+
+def test_confirmation_waits_time_out(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    monkeypatch.setattr(state_control, 'setup_inst_period', .001)
+    server = _Server()
+    sc = ChangeYourBrainStateControl('test', server, _EEG(), _ECG(), vis_period_sec=.001, baseline_sec=.003,
+                                     baseline_inst_sec=.001, keyboard=False, input_timeout_sec=.05)
+    seen = []
+
+    def watch():
+        if sc.experiment_state != (seen[-1] if seen else None):
+            seen.append(sc.experiment_state)
+        if sc.experiment_state == NO_EXPERIMENT and len(seen) > 1:
+            sc.stop()
+
+    sc.scheduler.call_every(.001, watch)
+    sc.scheduler.post(sc.tag_in)
+    sc.scheduler.call_later(5, sc.stop)
+    sc.run()
+    assert seen[-2:] == [BASELINE_CONFIRMATION, NO_EXPERIMENT]
+    assert sc.meta_data['value'][-1] == ('input_timeout', BASELINE_CONFIRMATION)
+    assert json.loads(server.ws.sent[-1])['message']['value']['instruction_name'] == 'RESET'
+    saved, = (tmp_path / 'data').glob('*_partial.pkl')
+    with open(str(saved), 'rb') as f:
+        session = pickle.load(f)
+    assert session['metadata']['value'][-1] == ('input_timeout', BASELINE_CONFIRMATION)
+    assert session['alpha baseline']['value']
+
+
+def test_lead_changes_are_pushed_not_polled():
+    eeg, ecg = _EEG(), _ECG()
+    eeg.contact_notifier, eeg.horseshoe_notifier = ChangeNotifier(0), ChangeNotifier(0)
+    ecg.lead_notifier = ChangeNotifier(0)
+    sc = ChangeYourBrainStateControl('test', _Server(), eeg, ecg, keyboard=False)
+    assert sc.lead_task is None
+    ecg.lead_notifier.update(True, 1700000005.)  # from the device thread
+    ecg.lead_notifier.update(False, 1700000006.)
+    eeg.horseshoe_notifier.update([1, 2, 1, 1], 1700000006.5)
+    sc.scheduler.post(sc.stop)
+    sc.run()
+    assert (sc.eeg_leadon, sc.ecg_leadon, sc.eegSensorState) == (True, False, [1, 2, 1, 1])
+    assert list(zip(sc.meta_data['time'], sc.meta_data['value']))[-1] == (1700000006., ('ecg_leadon', False))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Debounced change notifications
+
+A device reader calls ChangeNotifier.update(value, device_time) with every reading
+of some state (Muse forehead contact, horseshoe, CardioChip lead off); subscribers
+are called with (value, device_time) when it changes, instead of comparing it on
+every poll:
+
+    notifier = ChangeNotifier(debounce=.5)
+    notifier.subscribe(lambda on, t: print("lead", on, "at", t))
+    notifier.update(True, t)  # from the reader thread
+
+A change is passed on straight away, unless the last one was less than debounce
+seconds (device time) before it; then it is held, and passed on with the next
+reading after the debounce window if the value has not gone back in the meantime.
+So a contact that chatters makes one notification per window, not one per packet,
+and device_time is always when the reported value was first seen.
+
+Callbacks run in the reader's thread, one at a time and in order: they should only
+hand the change on (the state control posts it to its scheduler).
+"""
+
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class ChangeNotifier(object):
+    """ calls subscribers with (value, device_time) when the value updated into it changes """
+
+    def __init__(self, debounce=0.5):
+        self.debounce = debounce
+        self.value = None  # the last value passed on
+        self.time = None  # and the device time of its change
+        self.changes = 0
+        self._pending = None  # (value, device time first seen) of a change held back
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._listeners.remove(callback)
+
+    def update(self, value, device_time):
+        with self._lock:
+            if value == self.value:
+                self._pending = None  # it went back before the window was over
+                return
+            if self._pending is None or self._pending[0] != value:
+                self._pending = (value, device_time)
+            if self.time is not None and device_time - self.time < self.debounce:
+                return
+            value, device_time = self._pending
+            self._pending = None
+            self.value = value
+            self.time = device_time
+            self.changes += 1
+            for callback in self._listeners:
+                try:
+                    callback(value, device_time)
+                except Exception:
+                    log.exception("change listener %s failed", callback)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Shared memory sample stream
+
+SharedRing is a single producer / multi consumer ring buffer living in a
+multiprocessing.shared_memory block, so a device reader in one process can feed
+the state control, recorders and visualizations in others without pickling or
+copying the samples. Each column (timestamp, ecg_raw, ch1, ...) is a contiguous
+typed array, and every row has a sequence number: the count of rows written
+before it.
+
+The producer never waits for the consumers. It writes rows, then publishes the
+new row count; a consumer that falls more than a ring's worth behind loses the
+oldest rows and is told how many. Consumers keep their own read position in a
+RingReader and get NumPy views straight into the shared block:
+
+    # producer process
+    ring = SharedRing(ECG_COLUMNS, capacity=512 * 60, name='booth-7-ecg')
+    ring.write(timestamp=ts, ecg_raw=raw, leadoff=lead)
+
+    # any number of consumer processes
+    reader = RingReader(SharedRing(name='booth-7-ecg'))
+    for seq, cols in reader.views():
+        process(cols['timestamp'], cols['ecg_raw'])  # views, no copy
+    if not reader.valid(seq):
+        ...  # the producer overwrote the rows while they were being used
+
+The column layout is stored in the block itself, so consumers only need the name.
+Only the producer owns the block: attaching does not register it with the
+consumer's multiprocessing resource tracker, which would unlink it from under the
+producer when the consumer exits.
+"""
+
+import json
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = b'CYBRING1'
+HEADER_SIZE = 4096  # magic, layout json, write position; the columns start after it
+_ALIGN = 64
+
+# column layouts of the streams the booth produces
+ECG_COLUMNS = [('timestamp', 'f8'), ('ecg_raw', 'i2'), ('leadoff', 'u1')]
+EEG_BAND_COLUMNS = [('timestamp', 'f8'), ('host_time', 'f8'),
+                    ('ch1', 'f4'), ('ch2', 'f4'), ('ch3', 'f4'), ('ch4', 'f4')]
+
+
+def _attach(name):
+    """ open the existing block called name, without taking ownership of it """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # before 3.13 SharedMemory registers every block it opens on POSIX, and the
+    # tracker of a process that was not forked from the producer unlinks it at exit
+    register = resource_tracker.register
+
+    def register_all_but_shared_memory(rname, rtype):
+        if rtype != "shared_memory":
+            register(rname, rtype)
+
+    resource_tracker.register = register_all_but_shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedRing(object):
+    """
+    A ring of capacity rows with the given columns, a list of (name, dtype) pairs.
+    With columns given a new block is created (named name, or a random name, see
+    .name); without, the existing block called name is attached to.
+    """
+
+    def __init__(self, columns=None, capacity=512 * 60, name=None):
+        self.creator = columns is not None
+        if self.creator:
+            layout = {'capacity': int(capacity), 'columns': [(n, np.dtype(t).str) for n, t in columns]}
+            meta = json.dumps(layout).encode()
+            if 28 + len(meta) > HEADER_SIZE:
+                raise ValueError("too many columns for the ring header")
+            size = HEADER_SIZE + sum(self._column_size(np.dtype(t), capacity) for _n, t in columns)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            buf = self.shm.buf
+            buf[:len(MAGIC)] = MAGIC
+            np.ndarray(1, dtype='<u4', buffer=buf, offset=24)[0] = len(meta)
+            buf[28:28 + len(meta)] = meta
+        else:
+            self.shm = _attach(name)
+            buf = self.shm.buf
+            if bytes(buf[:len(MAGIC)]) != MAGIC:
+                raise ValueError("shared memory block {} is not a SharedRing".format(name))
+            n = int(np.ndarray(1, dtype='<u4', buffer=buf, offset=24)[0])
+            layout = json.loads(bytes(buf[28:28 + n]).decode())
+        self.name = self.shm.name
+        self.capacity = layout['capacity']
+        self.dtype = np.dtype([(n, t) for n, t in layout['columns']])
+        # rows written so far, i.e. the sequence number of the next row
+        self._written = np.ndarray(1, dtype='<u8', buffer=buf, offset=8)
+        # rows written once the write in progress is done; rows older than this
+        # less capacity may be getting overwritten right now
+        self._reserved = np.ndarray(1, dtype='<u8', buffer=buf, offset=16)
+        self.columns = {}
+        offset = HEADER_SIZE
+        for col, t in layout['columns']:
+            t = np.dtype(t)
+            self.columns[col] = np.ndarray(self.capacity, dtype=t, buffer=buf, offset=offset)
+            offset += self._column_size(t, self.capacity)
+        if self.creator:
+            self._written[0] = self._reserved[0] = 0
+
+    @staticmethod
+    def _column_size(dtype, capacity):
+        return -(-dtype.itemsize * capacity // _ALIGN) * _ALIGN
+
+    @property
+    def written(self):
+        """ total rows written; the next row gets this sequence number """
+        return int(self._written[0])
+
+    @property
+    def reserved(self):
+        return int(self._reserved[0])
+
+    def write(self, **columns):
+        """
+        producer only: append rows, one array per column; a scalar fills its column
+        (or makes a single row, if every column is given as a scalar), and columns
+        left out are written as zeros
+        """
+        arrays = {k: np.asarray(v) for k, v in columns.items()}
+        unknown = set(arrays) - set(self.columns)
+        if unknown:
+            raise KeyError("no such column: {}".format(', '.join(sorted(unknown))))
+        lengths = [len(v) for v in arrays.values() if v.ndim]
+        n = lengths[0] if lengths else (1 if arrays else 0)
+        if n == 0:
+            return self.written
+        start = self.written
+        if n > self.capacity:
+            # only the newest capacity rows can be kept
+            arrays = {k: v[-self.capacity:] if v.ndim else v for k, v in arrays.items()}
+            start += n - self.capacity
+        m = min(n, self.capacity)
+        self._reserved[0] = self.written + n  # announce which rows are about to be overwritten
+        first = start % self.capacity
+        split = min(m, self.capacity - first)
+        for name, column in self.columns.items():
+            values = arrays.get(name, 0)
+            if np.ndim(values):
+                column[first:first + split] = values[:split]
+                column[:m - split] = values[split:]
+            else:
+                column[first:first + split] = values
+                column[:m - split] = values
+        self._written[0] = self.written + n  # publish only after the rows are in place
+        return self.written
+
+    def close(self):
+        """ detach from the block """
+        self.columns = {}
+        self._written = self._reserved = None
+        self.shm.close()
+
+    def unlink(self):
+        """ free the block, from the producer once everyone is done """
+        self.shm.unlink()
+
+
+class RingReader(object):
+    """
+    One consumer's position in a SharedRing, starting at the rows written from now
+    on (start='now'), or at the oldest row still held (start='oldest').
+    lost counts rows that were overwritten before this reader got to them.
+    """
+
+    def __init__(self, ring, start='now'):
+        self.ring = ring
+        self.lost = 0
+        written = ring.written
+        self.next_seq = written if start == 'now' else max(0, written - ring.capacity)
+
+    def available(self):
+        return self.ring.written - self.next_seq
+
+    def views(self, max_rows=None):
+        """
+        consume the rows written since the last call, returned as up to two
+        (first sequence number, {column: view}) segments, two when they wrap around
+        the end of the ring. The views point into shared memory: use them before the
+        producer comes round again, and check with valid() if that might have happened.
+        """
+        ring = self.ring
+        written = ring.written
+        oldest = ring.reserved - ring.capacity  # rows before this are gone or going
+        if self.next_seq < oldest:
+            self.lost += oldest - self.next_seq
+            self.next_seq = oldest
+        end = written if max_rows is None else min(written, self.next_seq + max_rows)
+        segments = []
+        seq = self.next_seq
+        while seq < end:
+            first = seq % ring.capacity
+            n = min(end - seq, ring.capacity - first)
+            segments.append((seq, {k: c[first:first + n] for k, c in ring.columns.items()}))
+            seq += n
+        self.next_seq = end
+        return segments
+
+    def read(self, max_rows=None):
+        """ consume the new rows as one structured array copy, safe to keep """
+        segments = self.views(max_rows)
+        n = sum(len(next(iter(cols.values()))) for _seq, cols in segments) if segments else 0
+        out = np.empty(n, dtype=self.ring.dtype)
+        i = 0
+        for seq, cols in segments:
+            k = len(next(iter(cols.values())))
+            for name, view in cols.items():
+                out[name][i:i + k] = view
+            i += k
+        if segments and not self.valid(segments[0][0]):
+            # the producer came round while copying; drop the rows it may have touched
+            overwritten = min(n, self.ring.reserved - self.ring.capacity - segments[0][0])
+            self.lost += overwritten
+            out = out[overwritten:]
+        return out
+
+    def valid(self, seq):
+        """ True if the row with sequence number seq has not been (and is not being) overwritten """
+        return seq >= self.ring.reserved - self.ring.capacity
+
+    def latest(self, n):
+        """ views of the newest n rows (at most two segments), without consuming anything """
+        ring = self.ring
+        written = ring.written
+        n = min(n, written, ring.capacity)
+        segments = []
+        seq = written - n
+        while seq < written:
+            first = seq % ring.capacity
+            k = min(written - seq, ring.capacity - first)
+            segments.append((seq, {c: col[first:first + k] for c, col in ring.columns.items()}))
+            seq += k
+        return segments
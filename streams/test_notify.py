@@ -0,0 +1,18 @@
+"""
+Tests for the debounced change notifications, run with pytest from the repository root
+"""
+from .notify import ChangeNotifier
+
+
+def test_changes_are_debounced_and_keep_their_device_time():
+    notifier = ChangeNotifier(debounce=1.)
+    seen = []
+    notifier.subscribe(lambda value, t: seen.append((value, t)))
+    readings = [(False, 0.), (False, .5), (True, .6),  # on, but too soon after the first report
+                (True, .9), (True, 1.2),  # held on through the window: reported as of .6
+                (False, 1.3), (True, 1.4),  # a blip, gone again within the window
+                (True, 3.), (False, 3.1)]
+    for value, t in readings:
+        notifier.update(value, t)
+    assert seen == [(False, 0.), (True, .6), (False, 3.1)]
+    assert notifier.changes == 3
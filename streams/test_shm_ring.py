@@ -0,0 +1,84 @@
+"""
+Tests for the shared memory ring buffer, run with pytest from the repository root
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from .shm_ring import SharedRing, RingReader, ECG_COLUMNS
+
+
+def _produce(name, total, chunk):
+    ring = SharedRing(name=name)
+    for start in range(0, total, chunk):
+        seq = np.arange(start, min(start + chunk, total))
+        ring.write(timestamp=seq / 512., ecg_raw=(seq % 30000).astype(np.int16), leadoff=200)
+    ring.close()
+
+
+def test_readers_see_every_row_with_its_sequence_number():
+    ring = SharedRing(ECG_COLUMNS, capacity=1000)
+    try:
+        fast, slow = RingReader(ring), RingReader(SharedRing(name=ring.name))
+        rows = []
+        for start in range(0, 3000, 70):
+            seq = np.arange(start, start + 70)
+            ring.write(timestamp=seq / 512., ecg_raw=seq.astype(np.int16), leadoff=200)
+            for first, cols in fast.views():
+                assert np.array_equal(cols['ecg_raw'], np.arange(first, first + len(cols['ecg_raw'])))
+                rows.append(cols['timestamp'].copy())
+        assert np.array_equal(np.concatenate(rows) * 512., np.arange(3010))
+        assert fast.lost == 0
+        # the slow reader only comes back at the end; the oldest rows are gone
+        out = slow.read()
+        assert slow.lost == 3010 - 1000
+        assert out['ecg_raw'].tolist() == list(range(2010, 3010))
+        assert (out['leadoff'] == 200).all()
+        slow.ring.close()
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_views_are_zero_copy_and_readers_in_another_process_get_a_producers_rows():
+    ring = SharedRing(ECG_COLUMNS, capacity=512 * 4)
+    try:
+        reader = RingReader(ring, start='oldest')
+        producer = multiprocessing.Process(target=_produce, args=(ring.name, 512 * 3, 100))
+        producer.start()
+        producer.join()
+        segments = reader.views()
+        assert len(segments) == 1
+        seq, cols = segments[0]
+        assert np.shares_memory(cols['ecg_raw'], ring.columns['ecg_raw'])
+        assert seq == 0 and len(cols['timestamp']) == 512 * 3
+        assert reader.valid(seq)
+        assert RingReader(ring).latest(2)[0][1]['ecg_raw'].tolist() == [1534, 1535]
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_a_consumer_started_on_its_own_leaves_the_block_to_the_producer():
+    ring = SharedRing(ECG_COLUMNS, capacity=100)
+    try:
+        ring.write(timestamp=np.arange(10) / 512., ecg_raw=np.arange(10, dtype=np.int16), leadoff=200)
+        consumer = ("from streams.shm_ring import SharedRing, RingReader\n"
+                    "ring = SharedRing(name={!r})\n"
+                    "print(RingReader(ring, start='oldest').read()['ecg_raw'].sum())\n"
+                    "ring.close()\n").format(ring.name)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        done = subprocess.run([sys.executable, "-c", consumer], cwd=root, capture_output=True, text=True,
+                              timeout=60)
+        assert done.returncode == 0, done.stderr
+        assert done.stdout.strip() == "45"
+        assert "leaked" not in done.stderr
+        again = SharedRing(name=ring.name)  # still there after the consumer's exit
+        assert again.written == 10
+        again.close()
+    finally:
+        ring.close()
+        ring.unlink()
@@ -0,0 +1,44 @@
+"""
+Tests for the queued, rate limited logging setup, run with pytest from the repository root
+"""
+import io
+import logging
+
+import logconfig
+
+
+class _Unformattable(object):
+    def __str__(self):
+        raise AssertionError("a disabled record was formatted")
+
+
+def test_rate_limit_and_deferred_formatting():
+    out = io.StringIO()
+    logconfig.setup_logging(logging.INFO, rate_limit=60., stream=out, levels={'test_logconfig.hot': logging.DEBUG})
+    try:
+        logging.getLogger('test_logconfig.quiet').debug("%s", _Unformattable())
+        hot = logging.getLogger('test_logconfig.hot')
+        for i in range(100):
+            hot.debug("packet %i", i)
+        hot.warning("lost %i", 1)
+        hot.warning("lost %i", 2)
+        state = logging.getLogger('test_logconfig.state')
+        state.info("setting state to %s", 'A')
+        state.info("setting state to %s", 'B')  # never held back
+        hot.warning("checksum error %i", 1, extra=logconfig.RATE_LIMITED)
+        hot.warning("checksum error %i", 2, extra=logconfig.RATE_LIMITED)
+    finally:
+        logconfig._stop_listener()
+        logging.getLogger('test_logconfig.hot').setLevel(logging.NOTSET)
+    lines = out.getvalue().splitlines()
+    assert [line.split(': ', 1)[1] for line in lines] == ["packet 0", "lost 1", "lost 2", "setting state to A",
+                                                                "setting state to B", "checksum error 1"]
+
+
+def test_suppressed_count_is_reported():
+    f = logconfig.RateLimitFilter(interval=60.)
+    records = [logging.LogRecord('a', logging.DEBUG, __file__, 1, "tick %i", (i,), None) for i in range(5)]
+    assert [f.filter(r) for r in records] == [True, False, False, False, False]
+    f._last[('a', "tick %i")][0] -= 61.  # as if the interval had passed
+    assert f.filter(records[0])
+    assert records[0].suppressed == 4
@@ -0,0 +1,89 @@
+"""
+Tests for the ECG sources in main.py, run with pytest from the repository root
+"""
+import logging
+
+import numpy as np
+
+import main
+from ecg.cardiochip import SAMPLE_DTYPE
+from streams.notify import ChangeNotifier
+
+
+def test_ecg_process_reports_and_restarts_a_dead_child(caplog):
+    ecg = main.ecg_process(port="/dev/no-such-cardiochip", max_restarts=1)
+    try:
+        with caplog.at_level(logging.ERROR, logger="main"):
+            ecg.start()
+            ecg.process.join(10)  # cannot open the port: exits straight away
+            assert ecg.process.exitcode == 1
+            ecg.is_lead_on()  # notices, and starts it again
+            assert ecg.restarts == 1
+            ecg.process.join(10)
+            assert ecg.get_hrv() == -1 and not ecg.is_lead_on()
+            assert ecg.failed and not ecg.alive()
+        messages = [r.getMessage() for r in caplog.records]
+        assert sum("died with exit code 1" in m for m in messages) == 2
+        assert "giving up" in messages[-1]
+    finally:
+        ecg.stop()
+
+
+class FakeNeuroskyECG(object):
+    """ stands in for an open NeuroskyECG: a beat every 100 samples, with HRV 40 + its index """
+    Fs = 512
+    filter_delay = 0
+
+    def __init__(self):
+        self.lead_notifier = ChangeNotifier(0)
+        self.analyzed = []  # lengths of the blocks handed to analyze_block
+        self.resets = 0
+        self.rri_count = 0
+
+    def setHRVUpdate(self, n):
+        pass
+
+    def getTotalNumRRI(self):
+        return self.rri_count
+
+    def ecgResetAlgLib(self):
+        self.resets += 1
+        self.rri_count = 0
+
+    def analyze_block(self, raw):
+        self.analyzed.append(len(raw))
+        peaks = [(i, 800, 75, 40 + i) for i in range(0, len(raw), 100)]
+        self.rri_count += len(peaks)
+        return np.zeros(len(raw)), peaks
+
+
+def samples(n, leadoff, t0):
+    out = np.zeros(n, dtype=SAMPLE_DTYPE)
+    out['timestamp'] = t0 + np.arange(n) / 512.
+    out['leadoff'] = leadoff
+    return out
+
+
+def test_process_samples_drops_lead_off_past_the_timeout_across_batches():
+    nsk = FakeNeuroskyECG()
+    ecg = main.ecg_real(nskECG=nsk)
+    ecg.LEAD_TIMEOUT = 1  # 512 samples
+    count = ecg._process_samples(samples(300, 0, 1000.), 0)
+    assert count == 300 and nsk.analyzed == [300] and nsk.resets == 0
+    count = ecg._process_samples(samples(300, 0, 1001.), count)  # 213th sample is past the timeout
+    assert count == 600 and nsk.analyzed == [300, 212] and nsk.resets == 1
+    count = ecg._process_samples(samples(300, 0, 1002.), count)  # all dropped, nothing left to reset
+    assert count == 900 and nsk.analyzed == [300, 212] and nsk.resets == 1
+    assert not ecg.is_lead_on()
+    count = ecg._process_samples(np.concatenate([samples(10, 0, 1003.), samples(290, 200, 1003.1)]), count)
+    assert count == 0 and nsk.analyzed == [300, 212, 290] and ecg.is_lead_on()
+
+
+def test_process_samples_times_the_hrv_by_its_beat():
+    nsk = FakeNeuroskyECG()
+    ecg = main.ecg_real(nskECG=nsk)
+    ecg.cur_hrv = ecg.cur_hrv_t = None
+    ecg._process_samples(samples(250, 200, 1000.), 0)
+    assert ecg.get_hrv() == 40 + 200  # the last beat, 200 samples in
+    assert ecg.get_hrv_t() == 1000. + 200 / 512.
+    assert ecg.get_rri() == 800